@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for classifying crawled URLs, i.e. finding the config for a page's domain and checking whether the
+page's URL should be stored. Compares the compiled matchers and domain index against the old approach of searching
+config.DOMAINS and compiling each URL pattern on every call.
+
+Usage: python -m benchmarks.url_classification [domain count] [URL count]
+"""
+import random
+import re
+import sys
+from timeit import timeit
+from typing import List, Optional
+
+import config
+from webweeder import configutils
+from webweeder.domainconfig import DomainConfig, SimpleDomainConfig
+
+
+def _make_domains(count: int) -> List[DomainConfig]:
+    domains: List[DomainConfig] = []
+    for i in range(count):
+        name = 'site%d.com' % i
+        domains.append(SimpleDomainConfig(name=name,
+                                          url_patterns=[r'^https?://(www\.)?%s/[0-9]{4}/[0-9]{2}/[0-9]{2}/[^/]+/?$'
+                                                        % re.escape(name),
+                                                        r'^https?://(www\.)?%s/[0-9]{4}/[0-9]{2}/[^/]+(?<!/[0-9]{2})/?$'
+                                                        % re.escape(name)],
+                                          seed_urls=[],
+                                          article_date_junk=[r'^.*?on\s']))
+    return domains
+
+
+def _make_urls(domains: List[DomainConfig], count: int) -> List[str]:
+    rng = random.Random(0)
+    urls: List[str] = []
+    for i in range(count):
+        name = rng.choice(domains).name
+        shape = rng.randrange(3)
+        if shape == 0:
+            urls.append('https://%s/2017/01/%02d/some-article-%d/' % (name, rng.randrange(1, 29), i))
+        elif shape == 1:
+            urls.append('https://www.%s/2017/01/another-article-%d' % (name, i))
+        else:
+            urls.append('https://%s/tag/something-%d/' % (name, i))
+    return urls
+
+
+def _classify_uncompiled(urls: List[str]):
+    """
+    How URLs were classified before domain configs were compiled
+    """
+    for url in urls:
+        name = url.split('/')[2].replace('www.', '')
+        domain: Optional[DomainConfig] = None
+        for domain_config in config.DOMAINS:
+            if domain_config.name == name:
+                domain = domain_config
+                break
+        for pattern in domain.url_patterns:
+            if re.compile(pattern).match(url) is not None:
+                break
+
+
+def _classify_compiled(urls: List[str]):
+    for url in urls:
+        name = url.split('/')[2].replace('www.', '')
+        configutils.get_config_for_domain(name).includes_url(url)
+
+
+def main():
+    domain_count = int(sys.argv[1]) if (len(sys.argv) > 1) else 500
+    url_count = int(sys.argv[2]) if (len(sys.argv) > 2) else 20000
+
+    config.DOMAINS = _make_domains(domain_count)
+    urls = _make_urls(config.DOMAINS, url_count)
+
+    print('Classifying %d URLs across %d domains' % (url_count, domain_count))
+    for (label, func) in [('uncompiled', _classify_uncompiled), ('compiled', _classify_compiled)]:
+        elapsed = min(timeit(lambda: func(urls), number=1) for _ in range(3))
+        print('  %-10s %8.2f us/URL' % (label, (elapsed / url_count) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
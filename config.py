@@ -1,13 +1,12 @@
 import os
 from datetime import date
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from webweeder.domainconfig import DomainConfig, SimpleDomainConfig
-from webweeder.utils import date_range
+from webweeder.domainconfig import DomainConfig, SimpleDomainConfig, daily_seed_urls
+from webweeder.utils import MEGABYTES
 
+# The earliest date worth seeding when crawling
 _START_DATE = date(2013, 1, 1)
-_END_DATE = date.today()
-_DATES: List[date] = [d for d in reversed(date_range(_START_DATE, _END_DATE))]
 
 # Can be overridden with command-line arguments, otherwise this is the default value
 OUTPUT_DIRECTORY = os.path.join('out')
@@ -15,17 +14,199 @@ OUTPUT_DIRECTORY = os.path.join('out')
 # Can be overridden with command-line arguments, otherwise this is the default value
 USER_AGENT = 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)'
 
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How pages are stored: "directory" stores each page in its own directory, "segments" appends pages to large compressed
+# segment files, which is much kinder to the file system for big crawls
+STORAGE_BACKEND = 'directory'
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How raw HTML and plaintext files are compressed: "none", "gzip" or "zstd" (falls back to gzip if the "zstandard"
+# package isn't installed). Compressed files are always read transparently, regardless of this setting
+COMPRESSION = 'none'
+
+# Set to True to write each page's metadata file as compact JSON rather than indented JSON, which is smaller and quicker
+# to read but harder for humans to read. Both are always readable, regardless of this setting
+COMPACT_METADATA = False
+
+# Segment files which grow past this size (in bytes) are closed and a new segment is started
+SEGMENT_MAX_BYTES = (256 * MEGABYTES)
+
+# Where "webweed --export" writes the corpus, relative to the output directory. Any previous export there is replaced
+EXPORT_DIRECTORY_NAME = 'export'
+
+# How many articles are written to each shard of an export before a new shard is started
+EXPORT_SHARD_ROWS = 50000
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to also export the corpus as Parquet files, alongside the JSON Lines files (requires the "pyarrow"
+# package)
+EXPORT_PARQUET = False
+
+# Where "webweed --analyze" keeps its term-document matrix and term counts, relative to the output directory. New
+# articles are added to whatever is already there, and articles whose plaintext has changed replace their old counts
+ANALYSIS_DIRECTORY_NAME = 'analysis'
+
+# How many articles "webweed --analyze" counts at once. Bigger batches are quicker but use more memory
+ANALYSIS_BATCH_SIZE = 10000
+
+# Regex matching each term of an article, which is matched against the article in lowercase. By default, a term is a
+# word made of letters, optionally with apostrophes inside it (eg. "don't")
+ANALYSIS_TOKEN_PATTERN = r"[^\W\d_]+(?:['\u2019][^\W\d_]+)*"
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to persist each spider's scheduler and seen requests in the output directory, so an interrupted crawl can
+# carry on where it left off
+RESUMABLE_CRAWL = False
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to avoid crawling pages which have already been stored (according to the catalog) again
+INCREMENTAL_CRAWL = False
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# When crawling incrementally, stored pages older than this many days are crawled again (using a conditional request,
+# so unchanged pages aren't downloaded again), or -1 to never crawl stored pages again
+REFETCH_MAX_AGE = -1
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Only seed pages for dates on or after this date, or None to seed since the last successful crawl of each domain (or
+# since the very start if the domain has never been crawled successfully)
+CRAWL_SINCE: Optional[date] = None
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Only seed pages for dates before this date, or None to seed up to and including today
+CRAWL_UNTIL: Optional[date] = None
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to discover articles using the sitemaps of domains which have them, rather than by crawling from their
+# seed URLs. Only articles which are new or have changed since they were stored are crawled
+SITEMAP_DISCOVERY = False
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to crawl every domain with a single spider rather than one spider per domain, which balances concurrency
+# across domains and has less overhead when crawling many domains at once
+SINGLE_SPIDER = False
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How requests which have already been made are remembered: "memory" keeps every request's fingerprint in memory,
+# "bloom" keeps them in a fixed-size Bloom filter (saved in the job directory of resumable crawls), so memory usage
+# stays flat however many URLs are crawled, at the cost of very occasionally skipping a URL which hasn't been crawled
+DUPEFILTER = 'memory'
+
+# How many URLs each domain is expected to crawl (unless overridden for the domain), which determines the size of its
+# Bloom filter when DUPEFILTER is "bloom", and how often a URL which hasn't been crawled is mistaken for one which has
+DUPEFILTER_CAPACITY = 10_000_000
+DUPEFILTER_ERROR_RATE = 0.0001
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to avoid storing pages which are copies of pages which have already been stored, either because their
+# canonical URLs are the same (eg. they only differ by "www." or a tracking query parameter) or because their articles
+# are identical. Duplicates are recorded in the catalog as references to the first stored copy instead, so their raw
+# HTML is never written to the output directory. Off by default, so every page which is crawled is stored
+DEDUPLICATE_PAGES = False
+
+# Regular expressions matching the names of query parameters which are only used for tracking, so are ignored when
+# comparing URLs to find duplicate pages
+TRACKING_QUERY_PARAMETERS = [r'utm_.*', r'fbclid', r'gclid', r'dclid', r'msclkid', r'mc_cid', r'mc_eid', r'_ga',
+                             r'igshid', r'yclid']
+
+# Where resumable crawls keep their state, relative to the output directory
+JOBS_DIRECTORY_NAME = 'jobs'
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to extract the plaintext of each article while crawling, which makes running "webweed" afterwards optional
+EXTRACT_ON_CRAWL = False
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to parse and store crawled pages in a pool of worker threads, so downloads can carry on in the meantime
+OFFLOAD_PROCESSING = False
+
+# How many worker threads parse and store crawled pages when OFFLOAD_PROCESSING is set
+PROCESSING_THREADS = 4
+
+# How many crawled pages can be handed to the worker threads at once when OFFLOAD_PROCESSING is set. Once this many are
+# waiting, downloading slows down until the worker threads catch up
+PROCESSING_QUEUE_SIZE = 32
+
+# Name of the SQLite catalog which indexes every stored page, kept at the top of the output directory
+CATALOG_FILE_NAME = 'catalog.sqlite3'
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How many worker processes "webcrawl" should crawl with. Domains are shared out between the workers, and if there are
+# more workers than domains, the seed URLs of each domain are shared out too
+CRAWL_WORKERS = 1
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How many requests can be downloaded at once, across all domains (per spider)
+CONCURRENT_REQUESTS = 16
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How many requests can be downloaded from a single domain at once. Can be overridden for each domain
+CONCURRENT_REQUESTS_PER_DOMAIN = 8
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How long to wait (in seconds) between consecutive requests to the same domain. Can be overridden for each domain
+DOWNLOAD_DELAY = 0.0
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How long to wait (in seconds) for a page to download before giving up. Can be overridden for each domain
+DOWNLOAD_TIMEOUT = 60.0
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How many times to retry a request which failed (eg. timed out) before giving up. Can be overridden for each domain
+RETRY_TIMES = 2
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to adapt the delay between requests to each domain to how quickly it responds, so fast domains are
+# crawled at full speed while slow domains are given some breathing room. The delay never drops below DOWNLOAD_DELAY
+AUTOTHROTTLE = False
+
+# When AUTOTHROTTLE is set, how many requests should be in-flight to each domain at once on average. The delay starts
+# at AUTOTHROTTLE_START_DELAY and is never raised above AUTOTHROTTLE_MAX_DELAY (both in seconds)
+AUTOTHROTTLE_TARGET_CONCURRENCY = 2.0
+AUTOTHROTTLE_START_DELAY = 1.0
+AUTOTHROTTLE_MAX_DELAY = 30.0
+
+# How many hostnames to cache the IP addresses of, and how long to wait (in seconds) for a DNS lookup before giving up
+DNS_CACHE_SIZE = 10000
+DNS_TIMEOUT = 20.0
+
 # Can be overridden with command-line arguments, otherwise this is the default value
 # How often to log statistics (in seconds), or -1 to disable
 STATS_INTERVAL = 10
 
+# Names of the files in the log directory which crawl metrics are written to every STATS_INTERVAL seconds: JSON lines
+# which are appended to, and a Prometheus text file which is replaced each time (eg. for node_exporter's textfile
+# collector). Set either to None to not write it
+METRICS_JSON_FILE_NAME = 'metrics.jsonl'
+METRICS_PROMETHEUS_FILE_NAME = 'metrics.prom'
+
+# Upper bounds (in seconds) of the buckets of the histogram of how long downloads take
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
 # Can be overridden with command-line arguments, otherwise this is the default value
-# Determines which parser BeautifulSoup4 will use to parse documents
+# Determines which parser BeautifulSoup4 will use to parse documents, or "lxml-fast" to use lxml directly
 HTML_PARSER = 'lxml'
 
+# Can be overridden with command-line arguments, otherwise this is the default value
+# How many worker processes "webweed" should use to weed pages in parallel
+WEED_JOBS = 1
+
 # Can be overridden with command-line arguments, otherwise this is the default value
 LOG_LEVEL = 'INFO'
 
+# Can be overridden with command-line arguments, otherwise this is the default value
+# Set to True to time each stage of processing every page (reading, parsing, stripping, selecting, writing, etc.), and
+# log a summary of the timings for each domain once crawling or weeding finishes
+PROFILE = False
+
+# Can be overridden with command-line arguments, otherwise this is the default value
+# When profiling, also profile every page with cProfile and keep the output of this many of the slowest pages, or 0 to
+# not use cProfile (which slows processing down)
+PROFILE_SLOWEST = 0
+
+# Where the cProfile output of the slowest pages is written, relative to the log directory
+PROFILE_DIRECTORY_NAME = 'profiles'
+
 # Can be overridden with command-line arguments, otherwise this is the default value
 # Determines where log files are stored
 LOG_DIRECTORY = os.path.join('logs')
@@ -33,13 +214,23 @@ LOG_DIRECTORY = os.path.join('logs')
 # The settings given to Scrapy for crawling. Must be set by CLI on program start
 SCRAPY_SETTINGS: Dict[str, object] = None
 
+# Which part of each domain is crawled by this process, and how many parts the domain is split into between worker
+# processes. Set by CLI in worker processes, for domains which are split between several of them
+SEED_PARTITIONS: Dict[str, Tuple[int, int]] = {}
+
 DOMAINS: List[DomainConfig] = [
     SimpleDomainConfig(name='altright.com',
                        url_patterns=[r'^https?://(www\.)?altright.com/[0-9]{4}/[0-9]{2}/[0-9]{2}/[^/]+/?$'],
                        # Seed with each daily summary page
-                       seed_urls=['https://altright.com/%04d/%02d/%02d/' % (d.year, d.month, d.day) for d in _DATES],
+                       seed_urls=[],
+                       seed_url_generator=daily_seed_urls('https://altright.com/%04d/%02d/%02d/', _START_DATE),
+                       sitemap_urls=['https://altright.com/sitemap.xml'],
+                       # Only follow daily summary pages and their pagination to find articles
+                       follow_patterns=[r'^https?://(www\.)?altright.com/[0-9]{4}/[0-9]{2}/[0-9]{2}/(page/[0-9]+/?)?$'],
                        article_title_selector='h3.post-title',
                        article_date_selector='.post-meta div.date > a',
+                       # Eg. "January 3, 2017", anything else is left for dateutil to figure out
+                       article_date_formats=['%B %d, %Y'],
                        article_content_selector='div.article-content'),
     SimpleDomainConfig(name='clashdaily.com',
                        # If you're here because this RegEx is broken, the best thing to do is delete all traces of the
@@ -55,12 +246,19 @@ DOMAINS: List[DomainConfig] = [
                        #
                        url_patterns=[r'^https?://(www\.)?clashdaily.com/[0-9]{4}/[0-9]{2}/[^/]+(?<!/[0-9]{2})/?$'],
                        # Seed with each daily summary page
-                       seed_urls=['https://clashdaily.com/%04d/%02d/%02d/' % (d.year, d.month, d.day) for d in _DATES],
+                       seed_urls=[],
+                       seed_url_generator=daily_seed_urls('https://clashdaily.com/%04d/%02d/%02d/', _START_DATE),
+                       sitemap_urls=['https://clashdaily.com/sitemap.xml'],
+                       # Only follow daily summary pages and their pagination to find articles
+                       follow_patterns=[
+                           r'^https?://(www\.)?clashdaily.com/[0-9]{4}/[0-9]{2}/[0-9]{2}/(page/[0-9]+/?)?$'
+                       ],
                        article_title_selector='h1.wpdev-single-title',
                        article_date_selector='span.wpdev-article-date',
                        # Formats seen in the wild:
                        # - "Published on {Date}"
                        # - "Written by {Firstname} {Lastname} on {Date}"
                        article_date_junk=[r'^.*?on\s'],
+                       article_date_formats=['%B %d, %Y'],
                        article_content_selector='div.wpdev-entry-content')
 ]
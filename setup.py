@@ -15,16 +15,26 @@ setup(
         'beautifulsoup4',
         'bs4',
         'click',
+        'cssselect',
         'html5lib',
         'lxml',
         'pathvalidate',
         'pypiwin32',  # FIXME: Breaks linux!
         'python-dateutil',
-        'scrapy'
+        'scrapy',
+        'w3lib'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'orjson': ['orjson'],
+        'parquet': ['pyarrow'],
+        'analysis': ['numpy', 'scipy']
+    },
     entry_points="""
         [console_scripts]
         webcrawl=webweeder.cli:crawl
         webweed=webweeder.cli:weed
+        webcatalog=webweeder.cli:catalog
+        webconvert=webweeder.cli:convert
     """
 )
@@ -0,0 +1,132 @@
+import unittest
+from typing import List, Optional
+
+from bs4 import BeautifulSoup
+
+from webweeder import extraction
+
+_HTML = """<!DOCTYPE html>
+<html>
+<head>
+  <title>Fish &amp; chips &mdash; a history</title>
+  <style>body { color: red; }</style>
+  <script>var article = "not text";</script>
+</head>
+<BODY>
+  <DIV Class="Article-Content" id="content">
+    <h1 class="post-title">Fish   &amp;   <em>chips</em></h1>
+    <p class="post-meta">Published on <span class="date">January&nbsp;3, 2017</span></p>
+    <p>Some <b>bold <i>and italic</i></b> text,<br>then a line break &lt;here&gt; &#8212; and&#x20;entities.</p>
+    <!-- a comment which isn't text -->
+    <p>   </p>
+    <p>
+    </p>
+    <script type="text/javascript">document.write("<p>not text</p>");</script>
+    <style>.ad { display: none; }</style>
+    <template><p>Not rendered</p></template>
+    <pre>  preformatted
+      <b>text</b>
+
+    </pre>
+    <pre>   </pre>
+    <textarea>  kept
+    as is  </textarea>
+    <ul>
+      <li>One</li>
+      <li>Two<!-- hidden --> and a <a href="#">link</a></li>
+    </ul>
+    <ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby>
+    <p>Tail text after <span>a span</span>   and   spaces	tabs</p>
+  </DIV>
+  <div class="sidebar"><p>Sidebar</p></div>
+</BODY>
+</html>
+<!-- Served from the cache -->
+"""
+
+_SELECTORS = [
+    'div.Article-Content',
+    'DIV.Article-Content',
+    'div#content',
+    'h1.post-title',
+    'H1.POST-TITLE',
+    '.post-meta span.date',
+    '.post-meta',
+    'div.Article-Content p',
+    'pre',
+    'textarea',
+    'ul li:nth-of-type(2)',
+    'ruby',
+    'div.sidebar > p',
+    'div.missing',
+    'title'
+]
+
+
+class ExtractionTest(unittest.TestCase):
+    """
+    Checks that the lxml-fast extraction engine finds the same elements and produces exactly the same text as
+    BeautifulSoup with the "lxml" parser
+    """
+
+    def _parse(self, html: str, selectors: List[str]):
+        document = extraction.parse_html(html, extraction.PARSER_LXML_FAST, selectors)
+        # Otherwise the page was parsed with BeautifulSoup, so nothing would be compared
+        self.assertNotIsInstance(document, BeautifulSoup)
+        return document, BeautifulSoup(html, 'lxml')
+
+    def _assert_same_text(self, html: str, selectors: List[str]):
+        (document, soup) = self._parse(html, selectors)
+        for selector in selectors:
+            with self.subTest(selector=selector):
+                element = extraction.select_one(document, selector)
+                tag = soup.select_one(selector)
+                self.assertEqual(tag is None, element is None)
+                if tag is not None:
+                    self.assertEqual(tag.get_text(), extraction.get_text(element))
+
+    def test_select_one_matches_beautifulsoup(self):
+        (document, soup) = self._parse(_HTML, _SELECTORS)
+        for selector in _SELECTORS:
+            with self.subTest(selector=selector):
+                element = extraction.select_one(document, selector)
+                tag = soup.select_one(selector)
+                self.assertEqual(_describe_tag(tag), _describe_element(element))
+
+    def test_get_text_matches_beautifulsoup(self):
+        self._assert_same_text(_HTML, _SELECTORS)
+
+    def test_get_text_of_whole_document_matches_beautifulsoup(self):
+        self._assert_same_text(_HTML, ['html', 'body', 'head'])
+
+    def test_get_text_of_unclosed_and_misnested_tags_matches_beautifulsoup(self):
+        html = '<div class="c"><p>One <b>two <i>three</b> four</i><p>Five &amp six<table><td>Cell</table>'
+        self._assert_same_text(html, ['div.c', 'p', 'b', 'i', 'td'])
+
+    def test_get_text_of_deeply_nested_tags_matches_beautifulsoup(self):
+        html = '<div class="c">' + ('<span> x ' * 500) + ('</span>' * 500) + '</div>'
+        self._assert_same_text(html, ['div.c'])
+
+    def test_falls_back_to_beautifulsoup(self):
+        # lxml can't parse a document without any elements, and doesn't support every selector BeautifulSoup does
+        self.assertIsInstance(extraction.parse_html('', extraction.PARSER_LXML_FAST, ['p']), BeautifulSoup)
+        self.assertIsInstance(extraction.parse_html('<!-- -->', extraction.PARSER_LXML_FAST, ['p']), BeautifulSoup)
+        self.assertIsInstance(extraction.parse_html(_HTML, extraction.PARSER_LXML_FAST, ['p:-soup-contains("x")']),
+                              BeautifulSoup)
+        self.assertIsInstance(extraction.parse_html(_HTML, extraction.PARSER_LXML_FAST, None), BeautifulSoup)
+
+
+def _describe_tag(tag) -> Optional[str]:
+    if tag is None:
+        return None
+    return '%s#%s.%s' % (tag.name, tag.get('id'), ' '.join(tag.get('class', [])))
+
+
+def _describe_element(element) -> Optional[str]:
+    if element is None:
+        return None
+    return '%s#%s.%s' % (element.tag, element.get('id'), element.get('class', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
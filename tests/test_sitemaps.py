@@ -0,0 +1,210 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional
+from urllib.request import urlopen
+
+from scrapy.http import Request, XmlResponse
+
+import config
+from webweeder.catalog import PageCatalog, get_catalog_path
+from webweeder.domainconfig import SimpleDomainConfig
+from webweeder.models import PageMetadata
+from webweeder.sitemaps import SitemapEntry, iter_sitemap_entries, open_sitemap
+from webweeder.spiders.monster import MonsterSpider
+
+_FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), 'fixtures', 'sitemaps')
+
+# Pages last modified from the first day until (but not including) the second are crawled
+_SINCE = date(2017, 1, 1)
+_UNTIL = date(2017, 3, 1)
+
+_DOMAIN = SimpleDomainConfig(name='example.com',
+                             url_patterns=[r'^https://example\.com/[0-9]{4}/[0-9]{2}/[0-9]{2}/[^/]+/$'],
+                             seed_urls=[])
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves the fixture sitemaps. "{base}" in a sitemap is replaced with the server's URL, so sitemap indexes can list
+    the other fixtures
+    """
+
+    def do_GET(self):
+        path = os.path.join(_FIXTURES_DIRECTORY, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as file:
+            body = file.read()
+        if path.endswith('.xml'):
+            body = body.replace(b'{base}', self.server.base_url.encode('utf8'))
+        self.send_response(200)
+        # Sent as-is, like a static "sitemap.xml.gz", rather than with a "Content-Encoding" for the client to undo
+        self.send_header('Content-Type', 'application/gzip' if path.endswith('.gz') else 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FixtureServerTest(unittest.TestCase):
+    """
+    Serves the fixture sitemaps from a local HTTP server for the duration of the tests
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+        cls.server.base_url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _url(self, name: str) -> str:
+        return '%s/%s' % (self.server.base_url, name)
+
+    @staticmethod
+    def _download(url: str) -> bytes:
+        with urlopen(url, timeout=10) as response:
+            return response.read()
+
+
+class SitemapParsingTest(_FixtureServerTest):
+
+    def _fetch(self, name: str) -> List[SitemapEntry]:
+        return list(iter_sitemap_entries(open_sitemap(self._download(self._url(name)))))
+
+    @staticmethod
+    def _lastmod(entries: List[SitemapEntry], loc_suffix: str) -> Optional[datetime]:
+        return next(entry.lastmod for entry in entries if entry.loc.endswith(loc_suffix))
+
+    def test_parses_index(self):
+        entries = self._fetch('index.xml')
+        self.assertEqual(3, len(entries))
+        self.assertTrue(all(entry.is_sitemap for entry in entries))
+        self.assertEqual(self._url('urlset.xml'), entries[0].loc)
+        self.assertEqual(datetime(2017, 1, 10, 12), entries[0].lastmod)
+        self.assertEqual(datetime(2017, 3, 15), entries[1].lastmod)
+
+    def test_parses_gzipped_urlset(self):
+        entries = self._fetch('urlset.xml.gz')
+        self.assertEqual(3, len(entries))
+        self.assertFalse(any(entry.is_sitemap for entry in entries))
+        self.assertEqual(datetime(2017, 2, 1, 8), self._lastmod(entries, '/2017/02/01/in-window/'))
+
+    def test_converts_lastmod_to_utc(self):
+        entries = self._fetch('urlset.xml')
+        self.assertEqual(datetime(2016, 12, 31, 22, 30), self._lastmod(entries, '/before-window-in-utc/'))
+        self.assertEqual(datetime(2017, 1, 1, 1, 30), self._lastmod(entries, '/in-window-in-utc/'))
+        self.assertIsNone(self._lastmod(entries, '/no-lastmod/'))
+        self.assertIsNone(self._lastmod(entries, '/unparseable-lastmod/'))
+
+
+class SpiderSitemapTest(_FixtureServerTest):
+    """
+    Drives MonsterSpider.parse_sitemap() with responses built from the fixture sitemaps, following the sitemap requests
+    it yields and collecting the article requests
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._saved_config = (config.OUTPUT_DIRECTORY, config.DEDUPLICATE_PAGES)
+        config.OUTPUT_DIRECTORY = self._temp_dir.name
+        self.catalog = PageCatalog(get_catalog_path(self._temp_dir.name))
+        MonsterSpider.next_instance_domains = [_DOMAIN]
+        MonsterSpider.next_instance_catalog = self.catalog
+        self.spider = MonsterSpider()
+        self.spider.crawls[_DOMAIN.name].seed_window = (_SINCE, _UNTIL)
+        # URLs of the sitemaps which the spider requested
+        self.sitemaps_requested: List[str] = []
+
+    def tearDown(self):
+        self.spider.store.close()
+        self.catalog.close()
+        (config.OUTPUT_DIRECTORY, config.DEDUPLICATE_PAGES) = self._saved_config
+        self._temp_dir.cleanup()
+
+    def _crawl(self, name: str) -> List[str]:
+        """
+        :return: URLs of the articles which the spider requested, after following every sitemap it requested
+        """
+        request = Request(self._url(name), meta={'domain': _DOMAIN.name})
+        articles: List[str] = []
+        for requested in self._parse(request):
+            if requested.callback == self.spider.parse_sitemap:
+                self.assertEqual(_DOMAIN.name, requested.meta['domain'])
+                self.sitemaps_requested.append(requested.url)
+                articles.extend(self._crawl(os.path.basename(requested.url)))
+            else:
+                self.assertEqual(self.spider.parse_item, requested.callback)
+                self.assertEqual(_DOMAIN.name, requested.meta['budget_domain'])
+                articles.append(requested.url)
+        return articles
+
+    def _parse(self, request: Request) -> Iterable[Request]:
+        response = XmlResponse(request.url, body=self._download(request.url), request=request)
+        return self.spider.parse_sitemap(response)
+
+    def _add_page(self, url: str, url_date: datetime):
+        meta = PageMetadata()
+        meta.domain = _DOMAIN.name
+        meta.url = url
+        meta.url_date = url_date
+        meta.directory = url.split('://', 1)[1]
+        self.catalog.add_page(meta)
+
+    def _add_duplicate(self, url: str, url_date: datetime):
+        meta = PageMetadata()
+        meta.domain = _DOMAIN.name
+        meta.url = url
+        meta.url_date = url_date
+        self.catalog.add_duplicate(meta, 'https://example.com/2017/01/02/original/', 'content', 0)
+
+    def test_filters_by_lastmod_and_url_patterns(self):
+        self.assertEqual([
+            'https://example.com/2017/01/03/in-window/',
+            'https://example.com/2016/12/31/in-window-in-utc/',
+            'https://example.com/2017/01/04/no-lastmod/',
+            'https://example.com/2017/01/05/unparseable-lastmod/',
+            'https://example.com/2017/02/01/in-window/',
+            'https://example.com/2017/02/28/last-day-of-window/'
+        ], self._crawl('index.xml'))
+        # The index's entry for a sitemap last modified before the seed window is never requested
+        self.assertEqual([self._url('urlset.xml'), self._url('urlset.xml.gz')], self.sitemaps_requested)
+
+    def test_only_requests_new_or_changed_pages(self):
+        config.DEDUPLICATE_PAGES = True
+        # Stored since it was last modified
+        self._add_page('https://example.com/2017/01/03/in-window/', datetime(2017, 1, 10))
+        # Stored before it was last modified
+        self._add_page('https://example.com/2017/02/01/in-window/', datetime(2017, 1, 20))
+        # Found to be a copy before it was last modified, so it may no longer be a copy
+        self._add_duplicate('https://example.com/2016/12/31/in-window-in-utc/', datetime(2016, 12, 31))
+        # Found to be a copy since it was last modified
+        self._add_duplicate('https://example.com/2017/02/28/last-day-of-window/', datetime(2017, 3, 5))
+        # Stored, but there's no way to tell whether it's changed
+        self._add_page('https://example.com/2017/01/04/no-lastmod/', datetime(2016, 1, 1))
+        self.assertEqual([
+            'https://example.com/2016/12/31/in-window-in-utc/',
+            'https://example.com/2017/01/05/unparseable-lastmod/',
+            'https://example.com/2017/02/01/in-window/'
+        ], self._crawl('index.xml'))
+
+    def test_requests_copies_when_not_deduplicating(self):
+        config.DEDUPLICATE_PAGES = False
+        self._add_duplicate('https://example.com/2017/02/28/last-day-of-window/', datetime(2017, 3, 5))
+        self.assertIn('https://example.com/2017/02/28/last-day-of-window/', self._crawl('urlset.xml.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
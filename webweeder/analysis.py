@@ -0,0 +1,420 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from glob import escape, glob
+from itertools import islice
+from logging import getLogger
+from typing import Deque, Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
+
+from webweeder.models import PageMetadata
+from webweeder.utils import read_text_file, write_text_file
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+_logger = getLogger(__name__)
+
+# Files kept in the analysis directory. Each batch of articles gets its own matrix file and documents file, whose rows
+# line up. The manifest is written last, so a batch which was interrupted part-way through is ignored
+MANIFEST_FILE_NAME = 'manifest.json'
+VOCABULARY_FILE_NAME = 'vocabulary.txt'
+# Which row holds each analyzed article, and a digest of the plaintext it was counted from
+DOCUMENTS_DATABASE_FILE_NAME = 'documents.sqlite'
+_BATCH_MATRIX_FILE_NAME = 'terms-%05d.npz'
+_BATCH_DOCUMENTS_FILE_NAME = 'documents-%05d.jsonl'
+_GROUP_COUNTS_FILE_NAME = 'group-counts-%05d.npz'
+
+# The group of articles whose date isn't known
+UNKNOWN_MONTH = 'unknown'
+
+
+class AnalysisUnavailableError(Exception):
+    pass
+
+
+class _Document(NamedTuple):
+    url: str
+    domain: str
+    month: str
+    digest: bytes
+    # The batch and row of the article's superseded counts, and their group ID, if it's been analyzed before
+    replaces: Optional[Tuple[int, int, int]]
+
+
+class TermAnalyzer:
+    """
+    Incrementally builds a sparse term-document matrix of every article it's given, along with how often each term is
+    used by each domain in each month. Articles are buffered and counted a batch at a time, and each batch is saved as
+    it's counted, so adding articles never recounts the articles which were added before (even by an earlier run).
+    Articles are identified by their URL, and an article which has already been counted is skipped unless its plaintext
+    (or month) has changed. A changed article is counted again, and its earlier counts are taken off its group's counts
+    and left out of the term-document matrix.
+
+    The results can be loaded with load_term_matrix() and load_group_counts()
+    """
+
+    def __init__(self, directory: str, token_pattern: str, batch_size: int, jobs: int = 1):
+        """
+        :param directory: Where the analysis is kept. An existing analysis there is added to
+        :param token_pattern: Regex matching each term of an article, which is matched against the article in lowercase
+        :param batch_size: How many articles to buffer before they're counted and saved
+        :param jobs: How many worker processes count batches of articles, or 1 to count them in this process
+        :raises AnalysisUnavailableError: If "numpy" or "scipy" isn't installed
+        """
+        _check_available()
+        self.directory: str = directory
+        self.token_pattern: str = token_pattern
+        self.batch_size: int = batch_size
+        # How many articles have been added to the analysis during this run, and how many of them replaced an earlier
+        # count of the same article
+        self.added: int = 0
+        self.replaced: int = 0
+        self._documents: List[_Document] = []
+        self._texts: List[str] = []
+        # Batches which are being counted by the worker processes, oldest first
+        self._counting: Deque[Tuple[List[_Document], Future]] = deque()
+        # URLs of the articles which have been added but not saved yet. Any other copies of them are skipped
+        self._unsaved_urls: Set[str] = set()
+        self._executor: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(max_workers=jobs) if (jobs > 1) else None
+        self._max_counting: int = (jobs * 2)
+
+        os.makedirs(directory, exist_ok=True)
+        manifest = _read_manifest(directory)
+        self._batches: int = manifest['batches']
+        self._groups: Dict[str, int] = {group: i for (i, group) in enumerate(manifest['groups'])}
+        # Looking up a term which isn't in the vocabulary yet gives it the next term ID
+        self._vocabulary: Dict[str, int] = defaultdict()
+        self._vocabulary.default_factory = self._vocabulary.__len__
+        for term in _read_vocabulary(directory, manifest['terms']):
+            self._vocabulary[term] = len(self._vocabulary)
+        self._saved_terms: int = manifest['terms']
+        self._vocabulary_bytes: int = manifest['vocabulary_bytes']
+        self._group_counts = _read_group_counts(directory, manifest)
+        self._database: sqlite3.Connection = _open_documents_database(directory, self._batches)
+
+    def add(self, meta: PageMetadata, plaintext: str):
+        if meta.url in self._unsaved_urls:
+            _logger.debug('Skipping article which is already being analyzed: %s' % meta.url)
+            return
+        month = _get_month(meta)
+        group = _get_group(meta.domain, month)
+        digest = hashlib.sha1(plaintext.encode('utf8')).digest()
+        previous = self._database.execute(
+            'SELECT batch, row, group_id, digest FROM documents WHERE url = ? ORDER BY batch DESC LIMIT 1',
+            (meta.url,)).fetchone()
+        replaces = None
+        if previous is not None:
+            (batch, row, group_id, previous_digest) = previous
+            if (previous_digest == digest) and (self._groups.get(group) == group_id):
+                _logger.debug('Skipping article which has already been analyzed: %s' % meta.url)
+                return
+            _logger.debug('Analyzing article again as it has changed: %s' % meta.url)
+            replaces = (batch, row, group_id)
+        self._unsaved_urls.add(meta.url)
+        self._documents.append(_Document(meta.url, meta.domain, month, digest, replaces))
+        self._texts.append(plaintext)
+        if len(self._documents) >= self.batch_size:
+            self._count_batch()
+
+    def close(self):
+        """
+        Counts and saves every article which has been added but not saved yet
+        """
+        try:
+            self._count_batch()
+            while len(self._counting) != 0:
+                self._merge_batch(*self._counting.popleft())
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._database.close()
+
+    def _count_batch(self):
+        if len(self._documents) == 0:
+            return
+        (documents, texts) = (self._documents, self._texts)
+        self._documents = []
+        self._texts = []
+        if self._executor is None:
+            self._merge_batch(documents, count_terms(texts, self.token_pattern))
+            return
+        self._counting.append((documents, self._executor.submit(count_terms, texts, self.token_pattern)))
+        if len(self._counting) >= self._max_counting:
+            # Stops batches from piling up in memory if the workers can't keep up
+            self._merge_batch(*self._counting.popleft())
+
+    def _merge_batch(self, documents: List[_Document], counted):
+        """
+        Translates a counted batch into the shared vocabulary, adds it to the group counts (in place of the counts of
+        any articles it replaces) and saves it
+        :param counted: The result of count_terms(), or a Future of it
+        """
+        if isinstance(counted, Future):
+            counted = counted.result()
+        (terms, matrix) = counted
+        term_ids = numpy.fromiter(map(self._vocabulary.__getitem__, terms), dtype=numpy.int32, count=len(terms))
+        matrix = scipy.sparse.csr_matrix((matrix.data, term_ids[matrix.indices], matrix.indptr),
+                                         shape=(matrix.shape[0], len(self._vocabulary)))
+        matrix.sort_indices()
+
+        # Each article's group is its domain and month, and each group's counts are the sum of its articles' counts
+        group_ids = numpy.fromiter((self._get_group_id(document.domain, document.month) for document in documents),
+                                   dtype=numpy.int32, count=len(documents))
+        group_counts = self._group_counts
+        group_counts.resize((len(self._groups), len(self._vocabulary)))
+        group_counts = group_counts + (self._get_membership(group_ids) @ matrix)
+        group_counts = (group_counts - self._count_replaced(documents)).tocsr()
+        group_counts.eliminate_zeros()
+        self._group_counts = group_counts
+
+        self._save_batch(documents, matrix)
+        self._unsaved_urls.difference_update(document.url for document in documents)
+        self.added += len(documents)
+        self.replaced += sum((document.replaces is not None) for document in documents)
+
+    def _count_replaced(self, documents: List[_Document]):
+        """
+        :return: The counts of each group which came from the earlier counts of the given articles
+        """
+        replaced: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        for document in documents:
+            if document.replaces is not None:
+                (batch, row, group_id) = document.replaces
+                replaced[batch].append((row, group_id))
+        counts = scipy.sparse.csr_matrix((len(self._groups), len(self._vocabulary)), dtype=numpy.int64)
+        # Each saved batch is read once, however many of its articles are replaced
+        for (batch, rows) in replaced.items():
+            matrix = _read_batch_matrix(self.directory, batch, len(self._vocabulary))
+            group_ids = numpy.array([group_id for (_, group_id) in rows], dtype=numpy.int32)
+            counts = counts + (self._get_membership(group_ids) @ matrix[[row for (row, _) in rows]])
+        return counts
+
+    def _get_membership(self, group_ids):
+        """
+        :return: A sparse matrix with a row for each group and a column for each of the given group IDs, so multiplying
+        it by the matrix of those articles sums their counts into their groups
+        """
+        return scipy.sparse.csr_matrix(
+            (numpy.ones(len(group_ids), dtype=numpy.int64), (group_ids, numpy.arange(len(group_ids)))),
+            shape=(len(self._groups), len(group_ids)))
+
+    def _get_group_id(self, domain: str, month: str) -> int:
+        return self._groups.setdefault(_get_group(domain, month), len(self._groups))
+
+    def _save_batch(self, documents: List[_Document], matrix):
+        batch = self._batches
+        scipy.sparse.save_npz(os.path.join(self.directory, _BATCH_MATRIX_FILE_NAME % batch), matrix, compressed=False)
+        documents_json = ''.join(json.dumps({'url': document.url, 'domain': document.domain, 'month': document.month})
+                                 + '\n' for document in documents)
+        write_text_file(os.path.join(self.directory, _BATCH_DOCUMENTS_FILE_NAME % batch), documents_json)
+        scipy.sparse.save_npz(os.path.join(self.directory, _GROUP_COUNTS_FILE_NAME % batch), self._group_counts,
+                              compressed=False)
+
+        # The vocabulary only ever grows, so new terms are just appended (over any left by an interrupted batch)
+        new_terms = list(islice(reversed(self._vocabulary), len(self._vocabulary) - self._saved_terms))
+        new_terms.reverse()
+        with open(os.path.join(self.directory, VOCABULARY_FILE_NAME), 'ab') as vocabulary_file:
+            vocabulary_file.truncate(self._vocabulary_bytes)
+            vocabulary_file.write(''.join(term + '\n' for term in new_terms).encode('utf8'))
+            vocabulary_bytes = vocabulary_file.tell()
+        # Saved before the manifest. If the batch is interrupted before the manifest is written, its rows are deleted
+        # again when the analysis is next opened
+        with self._database:
+            self._database.executemany(
+                'INSERT OR REPLACE INTO documents (url, batch, row, group_id, digest) VALUES (?, ?, ?, ?, ?)',
+                ((document.url, batch, row, self._groups[_get_group(document.domain, document.month)], document.digest)
+                 for (row, document) in enumerate(documents)))
+
+        manifest = {'batches': batch + 1, 'terms': len(self._vocabulary), 'vocabulary_bytes': vocabulary_bytes,
+                    'groups': list(self._groups)}
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE_NAME)
+        write_text_file(manifest_path + '.tmp', json.dumps(manifest))
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+        previous_group_counts = os.path.join(self.directory, _GROUP_COUNTS_FILE_NAME % (batch - 1))
+        if os.path.isfile(previous_group_counts):
+            os.remove(previous_group_counts)
+        self._batches = batch + 1
+        self._saved_terms = len(self._vocabulary)
+        self._vocabulary_bytes = vocabulary_bytes
+        _logger.info('Analyzed batch of %d articles, with %d distinct terms so far'
+                     % (matrix.shape[0], matrix.shape[1]))
+
+
+def count_terms(texts: List[str], token_pattern: str):
+    """
+    Counts the terms of a batch of articles using a vocabulary of its own, so batches can be counted in parallel by
+    worker processes
+    :return: A tuple of the batch's vocabulary and a sparse matrix with a row for each of the given articles, holding
+    how many times each term of the batch's vocabulary appears in it
+    """
+    find_terms = _compile_token_pattern(token_pattern).findall
+    vocabulary: Dict[str, int] = defaultdict()
+    vocabulary.default_factory = vocabulary.__len__
+    get_term_id = vocabulary.__getitem__
+    term_ids = array('i')
+    row_starts = array('q', [0])
+    for text in texts:
+        term_ids.extend(map(get_term_id, find_terms(text.lower())))
+        row_starts.append(len(term_ids))
+    matrix = scipy.sparse.csr_matrix(
+        (numpy.ones(len(term_ids), dtype=numpy.int32), numpy.frombuffer(term_ids, dtype=numpy.int32),
+         numpy.frombuffer(row_starts, dtype=numpy.int64)),
+        shape=(len(texts), len(vocabulary)))
+    # Repeated terms are each counted once so far, so add them together
+    matrix.sum_duplicates()
+    return list(vocabulary), matrix
+
+
+def load_term_matrix(directory: str):
+    """
+    :return: A tuple of the term-document matrix (a "scipy.sparse.csr_matrix" with a row for each article and a column
+    for each term), the vocabulary (the term of each column) and the documents (the URL, domain and month of each row)
+    """
+    _check_available()
+    manifest = _read_manifest(directory)
+    vocabulary = _read_vocabulary(directory, manifest['terms'])
+    matrices = [_read_batch_matrix(directory, batch, len(vocabulary)) for batch in range(manifest['batches'])]
+    if len(matrices) == 0:
+        matrix = scipy.sparse.csr_matrix((0, len(vocabulary)), dtype=numpy.int32)
+    else:
+        matrix = scipy.sparse.vstack(matrices, format='csr')
+    documents = list(_iter_documents(directory, manifest['batches']))
+    # An article which changed was counted again in a later batch, which supersedes its earlier rows
+    latest_rows = {document['url']: row for (row, document) in enumerate(documents)}
+    if len(latest_rows) != len(documents):
+        rows = sorted(latest_rows.values())
+        matrix = matrix[rows]
+        documents = [documents[row] for row in rows]
+    return matrix, vocabulary, documents
+
+
+def load_group_counts(directory: str):
+    """
+    :return: A tuple of the group counts (a "scipy.sparse.csr_matrix" with a row for each group and a column for each
+    term), the vocabulary (the term of each column) and the groups (the domain and month of each row)
+    """
+    _check_available()
+    manifest = _read_manifest(directory)
+    counts = _read_group_counts(directory, manifest)
+    counts.resize((len(manifest['groups']), manifest['terms']))
+    groups = [tuple(group.split('\t')) for group in manifest['groups']]
+    return counts, _read_vocabulary(directory, manifest['terms']), groups
+
+
+def delete_analysis(directory: str) -> List[str]:
+    """
+    :return: Paths of the removed files
+    """
+    removed = []
+    for file_name in [MANIFEST_FILE_NAME, VOCABULARY_FILE_NAME, DOCUMENTS_DATABASE_FILE_NAME,
+                      DOCUMENTS_DATABASE_FILE_NAME + '-journal', 'terms-*.npz', 'documents-*.jsonl',
+                      'group-counts-*.npz']:
+        for file_path in glob(os.path.join(escape(directory), file_name)):
+            os.remove(file_path)
+            removed.append(file_path)
+    return removed
+
+
+def is_analysis_available() -> bool:
+    """
+    :return: Whether the packages needed to analyze articles are installed
+    """
+    return numpy is not None
+
+
+def _check_available():
+    if not is_analysis_available():
+        raise AnalysisUnavailableError('The "numpy" and "scipy" packages are needed to analyze articles')
+
+
+@lru_cache(maxsize=None)
+def _compile_token_pattern(token_pattern: str) -> Pattern:
+    return re.compile(token_pattern)
+
+
+def _get_month(meta: PageMetadata) -> str:
+    date = meta.article_date or meta.url_date
+    return date.strftime('%Y-%m') if (date is not None) else UNKNOWN_MONTH
+
+
+def _get_group(domain: str, month: str) -> str:
+    return '%s\t%s' % (domain, month)
+
+
+def _read_manifest(directory: str) -> Dict[str, object]:
+    manifest_json = read_text_file(os.path.join(directory, MANIFEST_FILE_NAME))
+    if manifest_json is None:
+        return {'batches': 0, 'terms': 0, 'vocabulary_bytes': 0, 'groups': []}
+    return json.loads(manifest_json)
+
+
+def _read_vocabulary(directory: str, terms: int) -> List[str]:
+    vocabulary: List[str] = []
+    if terms == 0:
+        return vocabulary
+    with open(os.path.join(directory, VOCABULARY_FILE_NAME), 'r', encoding='utf8') as vocabulary_file:
+        for line in vocabulary_file:
+            if len(vocabulary) == terms:
+                # Written by a batch which was interrupted
+                break
+            vocabulary.append(line.rstrip('\n'))
+    return vocabulary
+
+
+def _read_batch_matrix(directory: str, batch: int, terms: int):
+    matrix = scipy.sparse.load_npz(os.path.join(directory, _BATCH_MATRIX_FILE_NAME % batch)).tocsr()
+    # Earlier batches were counted before later terms were added to the vocabulary
+    matrix.resize((matrix.shape[0], terms))
+    return matrix
+
+
+def _open_documents_database(directory: str, batches: int) -> sqlite3.Connection:
+    """
+    Opens the database of analyzed articles, so they don't all have to be held in memory to tell which are new. Rows
+    left by a batch which was interrupted are deleted, and an analysis made before the database existed has its
+    articles added to it (without digests, so each is counted again the next time it's added)
+    :param batches: How many batches the manifest lists
+    """
+    database = sqlite3.connect(os.path.join(directory, DOCUMENTS_DATABASE_FILE_NAME))
+    with database:
+        # Every count of an article is kept, so an interrupted batch can't lose track of the counts it replaced
+        database.execute('CREATE TABLE IF NOT EXISTS documents (url TEXT NOT NULL, batch INTEGER NOT NULL, '
+                         'row INTEGER NOT NULL, group_id INTEGER NOT NULL, digest BLOB, PRIMARY KEY (url, batch))')
+        database.execute('DELETE FROM documents WHERE batch >= ?', (batches,))
+        saved_batches = database.execute('SELECT COALESCE(MAX(batch) + 1, 0) FROM documents').fetchone()[0]
+        if saved_batches < batches:
+            groups = {group: i for (i, group) in enumerate(_read_manifest(directory)['groups'])}
+            for batch in range(saved_batches, batches):
+                database.executemany(
+                    'INSERT OR REPLACE INTO documents (url, batch, row, group_id) VALUES (?, ?, ?, ?)',
+                    ((document['url'], batch, row, groups[_get_group(document['domain'], document['month'])])
+                     for (row, document) in enumerate(_iter_batch_documents(directory, batch))))
+    return database
+
+
+def _iter_documents(directory: str, batches: int):
+    for batch in range(batches):
+        yield from _iter_batch_documents(directory, batch)
+
+
+def _iter_batch_documents(directory: str, batch: int):
+    with open(os.path.join(directory, _BATCH_DOCUMENTS_FILE_NAME % batch), 'r', encoding='utf8') as documents_file:
+        for line in documents_file:
+            yield json.loads(line)
+
+
+def _read_group_counts(directory: str, manifest: Dict[str, object]):
+    batches = manifest['batches']
+    if batches == 0:
+        return scipy.sparse.csr_matrix((0, 0), dtype=numpy.int64)
+    return scipy.sparse.load_npz(os.path.join(directory, _GROUP_COUNTS_FILE_NAME % (batches - 1))).tocsr()
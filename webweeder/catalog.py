@@ -0,0 +1,308 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from logging import getLogger
+from typing import Iterator, List, Optional, Tuple
+
+import config
+from webweeder.dedupe import DUPLICATE_CONTENT, DUPLICATE_URL
+from webweeder.models import PageMetadata, page_metadata_from_json, page_metadata_to_json, page_metadatas_from_json, \
+    read_page_metadatas
+from webweeder.utils import parse_iso_datetime
+
+_logger = getLogger(__name__)
+
+# How many pages find_pages() reads from the database at once
+_BULK_SIZE = 256
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS pages (
+        url          TEXT PRIMARY KEY,
+        domain       TEXT NOT NULL,
+        url_date     TEXT,
+        article_date TEXT,
+        directory    TEXT NOT NULL,
+        metadata     TEXT NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS pages_domain ON pages (domain)',
+    'CREATE INDEX IF NOT EXISTS pages_url_date ON pages (url_date)',
+    'CREATE INDEX IF NOT EXISTS pages_article_date ON pages (article_date)',
+    """
+    CREATE TABLE IF NOT EXISTS crawls (
+        domain     TEXT PRIMARY KEY,
+        last_crawl TEXT NOT NULL
+    )
+    """,
+    # Which URL was stored first for each canonical URL and article, so copies of it can be found
+    'CREATE TABLE IF NOT EXISTS canonical_urls (canonical_url TEXT PRIMARY KEY, url TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS article_hashes (article_hash TEXT PRIMARY KEY, url TEXT NOT NULL)',
+    """
+    CREATE TABLE IF NOT EXISTS duplicates (
+        url          TEXT PRIMARY KEY,
+        domain       TEXT NOT NULL,
+        original_url TEXT NOT NULL,
+        reason       TEXT NOT NULL,
+        url_date     TEXT,
+        size         INTEGER NOT NULL
+    )
+    """
+]
+
+
+def get_catalog_path(base_dir: str) -> str:
+    """
+    :param base_dir: The output directory
+    :return: Where the catalog for the given output directory is stored
+    """
+    return os.path.join(base_dir, config.CATALOG_FILE_NAME)
+
+
+class PageCatalog:
+    """
+    An index of every stored page, so pages can be found and filtered without walking the output directory and parsing
+    every metadata file. The metadata files remain the source of truth: the catalog can be rebuilt from them at any time
+
+    Every method is thread-safe. Each change is committed straight away, so no write transaction is ever left open
+    between pages, and several processes (eg. crawl workers) can write to the same catalog at once. Spiders in the same
+    process should share a catalog rather than opening their own
+    """
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path: Where the catalog is stored. It will be created if it doesn't already exist
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        # Other processes may be writing to the catalog, so wait for their (short) transactions rather than failing.
+        # Statements are committed as soon as they're executed, unless they're part of a transaction()
+        self._connection = sqlite3.connect(file_path, timeout=60, check_same_thread=False, isolation_level=None)
+        # Reentrant, so methods which take the lock can be called during a transaction()
+        self._lock = threading.RLock()
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups every change made within the context into a single transaction, which is committed when the context
+        exits (or rolled back if it raises). Other threads using the catalog wait until it's finished, so only use this
+        for short bursts of changes, or when nothing else is using the catalog (eg. when rebuilding it)
+        """
+        with self._lock:
+            if self._connection.in_transaction:
+                # Already part of an outer transaction
+                yield
+                return
+            # Takes the write lock up-front, so nothing can change between reading and writing within the transaction
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def add_page(self, meta: PageMetadata):
+        """
+        Adds the given page to the catalog, replacing any page which was previously stored with the same URL
+        """
+        row = (meta.url, meta.domain, _datetime_to_sql(meta.url_date), _datetime_to_sql(meta.article_date),
+               meta.directory, page_metadata_to_json(meta, pretty=False))
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)', row)
+
+    def find_page(self, url: str) -> Optional[PageMetadata]:
+        """
+        :return: The metadata of the page with the given URL, or None if no such page has been catalogued
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT metadata FROM pages WHERE url = ?', (url,)).fetchone()
+        return page_metadata_from_json(row[0]) if (row is not None) else None
+
+    def find_pages(self,
+                   domains: Optional[List[str]] = None,
+                   since: Optional[datetime] = None,
+                   until: Optional[datetime] = None,
+                   ordered: bool = False) -> Iterator[PageMetadata]:
+        """
+        :param domains: Only find pages from these domains, or None to find pages from all domains
+        :param since: Only find articles published at or after this time, or None for no lower bound
+        :param until: Only find articles published before this time, or None for no upper bound
+        :param ordered: Set to True to find pages ordered by URL, otherwise they're found in no particular order
+        """
+        (where, params) = self._build_filter(domains, since, until)
+        sql = 'SELECT metadata FROM pages' + where + (' ORDER BY url' if ordered else '')
+        with self._lock:
+            cursor = self._connection.execute(sql, params)
+        while True:
+            # Read in batches, so every page is never held in memory at once. The lock isn't held between batches, so
+            # other threads can carry on using the catalog while the pages are being used
+            with self._lock:
+                rows = cursor.fetchmany(_BULK_SIZE)
+            if len(rows) == 0:
+                break
+            yield from page_metadatas_from_json([row[0] for row in rows])
+
+    def find_metadata_paths(self,
+                            base_dir: str,
+                            domains: Optional[List[str]] = None,
+                            since: Optional[datetime] = None,
+                            until: Optional[datetime] = None,
+                            ordered: bool = False) -> Iterator[str]:
+        """
+        Like find_pages(), but only yields the full path of each page's metadata file, which is much cheaper
+        :param base_dir: The output directory, which the metadata paths are joined to
+        """
+        (where, params) = self._build_filter(domains, since, until)
+        sql = 'SELECT directory FROM pages' + where + (' ORDER BY url' if ordered else '')
+        with self._lock:
+            cursor = self._connection.execute(sql, params)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(_BULK_SIZE)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield os.path.join(base_dir, row[0], 'metadata.json')
+
+    def count_pages(self,
+                    domains: Optional[List[str]] = None,
+                    since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> int:
+        (where, params) = self._build_filter(domains, since, until)
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM pages' + where, params).fetchone()[0]
+
+    def set_last_crawl(self, domain: str, started: datetime):
+        """
+        Records that the given domain was crawled successfully
+        :param started: When the crawl started
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO crawls VALUES (?, ?)', (domain, _datetime_to_sql(started)))
+
+    def find_last_crawl(self, domain: str) -> Optional[datetime]:
+        """
+        :return: When the last successful crawl of the given domain started, or None if it's never been crawled
+        successfully
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT last_crawl FROM crawls WHERE domain = ?', (domain,)).fetchone()
+        return parse_iso_datetime(row[0]) if (row is not None) else None
+
+    def claim_page(self, url: str, canonical_url: str, article_hash: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        Finds out whether a page which is about to be stored is a copy of a page which has already been stored. If not,
+        the page is claimed as the original for its canonical URL and article, so later copies are found instead
+        :param article_hash: Digest of the page's article, or None if it couldn't be extracted
+        :return: The URL of the original and the reason (DUPLICATE_URL or DUPLICATE_CONTENT) if the page is a copy,
+        otherwise None. Pages which have already been stored under the same URL are never considered copies
+        """
+        # Committed as one transaction, so only one of several processes storing copies of the same page at once can
+        # claim it, and the claim is seen by every other process as soon as it's made
+        with self.transaction():
+            connection = self._connection
+            stored = connection.execute('SELECT 1 FROM pages WHERE url = ?', (url,)).fetchone() is not None
+            if not stored:
+                row = connection.execute('SELECT url FROM canonical_urls WHERE canonical_url = ?',
+                                         (canonical_url,)).fetchone()
+                if (row is not None) and (row[0] != url):
+                    return row[0], DUPLICATE_URL
+            if article_hash is not None:
+                # Inserting first means the article is claimed if nothing else has claimed it yet
+                connection.execute('INSERT OR IGNORE INTO article_hashes VALUES (?, ?)', (article_hash, url))
+                row = connection.execute('SELECT url FROM article_hashes WHERE article_hash = ?',
+                                         (article_hash,)).fetchone()
+                if (not stored) and (row[0] != url):
+                    return row[0], DUPLICATE_CONTENT
+            connection.execute('INSERT OR IGNORE INTO canonical_urls VALUES (?, ?)', (canonical_url, url))
+        return None
+
+    def add_duplicate(self, meta: PageMetadata, original_url: str, reason: str, size: int):
+        """
+        Records that the given page wasn't stored because it's a copy of another page
+        :param size: How many bytes of raw HTML weren't stored
+        """
+        row = (meta.url, meta.domain, original_url, reason, _datetime_to_sql(meta.url_date), size)
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?, ?)', row)
+
+    def find_duplicate(self, url: str) -> Optional[Tuple[str, Optional[datetime]]]:
+        """
+        :return: The URL of the original and when the page was last crawled, if the page with the given URL was found to
+        be a copy of another page rather than being stored, otherwise None
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT original_url, url_date FROM duplicates WHERE url = ?',
+                                           (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0], (parse_iso_datetime(row[1]) if (row[1] is not None) else None)
+
+    def summarize_duplicates(self, domains: Optional[List[str]] = None) -> List[Tuple[str, str, int, int]]:
+        """
+        :param domains: Only summarize duplicates from these domains, or None to summarize all domains
+        :return: The domain, reason, number of duplicates and total size of the duplicates for each domain and reason
+        """
+        (where, params) = self._build_filter(domains, None, None)
+        sql = 'SELECT domain, reason, COUNT(*), SUM(size) FROM duplicates' + where + \
+              ' GROUP BY domain, reason ORDER BY domain, reason'
+        with self._lock:
+            return [tuple(row) for row in self._connection.execute(sql, params)]
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM pages')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _build_filter(domains: Optional[List[str]],
+                      since: Optional[datetime],
+                      until: Optional[datetime]) -> Tuple[str, List[object]]:
+        clauses: List[str] = []
+        params: List[object] = []
+        if domains is not None:
+            clauses.append('domain IN (%s)' % ', '.join('?' for _ in domains))
+            params += domains
+        if since is not None:
+            clauses.append('article_date >= ?')
+            params.append(_datetime_to_sql(since))
+        if until is not None:
+            clauses.append('article_date < ?')
+            params.append(_datetime_to_sql(until))
+        where = (' WHERE ' + ' AND '.join(clauses)) if (len(clauses) != 0) else ''
+        return where, params
+
+
+def rebuild_catalog(catalog: PageCatalog, metadata_paths: Iterator[str]) -> Tuple[int, int]:
+    """
+    Replaces everything in the given catalog with the pages described by the given metadata files
+    :return: How many pages were catalogued, and how many metadata files couldn't be read
+    """
+    added = 0
+    failed = 0
+    # Everything else using the catalog sees either the old pages or the rebuilt ones, never half of each
+    with catalog.transaction():
+        catalog.clear()
+        for (metadata_path, meta) in read_page_metadatas(metadata_paths):
+            if meta is None:
+                # Already logged
+                failed += 1
+                continue
+            catalog.add_page(meta)
+            added += 1
+    return added, failed
+
+
+def _datetime_to_sql(dt: Optional[datetime]) -> Optional[str]:
+    # ISO 8601 strings sort in chronological order, so they can be compared directly by SQLite
+    return dt.isoformat() if (dt is not None) else None
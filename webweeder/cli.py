@@ -1,23 +1,42 @@
 import getpass
+import multiprocessing
 import os
+import queue
+import signal
 import socket
 from datetime import date, datetime
+from contextlib import nullcontext
 from glob import glob
 from logging import getLogger, DEBUG
 from logging.handlers import RotatingFileHandler
-from typing import List, Optional
+from traceback import format_exc
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import click
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.log import get_scrapy_root_handler, configure_logging
+from twisted.internet.task import LoopingCall
 
 import config
 from webweeder import cli_vars
 from webweeder import configutils
+from webweeder import profiling
+from webweeder.analysis import TermAnalyzer, delete_analysis, is_analysis_available
+from webweeder.catalog import PageCatalog, get_catalog_path, rebuild_catalog
+from webweeder.domainconfig import DomainConfig
+from webweeder.dupefilter import DUPEFILTER_BLOOM, DUPEFILTERS
+from webweeder.export import CorpusExporter, iter_directory_articles
+from webweeder.models import PageMetadata, page_metadata_to_json, read_page_metadatas
+from webweeder.parallel import ordered_map
+from webweeder.segments import SegmentWriter, compress_payload, decompress_payload, read_record
 from webweeder.spiders.monster import MonsterSpider
-from webweeder.stats import StatsMonitor
-from webweeder.utils import delete_directory, find_duplicates, MEGABYTES
-from webweeder.weeders.monster import MonsterWeeder
+from webweeder.stats import StatsForwarder, StatsMonitor
+from webweeder.storage import PAGE_SEGMENT_PREFIX, PLAINTEXT_SEGMENT_PREFIX, STORAGE_BACKENDS, STORAGE_SEGMENTS, \
+    SegmentPageStore, decode_page_record, delete_segments, encode_page_record, find_segments, \
+    get_segments_directory, iter_latest_segment_payloads, iter_segment_pages, load_segment_index
+from webweeder.utils import delete_directory, delete_empty_directories, find_compressed_file, find_duplicates, \
+    read_text_file, resolve_compression, COMPRESSIONS, MEGABYTES
+from webweeder.weeders.monster import FINGERPRINT_FILE_NAME, MonsterWeeder
 
 _logger = getLogger(__name__)
 
@@ -32,17 +51,82 @@ _logger = getLogger(__name__)
               help=cli_vars.HELP_STATSINTERVAL)
 @click.option('--parser', default=config.HTML_PARSER, type=click.Choice(cli_vars.CHOICE_PARSERS),
               help=cli_vars.HELP_PARSER)
+@click.option('--storage', default=config.STORAGE_BACKEND, type=click.Choice(STORAGE_BACKENDS),
+              help=cli_vars.HELP_STORAGE)
+@click.option('--compression', default=config.COMPRESSION, type=click.Choice(COMPRESSIONS),
+              help=cli_vars.HELP_COMPRESSION_CRAWL)
+@click.option('--extract/--no-extract', default=config.EXTRACT_ON_CRAWL, help=cli_vars.HELP_EXTRACT)
+@click.option('--offload/--no-offload', default=config.OFFLOAD_PROCESSING, help=cli_vars.HELP_OFFLOAD)
+@click.option('--resume/--no-resume', default=config.RESUMABLE_CRAWL, help=cli_vars.HELP_RESUME)
+@click.option('--incremental/--no-incremental', default=config.INCREMENTAL_CRAWL, help=cli_vars.HELP_INCREMENTAL_CRAWL)
+@click.option('--maxage', default=config.REFETCH_MAX_AGE, type=click.IntRange(min=-1), help=cli_vars.HELP_MAXAGE)
+@click.option('--since', default=config.CRAWL_SINCE, type=click.DateTime(formats=['%Y-%m-%d']),
+              help=cli_vars.HELP_SINCE_CRAWL)
+@click.option('--until', default=config.CRAWL_UNTIL, type=click.DateTime(formats=['%Y-%m-%d']),
+              help=cli_vars.HELP_UNTIL_CRAWL)
+@click.option('--sitemaps/--no-sitemaps', default=config.SITEMAP_DISCOVERY, help=cli_vars.HELP_SITEMAPS)
+@click.option('--singlespider/--no-singlespider', default=config.SINGLE_SPIDER, help=cli_vars.HELP_SINGLESPIDER)
+@click.option('--workers', default=config.CRAWL_WORKERS, type=click.IntRange(min=1), help=cli_vars.HELP_WORKERS)
+@click.option('--concurrency', default=config.CONCURRENT_REQUESTS, type=click.IntRange(min=1),
+              help=cli_vars.HELP_CONCURRENCY)
+@click.option('--domainconcurrency', default=config.CONCURRENT_REQUESTS_PER_DOMAIN, type=click.IntRange(min=1),
+              help=cli_vars.HELP_DOMAINCONCURRENCY)
+@click.option('--delay', default=config.DOWNLOAD_DELAY, type=click.FloatRange(min=0), help=cli_vars.HELP_DELAY)
+@click.option('--timeout', default=config.DOWNLOAD_TIMEOUT, type=click.FloatRange(min=1), help=cli_vars.HELP_TIMEOUT)
+@click.option('--retries', default=config.RETRY_TIMES, type=click.IntRange(min=0), help=cli_vars.HELP_RETRIES)
+@click.option('--autothrottle/--no-autothrottle', default=config.AUTOTHROTTLE, help=cli_vars.HELP_AUTOTHROTTLE)
+@click.option('--dupefilter', default=config.DUPEFILTER, type=click.Choice(DUPEFILTERS), help=cli_vars.HELP_DUPEFILTER)
+@click.option('--dedupe/--no-dedupe', default=config.DEDUPLICATE_PAGES, help=cli_vars.HELP_DEDUPE)
+@click.option('--profile/--no-profile', default=config.PROFILE, help=cli_vars.HELP_PROFILE_CRAWL)
+@click.option('--profileslowest', default=config.PROFILE_SLOWEST, type=click.IntRange(min=0),
+              help=cli_vars.HELP_PROFILESLOWEST)
 @click.option('--loglevel', default=config.LOG_LEVEL, type=click.Choice(cli_vars.CHOICE_LOGLEVEL),
               help=cli_vars.HELP_LOGLEVEL)
 @click.option('--logdir', default=config.LOG_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_LOGDIR)
-def crawl(domains, alldomains, clean, outdir, useragent, statsinterval, parser, loglevel, logdir):
+def crawl(domains, alldomains, clean, outdir, useragent, statsinterval, parser, storage, compression, extract, offload,
+          resume, incremental, maxage, since, until, sitemaps, singlespider, workers, concurrency, domainconcurrency,
+          delay, timeout, retries, autothrottle, dupefilter, dedupe, profile, profileslowest, loglevel, logdir):
     # TODO: docstring for command-line help and example usage
 
     msg = 'crawl: domains=%r, alldomains=%r, clean=%r, outdir=%r, useragent=%r, statsinterval=%r, parser=%r, ' \
+          'storage=%r, compression=%r, extract=%r, offload=%r, resume=%r, incremental=%r, maxage=%r, since=%r, ' \
+          'until=%r, sitemaps=%r, singlespider=%r, workers=%r, concurrency=%r, domainconcurrency=%r, delay=%r, ' \
+          'timeout=%r, retries=%r, autothrottle=%r, dupefilter=%r, dedupe=%r, profile=%r, profileslowest=%r, ' \
           'logfile=%r, logdir=%r' \
-          % (domains, alldomains, clean, outdir, useragent, statsinterval, parser, loglevel, logdir)
+          % (domains, alldomains, clean, outdir, useragent, statsinterval, parser, storage, compression, extract,
+             offload, resume, incremental, maxage, since, until, sitemaps, singlespider, workers, concurrency,
+             domainconcurrency, delay, timeout, retries, autothrottle, dupefilter, dedupe, profile, profileslowest,
+             loglevel, logdir)
 
     _configure(outdir, useragent, statsinterval, parser, loglevel, logdir)
+    config.STORAGE_BACKEND = storage
+    config.COMPRESSION = resolve_compression(compression)
+    config.EXTRACT_ON_CRAWL = extract
+    config.OFFLOAD_PROCESSING = offload
+    config.RESUMABLE_CRAWL = resume
+    config.INCREMENTAL_CRAWL = incremental
+    config.REFETCH_MAX_AGE = maxage
+    config.CRAWL_SINCE = since.date() if (since is not None) else None
+    config.CRAWL_UNTIL = until.date() if (until is not None) else None
+    config.SITEMAP_DISCOVERY = sitemaps
+    config.SINGLE_SPIDER = singlespider
+    config.CRAWL_WORKERS = workers
+    config.CONCURRENT_REQUESTS = concurrency
+    config.CONCURRENT_REQUESTS_PER_DOMAIN = domainconcurrency
+    config.DOWNLOAD_DELAY = delay
+    config.DOWNLOAD_TIMEOUT = timeout
+    config.RETRY_TIMES = retries
+    config.AUTOTHROTTLE = autothrottle
+    config.DUPEFILTER = dupefilter
+    config.DEDUPLICATE_PAGES = dedupe
+    config.PROFILE = profile
+    config.PROFILE_SLOWEST = profileslowest
+    config.SCRAPY_SETTINGS.update(_get_download_settings())
+    if dupefilter == DUPEFILTER_BLOOM:
+        config.SCRAPY_SETTINGS['DUPEFILTER_CLASS'] = 'webweeder.dupefilter.BloomDupeFilter'
+        config.SCRAPY_SETTINGS['BLOOM_DUPEFILTER_ERROR_RATE'] = config.DUPEFILTER_ERROR_RATE
+    if offload:
+        config.SCRAPY_SETTINGS['ITEM_PIPELINES'] = {'webweeder.pipelines.PageProcessingPipeline': 100}
     _log_system_info()
     _logger.debug(msg)
     click.echo()
@@ -73,68 +157,707 @@ def crawl(domains, alldomains, clean, outdir, useragent, statsinterval, parser,
     # Keeps track of statistics
     stats = StatsMonitor()
 
-    # Create and start the spiders specified by the user
+    if config.CRAWL_WORKERS > 1:
+        _crawl_with_workers(domains, stats)
+    else:
+        _run_spiders(domains, stats)
+    stats.log_stats()
+
+
+def _run_spiders(domains: List[str], stats, stop_event=None):
+    """
+    Creates and starts the spiders for the given domains: either one spider per domain, or one for all of them. Blocks
+    until the spiders finish
+    :param stats: Either a StatsMonitor, or a StatsForwarder in a worker process
+    :param stop_event: In a worker process, the event which the coordinating process sets to stop crawling, or None
+    to stop crawling on Ctrl-C instead
+    """
+    domain_configs = [configutils.get_config_for_domain(domain) for domain in domains]
+    spiders = [domain_configs] if config.SINGLE_SPIDER else [[domain_config] for domain_config in domain_configs]
     process = CrawlerProcess(config.SCRAPY_SETTINGS)
+    # Shared by every spider in this process
+    catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    try:
+        for spider_domains in spiders:
+            MonsterSpider.next_instance_domains = spider_domains
+            MonsterSpider.next_instance_stats = stats
+            MonsterSpider.next_instance_settings = _get_spider_settings(spider_domains)
+            MonsterSpider.next_instance_catalog = catalog
+            process.crawl(MonsterSpider)
+        if stop_event is None:
+            process.start()  # Blocks until the spiders finish
+            return
+
+        def stop_if_asked():
+            if stop_event.is_set():
+                stop_poll.stop()
+                process.stop()
+
+        stop_poll = LoopingCall(stop_if_asked)
+        stop_poll.start(1.0, now=False)
+        process.start(install_signal_handlers=False)  # Blocks until the spiders finish
+    finally:
+        catalog.close()
+
+
+def _crawl_with_workers(domains: List[str], stats: StatsMonitor):
+    """
+    Shares the given domains out between several worker processes which crawl into the same output directory, then
+    waits for them to finish. Statistics are aggregated by the given StatsMonitor as the workers crawl
+    """
+    started = datetime.utcnow()
+    assignments = _assign_workers(domains, config.CRAWL_WORKERS)
+    context = multiprocessing.get_context()
+    events = context.Queue()
+    stop_event = context.Event()
+    config_values = _snapshot_crawl_config()
+
+    workers = []
+    for (number, assignment) in enumerate(assignments):
+        _logger.info('Starting crawl worker %d for: %r' % (number, assignment))
+        worker = context.Process(target=_crawl_worker, name='crawl-worker-%d' % number,
+                                 args=(number, assignment, config_values, events, stop_event))
+        worker.start()
+        workers.append(worker)
+
+    interrupted = False
+    while True:
+        try:
+            _receive_stats_events(events, stats, workers)
+            break
+        except KeyboardInterrupt:
+            if interrupted:
+                click.echo(cli_vars.MSG_KILLING_WORKERS)
+                for worker in workers:
+                    worker.terminate()
+                break
+            interrupted = True
+            # The workers ignore Ctrl-C, so they stop gracefully when they're told to rather than all at once
+            click.echo(cli_vars.MSG_STOPPING_WORKERS)
+            stop_event.set()
+
+    for (number, worker) in enumerate(workers):
+        worker.join()
+        if worker.exitcode != 0:
+            _logger.error('Crawl worker %d exited with code %r' % (number, worker.exitcode))
+
+    # Domains which were split between several workers have only been crawled successfully if all of them finished
+    catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    try:
+        for assignment in assignments:
+            for (domain, part, parts) in assignment:
+                reasons = stats.finish_reasons.get(domain, [])
+                if (parts > 1) and (part == 0) and (reasons == (['finished'] * parts)):
+                    catalog.set_last_crawl(domain, started)
+    finally:
+        catalog.close()
+
+
+def _assign_workers(domains: List[str], workers: int) -> List[List[Tuple[str, int, int]]]:
+    """
+    :return: For each worker, the domains it should crawl. Each domain is given with the part of the domain the worker
+    should crawl, and how many parts the domain is split into. Domains are only split if there are more workers than
+    domains, in which case each worker crawls part of a single domain
+    """
+    if len(domains) >= workers:
+        return [[(domain, 0, 1) for domain in domains[number::workers]] for number in range(workers)]
+    assignments = []
+    for number in range(workers):
+        domain_number = number % len(domains)
+        parts = len(range(domain_number, workers, len(domains)))
+        assignments.append([(domains[domain_number], number // len(domains), parts)])
+    return assignments
+
+
+def _receive_stats_events(events, stats: StatsMonitor, workers: List[multiprocessing.Process]):
+    """
+    Passes events forwarded by the workers' StatsForwarders to the given StatsMonitor until every worker has exited
+    """
+    while any(worker.is_alive() for worker in workers):
+        try:
+            (method, args) = events.get(timeout=0.5)
+        except queue.Empty:
+            stats.tick()
+            continue
+        getattr(stats, method)(*args)
+    # Events sent just before a worker exited
+    while True:
+        try:
+            (method, args) = events.get_nowait()
+        except queue.Empty:
+            return
+        getattr(stats, method)(*args)
+
+
+def _crawl_worker(number: int, assignment: List[Tuple[str, int, int]], config_values: Dict[str, object], events,
+                  stop_event):
+    """
+    Runs in a crawl worker process if "--workers" is greater than 1
+    :param assignment: The domains to crawl, as returned by _assign_workers()
+    """
+    # Ctrl-C is handled by the coordinating process, which sets the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(config_values)
+    config.SEED_PARTITIONS = {domain: (part, parts) for (domain, part, parts) in assignment if parts > 1}
+
+    # Each worker logs to its own file, as log files can't safely be rotated by several processes at once
+    root_logger = getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    _configure_logging(date.today().strftime('%Y-%m-%d') + ('-worker%d.log' % number))
+
+    _run_spiders([domain for (domain, _, _) in assignment], StatsForwarder(events), stop_event)
+
+
+def _snapshot_crawl_config() -> Dict[str, object]:
+    """
+    :return: Every configuration value which crawl worker processes need to see, except the domain configs (which
+    aren't necessarily picklable, and which worker processes find in "config.py" by name)
+    """
+    return {key: value for (key, value) in vars(config).items()
+            if key.isupper() and (not key.startswith('_')) and (key != 'DOMAINS')}
+
+
+def _get_spider_settings(domains: List[DomainConfig]) -> Dict[str, object]:
+    """
+    :return: Scrapy settings which only apply to the spider for the given domains, overriding config.SCRAPY_SETTINGS
+    """
+    settings: Dict[str, object] = {}
+    if config.RESUMABLE_CRAWL:
+        # Each spider needs its own job directory
+        job_name = MonsterSpider.get_name(domains)
+        if (len(domains) == 1) and (domains[0].name in config.SEED_PARTITIONS):
+            # Several workers are crawling parts of the same domain
+            job_name += '-part%d-of-%d' % config.SEED_PARTITIONS[domains[0].name]
+        settings['JOBDIR'] = os.path.join(config.OUTPUT_DIRECTORY, config.JOBS_DIRECTORY_NAME, job_name)
+    if len(domains) > 1:
+        # Requests are downloaded in a separate slot for each domain, so per-domain concurrency limits and delays still
+        # apply. Let every domain have as many requests in-flight as it would with a spider of its own, and prefer
+        # whichever domains currently have the fewest, so no domain's queue gets starved by another's
+        settings['CONCURRENT_REQUESTS'] = config.CONCURRENT_REQUESTS * len(domains)
+        settings['SCHEDULER_PRIORITY_QUEUE'] = 'scrapy.pqueues.DownloaderAwarePriorityQueue'
+    if config.DUPEFILTER == DUPEFILTER_BLOOM:
+        # Size the Bloom filter for every domain crawled by the spider
+        settings['BLOOM_DUPEFILTER_CAPACITY'] = sum(
+            (domain.expected_urls if (domain.expected_urls is not None) else config.DUPEFILTER_CAPACITY)
+            for domain in domains)
+
+    # MonsterSpider downloads each domain's requests in a slot named after the domain
+    download_slots: Dict[str, Dict[str, object]] = {}
     for domain in domains:
-        MonsterSpider.next_instance_domain = configutils.get_config_for_domain(domain)
-        MonsterSpider.next_instance_callback = stats.on_page_crawled
-        process.crawl(MonsterSpider)
-    process.start()  # Blocks until the spiders finish
+        slot: Dict[str, object] = {}
+        if domain.concurrency is not None:
+            slot['concurrency'] = domain.concurrency
+        if domain.download_delay is not None:
+            slot['delay'] = domain.download_delay
+        if len(slot) != 0:
+            download_slots[domain.name] = slot
+    if len(download_slots) != 0:
+        settings['DOWNLOAD_SLOTS'] = download_slots
+    return settings
+
+
+def _get_download_settings() -> Dict[str, object]:
+    """
+    :return: Scrapy settings which control how quickly pages are downloaded, and how hard to try
+    """
+    return {
+        'CONCURRENT_REQUESTS': config.CONCURRENT_REQUESTS,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': config.CONCURRENT_REQUESTS_PER_DOMAIN,
+        'DOWNLOAD_DELAY': config.DOWNLOAD_DELAY,
+        'DOWNLOAD_TIMEOUT': config.DOWNLOAD_TIMEOUT,
+        'RETRY_TIMES': config.RETRY_TIMES,
+        'AUTOTHROTTLE_ENABLED': config.AUTOTHROTTLE,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': config.AUTOTHROTTLE_TARGET_CONCURRENCY,
+        'AUTOTHROTTLE_START_DELAY': max(config.AUTOTHROTTLE_START_DELAY, config.DOWNLOAD_DELAY),
+        'AUTOTHROTTLE_MAX_DELAY': config.AUTOTHROTTLE_MAX_DELAY,
+        'DNSCACHE_ENABLED': True,
+        'DNSCACHE_SIZE': config.DNS_CACHE_SIZE,
+        'DNS_TIMEOUT': config.DNS_TIMEOUT
+    }
 
 
 @click.command()
 @click.option('--clean', is_flag=True, help=cli_vars.HELP_CLEAN_WEED)
+@click.option('--incremental', is_flag=True, help=cli_vars.HELP_INCREMENTAL)
+@click.option('--ordered', is_flag=True, help=cli_vars.HELP_ORDERED)
+@click.option('--fromcatalog', is_flag=True, help=cli_vars.HELP_FROMCATALOG)
+@click.option('--domain', 'domains', multiple=True, help=cli_vars.HELP_DOMAIN)
 @click.option('--outdir', default=config.OUTPUT_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_OUTDIR)
 @click.option('--parser', default=config.HTML_PARSER, type=click.Choice(cli_vars.CHOICE_PARSERS),
               help=cli_vars.HELP_PARSER)
+@click.option('--jobs', default=config.WEED_JOBS, type=click.IntRange(min=1), help=cli_vars.HELP_JOBS)
+@click.option('--storage', default=config.STORAGE_BACKEND, type=click.Choice(STORAGE_BACKENDS),
+              help=cli_vars.HELP_STORAGE)
+@click.option('--compression', default=config.COMPRESSION, type=click.Choice(COMPRESSIONS),
+              help=cli_vars.HELP_COMPRESSION_WEED)
+@click.option('--export', is_flag=True, help=cli_vars.HELP_EXPORT)
+@click.option('--parquet/--no-parquet', default=config.EXPORT_PARQUET, help=cli_vars.HELP_PARQUET)
+@click.option('--analyze', is_flag=True, help=cli_vars.HELP_ANALYZE)
+@click.option('--profile/--no-profile', default=config.PROFILE, help=cli_vars.HELP_PROFILE_WEED)
+@click.option('--profileslowest', default=config.PROFILE_SLOWEST, type=click.IntRange(min=0),
+              help=cli_vars.HELP_PROFILESLOWEST)
 @click.option('--loglevel', default=config.LOG_LEVEL, type=click.Choice(cli_vars.CHOICE_LOGLEVEL),
               help=cli_vars.HELP_LOGLEVEL)
 @click.option('--logdir', default=config.LOG_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_LOGDIR)
-def weed(clean, outdir, parser, loglevel, logdir):
+def weed(clean, incremental, ordered, fromcatalog, domains, outdir, parser, jobs, storage, compression, export, parquet,
+         analyze, profile, profileslowest, loglevel, logdir):
     # TODO: docstring for command-line help and example usage
 
-    msg = 'weed: clean=%r, outdir=%r, parser=%r, logfile=%r, logdir=%r' \
-          % (clean, outdir, parser, loglevel, logdir)
+    msg = 'weed: clean=%r, incremental=%r, ordered=%r, fromcatalog=%r, domains=%r, outdir=%r, parser=%r, jobs=%r, ' \
+          'storage=%r, compression=%r, export=%r, parquet=%r, analyze=%r, profile=%r, profileslowest=%r, ' \
+          'logfile=%r, logdir=%r' \
+          % (clean, incremental, ordered, fromcatalog, domains, outdir, parser, jobs, storage, compression, export,
+             parquet, analyze, profile, profileslowest, loglevel, logdir)
 
     _configure(outdir, config.USER_AGENT, config.STATS_INTERVAL, parser, loglevel, logdir)
+    config.STORAGE_BACKEND = storage
+    config.COMPRESSION = resolve_compression(compression)
+    config.EXPORT_PARQUET = parquet
+    config.PROFILE = profile
+    config.PROFILE_SLOWEST = profileslowest
     _log_system_info()
     _logger.debug(msg)
     click.echo()
 
+    if (len(domains) != 0) and (not fromcatalog):
+        click.echo(cli_vars.ERROR_DOMAIN_WITHOUT_CATALOG)
+        return
+    if analyze and (not is_analysis_available()):
+        click.echo(cli_vars.ERROR_ANALYSIS_UNAVAILABLE)
+        return
+
+    if storage == STORAGE_SEGMENTS:
+        if incremental or fromcatalog:
+            click.echo(cli_vars.ERROR_UNSUPPORTED_WITH_SEGMENTS)
+            return
+        _weed_segments(clean, jobs)
+        if clean and analyze:
+            _clean_analysis()
+        if export or analyze:
+            _process_articles(iter_segment_pages(config.OUTPUT_DIRECTORY, PLAINTEXT_SEGMENT_PREFIX), export, analyze,
+                              jobs)
+        return
+
     # Clean the output directory if necessary
     if clean:
         click.echo(cli_vars.MSG_CLEANING)
-        file_pattern = os.path.join(config.OUTPUT_DIRECTORY, '**', 'plaintext_article.txt')
-        for file in glob(file_pattern, recursive=True):
-            _logger.debug('Cleaning file: %s' % file)
-            os.remove(file)
+        for file_name in ['plaintext_article.txt*', FINGERPRINT_FILE_NAME]:
+            file_pattern = os.path.join(config.OUTPUT_DIRECTORY, '**', file_name)
+            for file in glob(file_pattern, recursive=True):
+                _logger.debug('Cleaning file: %s' % file)
+                os.remove(file)
         click.echo()
 
     weeder = MonsterWeeder()
 
-    _logger.info('Collecting pages to weed...')
-    metadatas: List[str] = weeder.find_page_metadatas(config.OUTPUT_DIRECTORY)
-    metadatas.sort()
+    total: Optional[int] = None
+    if fromcatalog:
+        page_catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+        domain_filter = list(domains) if (len(domains) != 0) else None
+        total = page_catalog.count_pages(domains=domain_filter)
+        metadatas: Iterable[str] = page_catalog.find_metadata_paths(config.OUTPUT_DIRECTORY, domains=domain_filter,
+                                                                    ordered=ordered)
+        if total == 0:
+            click.echo(cli_vars.ERROR_NOTHING_TO_WEED)
+            click.echo()
+            return
+
+        # Confirm that the user wants to start weeding
+        click.echo('You are about to weed %d pages' % total)
+        click.confirm('Continue weeding %d pages?' % total, abort=True)
+        click.echo()
+    elif ordered:
+        _logger.info('Collecting pages to weed...')
+        metadatas = weeder.find_page_metadatas(config.OUTPUT_DIRECTORY)
+        total = len(metadatas)
+
+        _logger.debug('Collected %d pages to weed: %r' % (total, metadatas))
+        if total == 0:
+            click.echo(cli_vars.ERROR_NOTHING_TO_WEED)
+            click.echo()
+            return
+
+        # Confirm that the user wants to start weeding
+        click.echo('You are about to weed %d pages' % total)
+        click.confirm('Continue weeding %d pages?' % total, abort=True)
+        click.echo()
+    else:
+        # Pages are weeded as soon as they're found, so we can't know how many there are up-front
+        metadatas = weeder.iter_page_metadatas(config.OUTPUT_DIRECTORY)
+
+        # Confirm that the user wants to start weeding
+        click.echo('You are about to weed every page in: %s' % config.OUTPUT_DIRECTORY)
+        click.confirm('Continue weeding?', abort=True)
+        click.echo()
+
+    if clean and analyze:
+        _clean_analysis()
+
+    tasks = ((metadata, incremental) for metadata in metadatas)
+    results = ordered_map(_weed_page_worker, tasks, jobs=jobs,
+                          initializer=_init_worker, initargs=(_snapshot_config(),))
+    _log_weed_results(results, total)
+
+    if export or analyze:
+        # The pages are found again rather than remembered, so memory usage doesn't grow with the size of the corpus
+        if fromcatalog:
+            metadatas = page_catalog.find_metadata_paths(config.OUTPUT_DIRECTORY, domains=domain_filter,
+                                                         ordered=ordered)
+        elif not ordered:
+            metadatas = weeder.iter_page_metadatas(config.OUTPUT_DIRECTORY)
+        _process_articles(iter_directory_articles(config.OUTPUT_DIRECTORY, metadatas), export, analyze, jobs)
+
+
+def _clean_analysis():
+    """
+    Deletes the analysis of the weeded articles. Otherwise articles which have already been analyzed are skipped unless
+    they've changed
+    """
+    for file_path in delete_analysis(os.path.join(config.OUTPUT_DIRECTORY, config.ANALYSIS_DIRECTORY_NAME)):
+        _logger.debug('Cleaning file: %s' % file_path)
+
+
+def _process_articles(articles: Iterable[Tuple[PageMetadata, str]], export: bool, analyze: bool, jobs: int):
+    """
+    Reads every weeded article once, writing them into a fresh export of the corpus (see config.EXPORT_DIRECTORY_NAME)
+    and/or adding any new or changed ones to the analysis (see config.ANALYSIS_DIRECTORY_NAME)
+    :param articles: The metadata and plaintext article of each weeded page
+    :param jobs: How many worker processes to analyze articles with
+    """
+    export_dir = os.path.join(config.OUTPUT_DIRECTORY, config.EXPORT_DIRECTORY_NAME)
+    analysis_dir = os.path.join(config.OUTPUT_DIRECTORY, config.ANALYSIS_DIRECTORY_NAME)
+    exporter: Optional[CorpusExporter] = None
+    analyzer: Optional[TermAnalyzer] = None
+    if export:
+        _logger.info('Exporting articles into: %s' % export_dir)
+        exporter = CorpusExporter(export_dir, config.EXPORT_SHARD_ROWS, parquet=config.EXPORT_PARQUET)
+    if analyze:
+        _logger.info('Analyzing articles into: %s' % analysis_dir)
+        analyzer = TermAnalyzer(analysis_dir, config.ANALYSIS_TOKEN_PATTERN, config.ANALYSIS_BATCH_SIZE, jobs=jobs)
+    try:
+        for (meta, plaintext) in articles:
+            if exporter is not None:
+                exporter.add(meta, plaintext)
+            if analyzer is not None:
+                analyzer.add(meta, plaintext)
+    finally:
+        if exporter is not None:
+            exporter.close()
+        if analyzer is not None:
+            analyzer.close()
+
+    if exporter is not None:
+        _logger.info('Exported %d articles into %d shards in: %s' % (exporter.rows, exporter.shards, export_dir))
+    if analyzer is not None:
+        _logger.info('Analyzed %d new articles and %d changed articles in: %s'
+                     % (analyzer.added - analyzer.replaced, analyzer.replaced, analysis_dir))
+    click.echo()
+
 
-    _logger.debug('Collected %d pages to weed: %r' % (len(metadatas), metadatas))
-    if len(metadatas) == 0:
+def _weed_segments(clean: bool, jobs: int):
+    """
+    Weeds every page stored in segments, writing the plaintext of each into a fresh set of plaintext segments. Pages
+    are read sequentially, and only the most recently stored copy of each page is weeded. The existing plaintext
+    segments are always replaced, so "--clean" is implied, but only once weeding has finished, so they're kept if
+    weeding fails. Pages which fail to weed keep their previous plaintext, if they have any
+    """
+    # Confirm that the user wants to start weeding
+    click.echo('You are about to weed every page stored in segments in: %s' % config.OUTPUT_DIRECTORY)
+    click.confirm('Continue weeding?', abort=True)
+    click.echo()
+
+    # New segments are never given the same name as an existing one, so they can be written alongside the old ones
+    old_segments = find_segments(config.OUTPUT_DIRECTORY, PLAINTEXT_SEGMENT_PREFIX)
+    old_plaintexts = load_segment_index(config.OUTPUT_DIRECTORY, PLAINTEXT_SEGMENT_PREFIX)
+    writer = SegmentWriter(get_segments_directory(config.OUTPUT_DIRECTORY), PLAINTEXT_SEGMENT_PREFIX,
+                           config.SEGMENT_MAX_BYTES)
+
+    def store_results(results: Iterable[Tuple[str, Optional[bytes], Optional[str], Optional[profiling.PageProfile]]]):
+        for (url, record, error, page_profile) in results:
+            if record is not None:
+                writer.append(url, record, is_compressed=True)
+            elif url in old_plaintexts:
+                # Otherwise the page's plaintext would be lost along with the old segments
+                _logger.debug('Keeping previous plaintext of page which failed to weed: %s' % url)
+                writer.append(url, read_record(old_plaintexts[url], decompress=False), is_compressed=True)
+            yield url, (error is None), error, page_profile
+
+    # Pages are passed to workers still compressed, so decompressing them happens in parallel too
+    records = iter_latest_segment_payloads(config.OUTPUT_DIRECTORY, PAGE_SEGMENT_PREFIX, decompress=False)
+    results = ordered_map(_weed_record_worker, records, jobs=jobs,
+                          initializer=_init_worker, initargs=(_snapshot_config(),))
+    succeeded = False
+    try:
+        _log_weed_results(store_results(results), None)
+        succeeded = True
+    finally:
+        writer.close()
+        if not succeeded:
+            # Leave the plaintext segments as they were before weeding started
+            old_segment_paths = set(old_segments)
+            delete_segments(config.OUTPUT_DIRECTORY, PLAINTEXT_SEGMENT_PREFIX,
+                            [path for path in find_segments(config.OUTPUT_DIRECTORY, PLAINTEXT_SEGMENT_PREFIX)
+                             if path not in old_segment_paths])
+
+    removed = delete_segments(config.OUTPUT_DIRECTORY, PLAINTEXT_SEGMENT_PREFIX, old_segments)
+    if clean:
+        click.echo(cli_vars.MSG_CLEANING)
+        for segment_path in removed:
+            _logger.debug('Cleaning file: %s' % segment_path)
+        click.echo()
+
+
+def _log_weed_results(results: Iterable[Tuple[str, bool, Optional[str], Optional[profiling.PageProfile]]],
+                      total: Optional[int]):
+    """
+    :param results: The result of each weeded page, as returned by one of the weeding workers
+    :param total: How many pages are being weeded, or None if unknown
+    """
+    skipped = 0
+    failures: List[str] = []
+    processed = 0
+    profiler = profiling.Profiler(config.PROFILE_SLOWEST) if config.PROFILE else None
+    for (page, weeded, error, page_profile) in results:
+        processed += 1
+        if (profiler is not None) and (page_profile is not None):
+            profiler.add(page_profile)
+        log_info = (_out_of_str(processed, total), page)
+        if error is not None:
+            # Just log the failure with its stack trace
+            _logger.error('Failed to weed page %s: %s\n%s' % (log_info + (error,)))
+            failures.append(page)
+        elif weeded:
+            _logger.info('Weeded page %s: %s' % log_info)
+        else:
+            _logger.debug('Skipped up-to-date page %s: %s' % log_info)
+            skipped += 1
+
+    if processed == 0:
         click.echo(cli_vars.ERROR_NOTHING_TO_WEED)
         click.echo()
         return
+    _log_weed_summary(processed, skipped, failures)
+    if profiler is not None:
+        profiler.log_summary(_logger)
+        profile_dir = os.path.join(config.LOG_DIRECTORY, config.PROFILE_DIRECTORY_NAME,
+                                   datetime.now().strftime('weed-%Y%m%d-%H%M%S'))
+        for path in profiler.dump_slowest(profile_dir):
+            _logger.info('Dumped cProfile output of slow page: %s' % path)
+        click.echo()
 
-    # Confirm that the user wants to start weeding
-    click.echo('You are about to weed %d pages' % len(metadatas))
-    click.confirm('Continue weeding %d pages?' % len(metadatas), abort=True)
+
+@click.command()
+@click.option('--delete', is_flag=True, help=cli_vars.HELP_DELETE_CONVERTED)
+@click.option('--outdir', default=config.OUTPUT_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_OUTDIR)
+@click.option('--loglevel', default=config.LOG_LEVEL, type=click.Choice(cli_vars.CHOICE_LOGLEVEL),
+              help=cli_vars.HELP_LOGLEVEL)
+@click.option('--logdir', default=config.LOG_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_LOGDIR)
+def convert(delete, outdir, loglevel, logdir):
+    # TODO: docstring for command-line help and example usage
+
+    msg = 'convert: delete=%r, outdir=%r, logfile=%r, logdir=%r' % (delete, outdir, loglevel, logdir)
+
+    _configure(outdir, config.USER_AGENT, config.STATS_INTERVAL, config.HTML_PARSER, loglevel, logdir)
+    _log_system_info()
+    _logger.debug(msg)
     click.echo()
 
-    for (i, metadata) in enumerate(metadatas):
-        log_info = (_out_of_str(i + 1, len(metadatas)), metadata)
-        _logger.info('Weeding page %s: %s' % log_info)
+    # Confirm that the user wants to start converting
+    click.echo('You are about to convert every page stored in directories in %s into segments' % outdir)
+    if delete:
+        click.echo(cli_vars.MSG_DELETING_CONVERTED)
+    click.confirm('Continue converting?', abort=True)
+    click.echo()
+
+    store = SegmentPageStore(config.OUTPUT_DIRECTORY)
+    converted = 0
+    failed = 0
+    metadata_paths = MonsterWeeder().iter_page_metadatas(config.OUTPUT_DIRECTORY)
+    for (metadata_path, meta) in read_page_metadatas(metadata_paths):
+        if meta is None:
+            # Already logged
+            failed += 1
+            continue
         try:
-            weeder.weed_page(config.OUTPUT_DIRECTORY, metadata)
+            page_dir = os.path.join(config.OUTPUT_DIRECTORY, meta.directory)
+            raw_html = read_text_file(os.path.join(page_dir, meta.file_raw_html), missing_ok=False)
+            store.store_page(meta, raw_html)
         except Exception:
-            # Just log the failure with its stack trace
-            _logger.exception('Failed to weed page %s: %s\n' % log_info)
+            _logger.exception('Failed to convert page: %s\n' % metadata_path)
+            failed += 1
+            continue
+        converted += 1
+        _logger.info('Converted page %s: %s' % (_out_of_str(converted, None), metadata_path))
+        if delete:
+            for file_name in [meta.file_metadata, meta.file_raw_html, meta.file_article_plaintext,
+                              FINGERPRINT_FILE_NAME]:
+                file_path = find_compressed_file(os.path.join(page_dir, file_name))
+                if file_path is not None:
+                    os.remove(file_path)
+    store.close()
+
+    if delete:
+        delete_empty_directories(config.OUTPUT_DIRECTORY)
+    _logger.info('Converted %d pages successfully, %d failed' % (converted, failed))
+
+
+@click.group()
+@click.option('--outdir', default=config.OUTPUT_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_OUTDIR)
+@click.option('--loglevel', default=config.LOG_LEVEL, type=click.Choice(cli_vars.CHOICE_LOGLEVEL),
+              help=cli_vars.HELP_LOGLEVEL)
+@click.option('--logdir', default=config.LOG_DIRECTORY, type=click.Path(file_okay=False), help=cli_vars.HELP_LOGDIR)
+def catalog(outdir, loglevel, logdir):
+    # TODO: docstring for command-line help and example usage
+
+    msg = 'catalog: outdir=%r, logfile=%r, logdir=%r' % (outdir, loglevel, logdir)
+
+    _configure(outdir, config.USER_AGENT, config.STATS_INTERVAL, config.HTML_PARSER, loglevel, logdir)
+    _log_system_info()
+    _logger.debug(msg)
+
+
+@catalog.command(name='rebuild')
+def catalog_rebuild():
+    click.echo(cli_vars.MSG_REBUILDING_CATALOG)
+    page_catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    metadatas = MonsterWeeder().iter_page_metadatas(config.OUTPUT_DIRECTORY)
+    (added, failed) = rebuild_catalog(page_catalog, metadatas)
+    page_catalog.close()
+    click.echo('Catalogued %d pages, %d could not be read' % (added, failed))
+
+
+@catalog.command(name='count')
+@click.option('--domain', 'domains', multiple=True, help=cli_vars.HELP_DOMAIN)
+@click.option('--since', default=None, type=click.DateTime(formats=['%Y-%m-%d']), help=cli_vars.HELP_SINCE)
+@click.option('--until', default=None, type=click.DateTime(formats=['%Y-%m-%d']), help=cli_vars.HELP_UNTIL)
+def catalog_count(domains, since, until):
+    page_catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    domain_filter = list(domains) if (len(domains) != 0) else None
+    click.echo(page_catalog.count_pages(domains=domain_filter, since=since, until=until))
+    page_catalog.close()
+
+
+@catalog.command(name='find')
+@click.option('--domain', 'domains', multiple=True, help=cli_vars.HELP_DOMAIN)
+@click.option('--since', default=None, type=click.DateTime(formats=['%Y-%m-%d']), help=cli_vars.HELP_SINCE)
+@click.option('--until', default=None, type=click.DateTime(formats=['%Y-%m-%d']), help=cli_vars.HELP_UNTIL)
+def catalog_find(domains, since, until):
+    page_catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    domain_filter = list(domains) if (len(domains) != 0) else None
+    for meta in page_catalog.find_pages(domains=domain_filter, since=since, until=until, ordered=True):
+        click.echo('%s\t%s' % (meta.url, os.path.join(config.OUTPUT_DIRECTORY, meta.directory)))
+    page_catalog.close()
+
+
+@catalog.command(name='lookup')
+@click.argument('url')
+def catalog_lookup(url):
+    page_catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    meta = page_catalog.find_page(url)
+    page_catalog.close()
+    if meta is None:
+        click.echo(cli_vars.MSG_PAGE_NOT_CATALOGUED)
+        return
+    click.echo(page_metadata_to_json(meta, pretty=True))
+
+
+@catalog.command(name='duplicates')
+@click.option('--domain', 'domains', multiple=True, help=cli_vars.HELP_DOMAIN)
+def catalog_duplicates(domains):
+    page_catalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY))
+    domain_filter = list(domains) if (len(domains) != 0) else None
+    summary = page_catalog.summarize_duplicates(domains=domain_filter)
+    stored = page_catalog.count_pages(domains=domain_filter)
+    page_catalog.close()
+    if len(summary) == 0:
+        click.echo(cli_vars.MSG_NO_DUPLICATES)
+        return
+    for (domain, reason, count, size) in summary:
+        click.echo('Domain "%s": %d copies (same %s), %.2f MB not stored' % (domain, count, reason, size / MEGABYTES))
+    total_count = sum(count for (_, _, count, _) in summary)
+    total_size = sum(size for (_, _, _, size) in summary)
+    click.echo('Total: %d copies of %d stored pages, %.2f MB not stored (%.1f%% of pages crawled)'
+               % (total_count, stored, total_size / MEGABYTES, 100 * total_count / (total_count + stored)))
+
+
+def _weed_page_worker(task: Tuple[str, bool]) -> Tuple[str, bool, Optional[str], Optional[profiling.PageProfile]]:
+    """
+    Runs in a worker process if "--jobs" is greater than 1, so must not touch anything which isn't picklable
+    :param task: The metadata path of the page to weed, and whether to weed incrementally
+    :return: The given metadata path, whether the page was weeded (as opposed to skipped), the formatted stack trace
+    if weeding failed or None if it succeeded, and how long weeding the page took if config.PROFILE is set
+    """
+    (metadata_path, incremental) = task
+    with _profile_page(metadata_path) as page_profile:
+        try:
+            weeded = MonsterWeeder().weed_page(config.OUTPUT_DIRECTORY, metadata_path, incremental=incremental)
+            error = None
+        except Exception:
+            (weeded, error) = (False, format_exc())
+    return metadata_path, weeded, error, page_profile
+
+
+def _weed_record_worker(task: Tuple[str, bytes]) -> Tuple[str, Optional[bytes], Optional[str],
+                                                        Optional[profiling.PageProfile]]:
+    """
+    Like _weed_page_worker(), but for a page stored in a segment
+    :param task: The URL of the page and its record, still compressed
+    :return: The URL of the page, its compressed plaintext record or None if weeding failed, the formatted stack
+    trace if weeding failed or None if it succeeded, and how long weeding the page took if config.PROFILE is set
+    """
+    (url, payload) = task
+    record = None
+    error = None
+    with _profile_page(url) as page_profile:
+        try:
+            with profiling.stage(profiling.STAGE_READ) as timer:
+                (meta, raw_html) = decode_page_record(decompress_payload(payload))
+                timer.count_bytes(raw_html)
+            plaintext = MonsterWeeder().weed_html(meta, raw_html)
+            with profiling.stage(profiling.STAGE_WRITE) as timer:
+                timer.count_bytes(plaintext)
+                record = compress_payload(encode_page_record(meta, plaintext if (plaintext is not None) else ''))
+        except Exception:
+            error = format_exc()
+    return url, record, error, page_profile
+
+
+def _profile_page(page: str):
+    """
+    :return: A context which profiles weeding the given page if config.PROFILE is set, otherwise one which does nothing
+    """
+    if not config.PROFILE:
+        return nullcontext()
+    return profiling.profile_page(page, slowest=config.PROFILE_SLOWEST)
+
+
+def _snapshot_config() -> Dict[str, object]:
+    """
+    :return: Configuration values set on the command-line, which worker processes need to see. Needed because worker
+    processes re-import "config.py" from scratch on platforms which don't fork (i.e. Windows)
+    """
+    return {
+        'OUTPUT_DIRECTORY': config.OUTPUT_DIRECTORY,
+        'HTML_PARSER': config.HTML_PARSER,
+        'STORAGE_BACKEND': config.STORAGE_BACKEND,
+        'COMPRESSION': config.COMPRESSION,
+        'PROFILE': config.PROFILE,
+        'PROFILE_SLOWEST': config.PROFILE_SLOWEST
+    }
+
+
+def _init_worker(config_values: Dict[str, object]):
+    for (key, value) in config_values.items():
+        setattr(config, key, value)
+
+
+def _log_weed_summary(total: int, skipped: int, failures: List[str]):
+    weeded = (total - skipped - len(failures))
+    _logger.info('Weeded %d pages successfully, %d were already up to date, %d failed'
+                 % (weeded, skipped, len(failures)))
+    for failure in failures:
+        _logger.warning('Failed to weed page: %s' % failure)
 
 
 def _configure(outdir, useragent, statsinterval, parser, loglevel, logdir):
@@ -154,9 +877,13 @@ def _configure(outdir, useragent, statsinterval, parser, loglevel, logdir):
     os.makedirs(outdir, exist_ok=True)
     os.makedirs(logdir, exist_ok=True)
 
+    _configure_logging(date.today().strftime('%Y-%m-%d.log'))
+
+
+def _configure_logging(log_file_name: str):
     configure_logging(config.SCRAPY_SETTINGS)
 
-    log_file_path = os.path.join(config.LOG_DIRECTORY, date.today().strftime('%Y-%m-%d.log'))
+    log_file_path = os.path.join(config.LOG_DIRECTORY, log_file_name)
     file_handler = RotatingFileHandler(filename=log_file_path, maxBytes=(50 * MEGABYTES), backupCount=100)
     file_handler.setFormatter(get_scrapy_root_handler().formatter)
     file_handler.setLevel(DEBUG)
@@ -219,9 +946,12 @@ def _log_system_info():
     _logger.debug('')
 
 
-def _out_of_str(n1: int, n2: int) -> str:
+def _out_of_str(n1: int, n2: Optional[int]) -> str:
     """
-    :return A string in the format [n1 / n2], where "n1" and "n2" are the passed integers padded to the same length
+    :return A string in the format [n1 / n2], where "n1" and "n2" are the passed integers padded to the same length, or
+    in the format [n1] if "n2" is None
     """
+    if n2 is None:
+        return '[%d]' % n1
     width = len(str(max(n1, n2)))
     return '[%s / %s]' % (str(n1).rjust(width), str(n2).rjust(width))
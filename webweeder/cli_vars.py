@@ -2,7 +2,7 @@
 Contains values which are too long and would otherwise just clutter up cli.py
 """
 
-CHOICE_PARSERS = ['html.parser', 'html5lib', 'lxml']
+CHOICE_PARSERS = ['html.parser', 'html5lib', 'lxml', 'lxml-fast']
 CHOICE_LOGLEVEL = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
 
 HELP_ALLDOMAINS = 'Set this flag to crawl every single configured domain, instead of specifying a list of them.'
@@ -10,17 +10,98 @@ HELP_CLEAN_CRAWL = 'Set this flag to remove anything in the output directory bef
                    'Using this flag without specifying any domains will clean the output directory and exit.'
 HELP_CLEAN_WEED = 'Set this flag to remove all plaintext files in the output directory before crawling starts ' \
                   '(metadata and raw HTML files are preserved).'
+HELP_INCREMENTAL = 'Set this flag to skip pages which have already been weeded, unless their raw HTML or the ' \
+                   'extraction settings for their domain have changed since.'
+HELP_ORDERED = 'Set this flag to collect and sort every page before weeding starts, so pages are weeded in a ' \
+               'predictable order. Otherwise, pages are weeded in whatever order they are found.'
+HELP_FROMCATALOG = 'Set this flag to find pages to weed using the catalog instead of searching the output directory. ' \
+                   'Use "webcatalog rebuild" first if the output directory was crawled by an older version.'
+HELP_EXPORT = 'Set this flag to export every weeded article along with its metadata once weeding finishes, as ' \
+              'sharded and gzipped JSON Lines files in the "export" directory of the output directory.'
+HELP_PARQUET = 'Also export articles as Parquet files (requires the "pyarrow" package). Overrides any value set in ' \
+               '"config.py".'
+HELP_ANALYZE = 'Set this flag to add every newly weeded article to the term-document matrix and the term counts of ' \
+               'each domain per month, in the "analysis" directory of the output directory. Articles whose ' \
+               'plaintext has changed since they were analyzed replace their old counts.'
+HELP_PROFILE_CRAWL = 'Time each stage of processing every crawled page, and log a summary of the timings for each ' \
+                     'domain once crawling finishes. Overrides any value set in "config.py".'
+HELP_PROFILE_WEED = 'Time each stage of weeding every page, and log a summary of the timings for each domain once ' \
+                    'weeding finishes. Overrides any value set in "config.py".'
+HELP_PROFILESLOWEST = 'When profiling, also profile every page with cProfile and write the output for this many of ' \
+                      'the slowest pages to the "profiles" directory of the log directory. Overrides any value set ' \
+                      'in "config.py".'
+HELP_DOMAIN = 'Only include pages from this domain. Can be given more than once.'
+HELP_SINCE = 'Only include articles published on or after this date.'
+HELP_UNTIL = 'Only include articles published before this date.'
 HELP_OUTDIR = 'The directory to store results. Overrides any value set in "config.py".'
 HELP_USERAGENT = 'The user agent string to use for crawling. Overrides any value set in "config.py".'
-HELP_STATSINTERVAL = 'How often to log statistics, in seconds. Set to "-1" to disable statistics logging.'
+HELP_STATSINTERVAL = 'How often to log statistics and write crawl metrics to the log directory, in seconds. Set to ' \
+                     '"-1" to disable statistics logging.'
 HELP_PARSER = 'Which parser BeautifulSoup4 should use to parse HTML documents. ' \
-              'See: https://www.crummy.com/software/BeautifulSoup/bs4/doc/#installing-a-parser for details.'
+              'See: https://www.crummy.com/software/BeautifulSoup/bs4/doc/#installing-a-parser for details. ' \
+              '"lxml-fast" skips BeautifulSoup4 and uses lxml directly with precompiled selectors, which is much ' \
+              'faster and extracts exactly the same text as "lxml".'
+HELP_JOBS = 'How many worker processes to weed pages with. Set to the number of CPU cores to weed as fast as possible.'
+HELP_STORAGE = 'How pages are stored. "directory" stores each page in its own directory, "segments" appends pages to ' \
+               'large compressed segment files. Overrides any value set in "config.py".'
+HELP_COMPRESSION_CRAWL = 'How to compress raw HTML files. "zstd" falls back to "gzip" if the "zstandard" package ' \
+                         'isn\'t installed. Overrides any value set in "config.py".'
+HELP_COMPRESSION_WEED = 'How to compress plaintext files. "zstd" falls back to "gzip" if the "zstandard" package ' \
+                        'isn\'t installed. Overrides any value set in "config.py".'
+HELP_EXTRACT = 'Extract the plaintext of each article while crawling, so running "webweed" afterwards is optional. ' \
+               'Overrides any value set in "config.py".'
+HELP_OFFLOAD = 'Parse and store crawled pages in a pool of worker threads, so downloading can carry on in the ' \
+               'meantime. Overrides any value set in "config.py".'
+HELP_RESUME = 'Keep track of what\'s left to crawl in the output directory, so an interrupted crawl carries on ' \
+              'where it left off next time. Overrides any value set in "config.py".'
+HELP_INCREMENTAL_CRAWL = 'Don\'t crawl pages which have already been stored again, unless they are older than ' \
+                         '"--maxage". Overrides any value set in "config.py".'
+HELP_MAXAGE = 'When crawling incrementally, stored pages older than this many days are crawled again if they have ' \
+              'changed. Set to "-1" to never crawl stored pages again. Overrides any value set in "config.py".'
+HELP_SINCE_CRAWL = 'Only seed pages for dates on or after this date. Defaults to the date of the last successful ' \
+                   'crawl of each domain, or every date if the domain has never been crawled successfully. ' \
+                   'Overrides any value set in "config.py".'
+HELP_UNTIL_CRAWL = 'Only seed pages for dates before this date. Defaults to seeding up to and including today. ' \
+                   'Overrides any value set in "config.py".'
+HELP_SITEMAPS = 'Discover articles using the sitemaps of domains which have them, rather than by crawling from their ' \
+                'seed URLs. Only articles which are new or have changed are crawled. Overrides any value set in ' \
+                '"config.py".'
+HELP_SINGLESPIDER = 'Crawl every domain with a single spider rather than one spider per domain, taking turns between ' \
+                    'domains. Overrides any value set in "config.py".'
+HELP_WORKERS = 'How many worker processes to crawl with. Domains are shared out between the workers, and if there ' \
+               'are more workers than domains, the articles of each domain are shared out too. Overrides any value ' \
+               'set in "config.py".'
+HELP_CONCURRENCY = 'How many requests can be downloaded at once. Overrides any value set in "config.py".'
+HELP_DOMAINCONCURRENCY = 'How many requests can be downloaded from a single domain at once, unless overridden for ' \
+                         'the domain. Overrides any value set in "config.py".'
+HELP_DELAY = 'How long to wait (in seconds) between consecutive requests to the same domain, unless overridden for ' \
+             'the domain. Overrides any value set in "config.py".'
+HELP_TIMEOUT = 'How long to wait (in seconds) for a page to download before giving up, unless overridden for the ' \
+               'domain. Overrides any value set in "config.py".'
+HELP_RETRIES = 'How many times to retry a failed request before giving up, unless overridden for the domain. ' \
+               'Overrides any value set in "config.py".'
+HELP_AUTOTHROTTLE = 'Adapt the delay between requests to each domain to how quickly it responds. Overrides any ' \
+                    'value set in "config.py".'
+HELP_DUPEFILTER = 'How to remember which requests have already been made: "memory" remembers every request, "bloom" ' \
+                  'uses a fixed-size Bloom filter so memory usage stays flat on very long crawls, but may very ' \
+                  'occasionally skip a page. Overrides any value set in "config.py".'
+HELP_DEDUPE = 'Avoid storing pages which are copies of pages which have already been stored, because their URLs only ' \
+              'differ trivially or their articles are identical. Copies are only recorded in the catalog, and their ' \
+              'HTML is not stored. Off by default. Overrides any value set in "config.py".'
+HELP_DELETE_CONVERTED = 'Set this flag to delete each page\'s directory once it has been converted.'
 HELP_LOGLEVEL = 'Which messages to show on the console. Use DEBUG to show all messages. ' \
                 'Note that all messages will be written to the log file regardless.'
 HELP_LOGDIR = 'The directory to store log files. Overrides any value set in "config.py".'
 
 MSG_CLEANING = 'Cleaning output directory'
 MSG_CLEANING_AND_EXITING = '%s and exiting' % MSG_CLEANING
+MSG_DELETING_CONVERTED = 'Pages will be deleted from their directories once they have been converted'
+MSG_STOPPING_WORKERS = 'Stopping crawl workers once they have finished what they are doing, press Ctrl-C again to ' \
+                       'kill them'
+MSG_KILLING_WORKERS = 'Killing crawl workers'
+MSG_REBUILDING_CATALOG = 'Rebuilding catalog from the output directory'
+MSG_PAGE_NOT_CATALOGUED = 'No page has been catalogued with that URL'
+MSG_NO_DUPLICATES = 'No copies of stored pages have been found'
 
 ERROR_ALLDOMAINS_WITH_LIST = 'You cannot specify a list of domains when the "--alldomains" flag is used. ' \
                              'See "webcrawl --help" for usage.'
@@ -29,4 +110,10 @@ ERROR_UNCONFIGURED_DOMAIN = 'You are trying to crawl the "%s" domain, which hasn
                             'Make sure is has an entry in "config.py". See "webcrawl --help" for usage.'
 ERROR_DUPLICATE_DOMAINS = 'You have specified the "%s" domain more than once, which is invalid. ' \
                           'See "webcrawl --help" for usage.'
+ERROR_DOMAIN_WITHOUT_CATALOG = 'The "--domain" option can only be used together with the "--fromcatalog" flag. ' \
+                               'See "webweed --help" for usage.'
+ERROR_UNSUPPORTED_WITH_SEGMENTS = 'The "--incremental" and "--fromcatalog" flags can\'t be used to weed pages ' \
+                                  'stored in segments. See "webweed --help" for usage.'
+ERROR_ANALYSIS_UNAVAILABLE = 'The "--analyze" flag needs the "numpy" and "scipy" packages to be installed. Try ' \
+                             '"pip install numpy scipy".'
 ERROR_NOTHING_TO_WEED = 'There are no pages to weed. Have you tried the "webcrawl" command?'
@@ -1,8 +1,13 @@
-from typing import Optional
+from typing import Dict, List, Optional
 
 import config
 from webweeder.domainconfig import DomainConfig
 
+# Maps each domain's name to its config. Rebuilt whenever config.DOMAINS is replaced or resized
+_domain_index: Dict[str, DomainConfig] = {}
+_indexed_domains: Optional[List[DomainConfig]] = None
+_indexed_count: int = -1
+
 
 def get_config_for_domain(name: str) -> Optional[DomainConfig]:
     """
@@ -10,7 +15,17 @@ def get_config_for_domain(name: str) -> Optional[DomainConfig]:
     :return: The DomainConfig for the domain with the specified name, or None if no domains with the given domain are
     configured.
     """
-    for domain_config in config.DOMAINS:
-        if domain_config.name == name:
-            return domain_config
-    return None
+    return _get_domain_index().get(name)
+
+
+def _get_domain_index() -> Dict[str, DomainConfig]:
+    global _domain_index, _indexed_domains, _indexed_count
+    if (config.DOMAINS is not _indexed_domains) or (len(config.DOMAINS) != _indexed_count):
+        index: Dict[str, DomainConfig] = {}
+        for domain_config in config.DOMAINS:
+            # The first matching domain wins, same as a linear search
+            index.setdefault(domain_config.name, domain_config)
+        _domain_index = index
+        _indexed_domains = config.DOMAINS
+        _indexed_count = len(config.DOMAINS)
+    return _domain_index
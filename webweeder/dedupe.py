@@ -0,0 +1,51 @@
+import hashlib
+import re
+from typing import List, Optional, Pattern
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from w3lib.url import canonicalize_url as _w3lib_canonicalize_url
+
+import config
+
+# Why a page was found to be a duplicate of a page which had already been stored
+DUPLICATE_URL = 'url'
+DUPLICATE_CONTENT = 'content'
+
+_WHITESPACE = re.compile(r'\s+')
+
+_tracking_regexes: Optional[List[Pattern]] = None
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalizes the differences between URLs which almost certainly lead to the same page: "http" and "https", "www." and
+    the bare hostname, default ports, trailing and repeated slashes, fragments, the order of query parameters and any
+    tracking query parameters (see config.TRACKING_QUERY_PARAMETERS)
+    :return: The canonical form of the given URL, which is only used to compare URLs, never to download them
+    """
+    parts = urlsplit(_w3lib_canonicalize_url(url))
+    hostname = parts.hostname or ''
+    if hostname.startswith('www.'):
+        hostname = hostname[len('www.'):]
+    port = parts.port
+    netloc = hostname if (port is None) or (port in (80, 443)) else ('%s:%d' % (hostname, port))
+
+    path = re.sub('/{2,}', '/', parts.path).rstrip('/')
+    query = [(key, value) for (key, value) in parse_qsl(parts.query, keep_blank_values=True)
+             if not _is_tracking_parameter(key)]
+    return urlunsplit(('https', netloc, path, urlencode(sorted(query)), ''))
+
+
+def hash_article(plaintext: str) -> str:
+    """
+    :return: A digest of the given article, which ignores differences in whitespace
+    """
+    normalized = _WHITESPACE.sub(' ', plaintext).strip()
+    return hashlib.sha1(normalized.encode('utf8')).hexdigest()
+
+
+def _is_tracking_parameter(key: str) -> bool:
+    global _tracking_regexes
+    if _tracking_regexes is None:
+        _tracking_regexes = [re.compile(pattern, re.IGNORECASE) for pattern in config.TRACKING_QUERY_PARAMETERS]
+    return any(regex.fullmatch(key) is not None for regex in _tracking_regexes)
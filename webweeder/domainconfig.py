@@ -1,10 +1,77 @@
 import re
-from datetime import datetime
-from typing import List, Optional
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Pattern
+from urllib.parse import urlsplit
 
 from bs4 import BeautifulSoup
 from dateutil.parser import parse as parse_date
 
+from webweeder import extraction, profiling
+from webweeder.utils import iter_dates
+
+# Lazily generates seed URLs for the dates in a window. Given the first date (inclusive, or None for no lower bound) and
+# the last date (exclusive, or None to include today)
+SeedUrlGenerator = Callable[[Optional[date], Optional[date]], Iterable[str]]
+
+# How many article dates each domain remembers the parsed value of. Articles on the same day share the same date string
+_DATE_CACHE_SIZE = 4096
+
+
+class UrlMatcher:
+    """
+    Matches URLs against a list of regular expressions, which are combined and compiled once up-front
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns: List[str] = patterns
+        self._regex: Optional[Pattern] = None
+        self._regexes: List[Pattern] = []
+        if len(patterns) == 0:
+            return
+        try:
+            # One combined regex is much quicker to match than trying each pattern in turn
+            self._regex = re.compile('|'.join('(?:%s)' % pattern for pattern in patterns))
+        except re.error:
+            # Eg. the same named group is used by more than one pattern
+            self._regexes = [re.compile(pattern) for pattern in patterns]
+
+    def matches(self, url: str) -> bool:
+        """
+        :return: True if any of the patterns match the start of the given URL
+        """
+        if self._regex is not None:
+            return self._regex.match(url) is not None
+        for regex in self._regexes:
+            if regex.match(url) is not None:
+                return True
+        return False
+
+
+class HostnameIndex:
+    """
+    Finds which of a set of domains a URL belongs to from its hostname alone, including subdomains (eg. "www."), so
+    it's just as quick with dozens of domains as it is with one
+    """
+
+    def __init__(self, domains: List['DomainConfig']):
+        self._domains: Dict[str, DomainConfig] = {}
+        for domain in domains:
+            # The first matching domain wins, same as configutils.get_config_for_domain()
+            self._domains.setdefault(domain.name.lower(), domain)
+
+    def find_domain(self, url: str) -> Optional['DomainConfig']:
+        """
+        :return: The domain which the given URL belongs to, or None if it doesn't belong to any of them
+        """
+        hostname = urlsplit(url).hostname
+        while hostname:
+            domain = self._domains.get(hostname)
+            if domain is not None:
+                return domain
+            # Try the parent domain, eg. "www.example.com" -> "example.com"
+            hostname = hostname.partition('.')[2]
+        return None
+
 
 class DomainConfig:
     def __init__(self,
@@ -15,10 +82,21 @@ class DomainConfig:
                  article_title_selector: Optional[str] = None,
                  article_date_selector: Optional[str] = None,
                  article_date_junk: Optional[List[str]] = None,
-                 article_content_selector: Optional[str] = None):
+                 article_content_selector: Optional[str] = None,
+                 follow_patterns: Optional[List[str]] = None,
+                 max_depth: Optional[int] = None,
+                 max_pages: Optional[int] = None,
+                 seed_url_generator: Optional[SeedUrlGenerator] = None,
+                 sitemap_urls: Optional[List[str]] = None,
+                 concurrency: Optional[int] = None,
+                 download_delay: Optional[float] = None,
+                 download_timeout: Optional[float] = None,
+                 max_retry_times: Optional[int] = None,
+                 expected_urls: Optional[int] = None,
+                 article_date_formats: Optional[List[str]] = None):
         """
         :param name:
-        :param url_patterns:
+        :param url_patterns: Regular expressions matching the URLs of pages which should be stored
         :param seed_urls:
         :param page_title_selector:
         :param article_title_selector:
@@ -26,9 +104,30 @@ class DomainConfig:
         :param article_date_junk: Ordered list of regular expressions to remove from article dates, eg. clashdaily.com
         article dates are prefixed with: "Published on"
         :param article_content_selector:
+        :param follow_patterns: Regular expressions matching the URLs of pages which aren't stored, but which should be
+        crawled to find more pages (eg. daily summary pages and pagination). Links to pages matching neither these nor
+        'url_patterns' are never crawled. If None, every link on the domain is crawled
+        :param max_depth: How many links away from the seed URLs to crawl, or None for no limit
+        :param max_pages: Roughly how many pages to download before no more links are crawled, or None for no limit.
+        Requests which are already queued when the budget runs out are still downloaded
+        :param seed_url_generator: Lazily generates more seed URLs for a window of dates (see daily_seed_urls()), so
+        there's no need to build a list of thousands of seed URLs up-front. These are seeded after 'seed_urls', which
+        are always seeded regardless of the window
+        :param sitemap_urls: URLs of the domain's sitemaps (or sitemap indexes). When sitemap discovery is enabled,
+        these are crawled instead of the seed URLs, and only articles which are new or have changed are crawled
+        :param concurrency: Overrides config.CONCURRENT_REQUESTS_PER_DOMAIN for this domain, or None for no override
+        :param download_delay: Overrides config.DOWNLOAD_DELAY for this domain, or None for no override
+        :param download_timeout: Overrides config.DOWNLOAD_TIMEOUT for this domain, or None for no override
+        :param max_retry_times: Overrides config.RETRY_TIMES for this domain, or None for no override
+        :param expected_urls: Overrides config.DUPEFILTER_CAPACITY for this domain, or None for no override
+        :param article_date_formats: Ordered list of formats (see datetime.strptime()) to parse article dates with, once
+        'article_date_junk' has been removed, eg. "%B %d, %Y". Dates which don't match any of them are parsed by
+        dateutil, which is much slower and has to guess the format
         """
         if article_date_junk is None:
             article_date_junk = []
+        if article_date_formats is None:
+            article_date_formats = []
         self.name: str = name
         self.url_patterns: List[str] = url_patterns
         self.seed_urls: List[str] = seed_urls
@@ -37,13 +136,41 @@ class DomainConfig:
         self.article_date_selector: Optional[str] = article_date_selector
         self.article_date_junk: List[str] = article_date_junk
         self.article_content_selector: Optional[str] = article_content_selector
+        self.follow_patterns: Optional[List[str]] = follow_patterns
+        self.max_depth: Optional[int] = max_depth
+        self.max_pages: Optional[int] = max_pages
+        self.seed_url_generator: Optional[SeedUrlGenerator] = seed_url_generator
+        self.sitemap_urls: Optional[List[str]] = sitemap_urls
+        self.concurrency: Optional[int] = concurrency
+        self.download_delay: Optional[float] = download_delay
+        self.download_timeout: Optional[float] = download_timeout
+        self.max_retry_times: Optional[int] = max_retry_times
+        self.expected_urls: Optional[int] = expected_urls
+        self.article_date_formats: List[str] = article_date_formats
+
+        self.url_matcher: UrlMatcher = UrlMatcher(url_patterns)
+        self.article_date_junk_regexes: List[Pattern] = [re.compile(junk, re.IGNORECASE) for junk in article_date_junk]
+        self._date_cache: Dict[str, datetime] = {}
 
     def includes_url(self, url: str) -> bool:
-        for pattern in self.url_patterns:
-            regex = re.compile(pattern)
-            if regex.match(url) is not None:
-                return True
-        return False
+        return self.url_matcher.matches(url)
+
+    def iter_seed_urls(self, since: Optional[date] = None, until: Optional[date] = None) -> Iterator[str]:
+        """
+        :param since: Only generate seed URLs for dates on or after this date, or None for no lower bound
+        :param until: Only generate seed URLs for dates before this date, or None to include today
+        """
+        yield from self.seed_urls
+        if self.seed_url_generator is not None:
+            yield from self.seed_url_generator(since, until)
+
+    def parse_html(self, raw_html: str, parser: str) -> 'extraction.ParsedPage':
+        """
+        :param parser: Which parser BeautifulSoup should use (see config.HTML_PARSER), or extraction.PARSER_LXML_FAST
+        :return: The page parsed ready to be passed to the 'scrape_*' methods. Always a BeautifulSoup tree, unless
+        overridden by a subclass which supports extraction.PARSER_LXML_FAST
+        """
+        return extraction.parse_html(raw_html, parser, None)
 
     def scrape_article_title(self, soup: BeautifulSoup) -> Optional[str]:
         """
@@ -69,6 +196,33 @@ class DomainConfig:
         """
         raise NotImplementedError
 
+    def scrape_article_content(self, soup: BeautifulSoup) -> Optional[str]:
+        """
+        IMPORTANT: This may modify the passed soup, so scrape everything else first
+
+        If 'article_content_selector' is None, None is returned
+        If 'article_content_selector' is not None, the scraped article content is returned as plaintext
+        If 'article_content_selector' is not None but the article content cannot be scraped, an error is raised
+        """
+        raise NotImplementedError
+
+
+def daily_seed_urls(url_format: str, first_date: date) -> SeedUrlGenerator:
+    """
+    :param url_format: Format of the URL for each date, given the year, month and day, eg. the URL of a daily summary
+    page: "https://example.com/%04d/%02d/%02d/"
+    :param first_date: The earliest date worth seeding
+    :return: A generator of one seed URL for each date in the window, newest first
+    """
+
+    def generate(since: Optional[date], until: Optional[date]) -> Iterator[str]:
+        start = first_date if (since is None) else max(since, first_date)
+        end = date.today() if (until is None) else (until - timedelta(days=1))
+        for d in iter_dates(start, end, reverse=True):
+            yield url_format % (d.year, d.month, d.day)
+
+    return generate
+
 
 class SimpleDomainConfig(DomainConfig):
     @classmethod
@@ -80,19 +234,47 @@ class SimpleDomainConfig(DomainConfig):
         """
         if selector is None:
             return None
-        element = soup.select_one(selector)
-        text = element.get_text()
-        return text.strip()
+        with profiling.stage(profiling.STAGE_SELECT):
+            if not isinstance(soup, BeautifulSoup):
+                # Parsed for extraction.PARSER_LXML_FAST
+                element = extraction.select_one(soup, selector)
+                if element is None:
+                    raise ValueError('Nothing matches selector: %s' % selector)
+                return extraction.get_text(element).strip()
+            element = soup.select_one(selector)
+            text = element.get_text()
+            return text.strip()
 
     def parse_date(self, date_str: str) -> datetime:
         """
         Raises if the given date string cannot be parsed
         """
-        for junk in self.article_date_junk:
-            date_str = re.sub(junk, '', date_str, flags=re.IGNORECASE)
+        parsed = self._date_cache.get(date_str)
+        if parsed is not None:
+            return parsed
+        parsed = self._parse_date_uncached(date_str)
+        if len(self._date_cache) >= _DATE_CACHE_SIZE:
+            # Dates are crawled roughly in order, so old ones are unlikely to turn up again
+            self._date_cache.clear()
+        self._date_cache[date_str] = parsed
+        return parsed
+
+    def _parse_date_uncached(self, date_str: str) -> datetime:
+        for junk in self.article_date_junk_regexes:
+            date_str = junk.sub('', date_str)
             date_str = date_str.strip()
+        for date_format in self.article_date_formats:
+            try:
+                return datetime.strptime(date_str, date_format)
+            except ValueError:
+                continue
         return parse_date(date_str)
 
+    def parse_html(self, raw_html: str, parser: str) -> 'extraction.ParsedPage':
+        selectors = [self.page_title_selector, self.article_title_selector, self.article_date_selector,
+                     self.article_content_selector]
+        return extraction.parse_html(raw_html, parser, selectors)
+
     def scrape_article_title(self, soup: BeautifulSoup) -> Optional[str]:
         return self.select_text(soup, self.article_title_selector)
 
@@ -102,3 +284,16 @@ class SimpleDomainConfig(DomainConfig):
 
     def scrape_page_title(self, soup: BeautifulSoup) -> Optional[str]:
         return self.select_text(soup, self.page_title_selector)
+
+    def scrape_article_content(self, soup: BeautifulSoup) -> Optional[str]:
+        if self.article_content_selector is None:
+            return None
+        if not isinstance(soup, BeautifulSoup):
+            # Scripts and styles are skipped by extraction.get_text(), so there's no need to remove them
+            return self.select_text(soup, self.article_content_selector)
+        with profiling.stage(profiling.STAGE_STRIP):
+            for crap in soup.find_all(name='script'):
+                crap.extract()
+            for crap in soup.find_all(name='style'):
+                crap.extract()
+        return self.select_text(soup, self.article_content_selector)
@@ -0,0 +1,150 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+from logging import getLogger
+from typing import Optional
+
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.http import Request
+from scrapy.utils.job import job_dir
+
+_logger = getLogger(__name__)
+
+DUPEFILTER_MEMORY = 'memory'
+DUPEFILTER_BLOOM = 'bloom'
+DUPEFILTERS = [DUPEFILTER_MEMORY, DUPEFILTER_BLOOM]
+
+# Name of the file which BloomDupeFilter keeps in the job directory of a resumable crawl
+BLOOM_FILE_NAME = 'requests.bloom'
+
+# The file starts with this header: a magic number, the number of hash functions and the number of bits
+_BLOOM_HEADER = struct.Struct('>4sIQ')
+_BLOOM_MAGIC = b'WWBF'
+
+
+class BloomFilter:
+    """
+    A fixed-size set of keys which never forgets a key it has seen, but which may (rarely) claim to have seen a key it
+    hasn't. Its bits are memory-mapped, either from a file so they survive restarts, or anonymously, so its memory usage
+    never grows past its size however many keys are added
+    """
+
+    def __init__(self, file_path: Optional[str], capacity: int, error_rate: float):
+        """
+        :param file_path: Where to keep the filter, or None to keep it in memory. If the file already exists, the filter
+        carries on from where it left off (with the size it was created with)
+        :param capacity: How many keys the filter is expected to hold
+        :param error_rate: The chance of a key being wrongly reported as seen once the filter holds 'capacity' keys
+        """
+        bits = max(int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        hashes = max(int(round((bits / capacity) * math.log(2))), 1)
+        self.file_path: Optional[str] = file_path
+        self._file = None
+        if file_path is None:
+            self._bits = mmap.mmap(-1, _BLOOM_HEADER.size + (bits + 7) // 8)
+        else:
+            (hashes, bits) = self._open_file(file_path, hashes, bits)
+        self.hashes: int = hashes
+        self.bits: int = bits
+
+    def _open_file(self, file_path: str, hashes: int, bits: int):
+        if os.path.isfile(file_path):
+            self._file = open(file_path, 'r+b')
+            (magic, existing_hashes, existing_bits) = _BLOOM_HEADER.unpack(self._file.read(_BLOOM_HEADER.size))
+            if magic != _BLOOM_MAGIC:
+                raise ValueError('Not a bloom filter: %s' % file_path)
+            if existing_bits != bits:
+                _logger.info('Reusing existing bloom filter of %d bits rather than %d bits: %s'
+                             % (existing_bits, bits, file_path))
+            (hashes, bits) = (existing_hashes, existing_bits)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            self._file = open(file_path, 'x+b')
+            self._file.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, hashes, bits))
+            # Sparse on most file systems, so space is only used as bits get set
+            self._file.truncate(_BLOOM_HEADER.size + (bits + 7) // 8)
+        self._bits = mmap.mmap(self._file.fileno(), 0)
+        return hashes, bits
+
+    def add(self, key: bytes) -> bool:
+        """
+        :return: True if the key (probably) had already been added, otherwise False
+        """
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        # Double hashing: the positions of the key's bits are h1, h1 + h2, h1 + 2*h2, ...
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        bits = self._bits
+        seen = True
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.bits
+            index = _BLOOM_HEADER.size + (position >> 3)
+            mask = 1 << (position & 7)
+            byte = bits[index]
+            if not (byte & mask):
+                seen = False
+                bits[index] = byte | mask
+        return seen
+
+    def close(self, delete: bool = False):
+        """
+        :param delete: Set to True to delete the filter's file, if it has one
+        """
+        if self._file is not None:
+            self._bits.flush()
+        self._bits.close()
+        if self._file is not None:
+            self._file.close()
+            if delete:
+                os.remove(self.file_path)
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """
+    Filters out duplicate requests using a BloomFilter of request fingerprints, rather than Scrapy's default set of
+    fingerprints which grows without bound. Sized by the BLOOM_DUPEFILTER_CAPACITY and BLOOM_DUPEFILTER_ERROR_RATE
+    settings. A tiny fraction of requests which aren't duplicates will be filtered out too.
+
+    For resumable crawls the filter is kept in the job directory, and deleted once the crawl finishes
+    """
+
+    def __init__(self, file_path: Optional[str], capacity: int, error_rate: float, fingerprinter=None,
+                 debug: bool = False):
+        self.bloom: BloomFilter = BloomFilter(file_path, capacity, error_rate)
+        self.fingerprinter = fingerprinter
+        self.debug: bool = debug
+        self._logged_duplicate: bool = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = job_dir(settings)
+        file_path = os.path.join(directory, BLOOM_FILE_NAME) if (directory is not None) else None
+        return cls(file_path, settings.getint('BLOOM_DUPEFILTER_CAPACITY'),
+                   settings.getfloat('BLOOM_DUPEFILTER_ERROR_RATE'),
+                   getattr(crawler, 'request_fingerprinter', None), settings.getbool('DUPEFILTER_DEBUG'))
+
+    def request_seen(self, request: Request) -> bool:
+        return self.bloom.add(self._fingerprint(request))
+
+    def _fingerprint(self, request: Request) -> bytes:
+        if self.fingerprinter is not None:
+            return self.fingerprinter.fingerprint(request)
+        # Versions of Scrapy before 2.7 don't have request fingerprinters
+        from scrapy.utils.request import request_fingerprint
+        return bytes.fromhex(request_fingerprint(request))
+
+    def close(self, reason: str):
+        # Once the crawl has finished there's nothing left to resume
+        self.bloom.close(delete=(reason == 'finished'))
+
+    def log(self, request: Request, spider):
+        if self.debug:
+            _logger.debug('Filtered duplicate request: %s' % request, extra={'spider': spider})
+        elif not self._logged_duplicate:
+            _logger.debug('Filtered duplicate request: %s - no more duplicates will be shown (see DUPEFILTER_DEBUG to '
+                          'show all duplicates)' % request, extra={'spider': spider})
+            self._logged_duplicate = True
+        spider.crawler.stats.inc_value('dupefilter/filtered')
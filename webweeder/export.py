@@ -0,0 +1,141 @@
+import gzip
+import os
+from datetime import datetime
+from glob import escape, glob
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from webweeder.models import PAGE_METADATA_FIELDS, PageMetadata, page_metadata_to_dict, read_page_metadatas
+from webweeder.utils import find_compressed_file, read_text_file, to_compact_json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+_logger = getLogger(__name__)
+
+# Start of each shard's file name
+EXPORT_SHARD_PREFIX = 'articles'
+JSONL_EXTENSION = '.jsonl.gz'
+PARQUET_EXTENSION = '.parquet'
+
+# Name of the column holding each page's plaintext article, alongside a column for each field of PageMetadata
+ARTICLE_COLUMN = 'article'
+
+# How many rows are buffered before they're written to a Parquet file
+_PARQUET_ROW_GROUP_ROWS = 1000
+# Shards are written under a temporary name, so a shard which exists is always complete
+_PARTIAL_EXTENSION = '.partial'
+
+
+class CorpusExporter:
+    """
+    Streams articles along with their metadata into shards of gzipped JSON Lines, and optionally Parquet files too,
+    starting a new shard every 'shard_rows' rows. Rows are written as they're added, so memory usage stays the same
+    however big the corpus is. Each row of the JSON Lines shards is an object with the fields of PageMetadata plus an
+    "article" field
+    """
+
+    def __init__(self, directory: str, shard_rows: int, parquet: bool = False):
+        """
+        :param directory: Where to write the shards. Any shards from a previous export are deleted
+        :param shard_rows: How many rows to write to each shard before starting a new one
+        :param parquet: Set to True to write a Parquet file for each shard too, if the "pyarrow" package is installed
+        """
+        if parquet and (pyarrow is None):
+            _logger.warning('Parquet export requested but the "pyarrow" package isn\'t installed, only exporting JSON '
+                            'Lines instead')
+            parquet = False
+        os.makedirs(directory, exist_ok=True)
+        for extension in [JSONL_EXTENSION, PARQUET_EXTENSION]:
+            pattern = os.path.join(escape(directory), '%s-*%s*' % (EXPORT_SHARD_PREFIX, extension))
+            for old_shard_path in glob(pattern):
+                _logger.debug('Deleting previously exported shard: %s' % old_shard_path)
+                os.remove(old_shard_path)
+
+        self.directory: str = directory
+        self.shard_rows: int = shard_rows
+        self.parquet: bool = parquet
+        # How many rows and shards have been written so far
+        self.rows: int = 0
+        self.shards: int = 0
+        self._shard_path: Optional[str] = None
+        self._shard_file: Optional[TextIO] = None
+        self._shard_row_count: int = 0
+        self._parquet_writer = None
+        self._parquet_rows: List[Dict[str, object]] = []
+
+    def add(self, meta: PageMetadata, plaintext: str):
+        if (self._shard_file is None) or (self._shard_row_count >= self.shard_rows):
+            self._start_shard()
+        row = page_metadata_to_dict(meta)
+        row[ARTICLE_COLUMN] = plaintext
+        self._shard_file.write(to_compact_json(row))
+        self._shard_file.write('\n')
+        if self.parquet:
+            # Dates are stored as timestamps rather than strings
+            row.update((name, getattr(meta, name)) for (name, field_type) in PAGE_METADATA_FIELDS.items()
+                       if field_type is datetime)
+            self._parquet_rows.append(row)
+            if len(self._parquet_rows) >= _PARQUET_ROW_GROUP_ROWS:
+                self._flush_parquet()
+        self._shard_row_count += 1
+        self.rows += 1
+
+    def close(self):
+        self._finish_shard()
+
+    def _start_shard(self):
+        self._finish_shard()
+        self._shard_path = os.path.join(self.directory, '%s-%05d' % (EXPORT_SHARD_PREFIX, self.shards))
+        self._shard_file = gzip.open(self._shard_path + JSONL_EXTENSION + _PARTIAL_EXTENSION, 'wt', encoding='utf8')
+        self._shard_row_count = 0
+        if self.parquet:
+            self._parquet_writer = pyarrow.parquet.ParquetWriter(
+                self._shard_path + PARQUET_EXTENSION + _PARTIAL_EXTENSION, _get_parquet_schema())
+        self.shards += 1
+
+    def _finish_shard(self):
+        if self._shard_file is None:
+            return
+        self._shard_file.close()
+        os.replace(self._shard_path + JSONL_EXTENSION + _PARTIAL_EXTENSION, self._shard_path + JSONL_EXTENSION)
+        if self._parquet_writer is not None:
+            self._flush_parquet()
+            self._parquet_writer.close()
+            os.replace(self._shard_path + PARQUET_EXTENSION + _PARTIAL_EXTENSION, self._shard_path + PARQUET_EXTENSION)
+            self._parquet_writer = None
+        _logger.info('Exported shard: %s' % self._shard_path)
+        self._shard_file = None
+
+    def _flush_parquet(self):
+        if len(self._parquet_rows) == 0:
+            return
+        table = pyarrow.Table.from_pylist(self._parquet_rows, schema=_get_parquet_schema())
+        self._parquet_writer.write_table(table)
+        self._parquet_rows = []
+
+
+def iter_directory_articles(base_dir: str, metadata_paths: Iterable[str]) -> Iterator[Tuple[PageMetadata, str]]:
+    """
+    Reads the metadata and plaintext article of each page stored in its own directory. Pages which haven't been weeded
+    yet (or whose metadata can't be read) are skipped
+    """
+    for (metadata_path, meta) in read_page_metadatas(metadata_paths):
+        if meta is None:
+            # Already logged
+            continue
+        plaintext_path = find_compressed_file(os.path.join(base_dir, meta.directory, meta.file_article_plaintext))
+        if plaintext_path is None:
+            _logger.debug('Not exporting page which hasn\'t been weeded: %s' % metadata_path)
+            continue
+        yield meta, read_text_file(plaintext_path, missing_ok=False)
+
+
+def _get_parquet_schema():
+    fields = [(name, pyarrow.timestamp('us') if (field_type is datetime) else pyarrow.string())
+              for (name, field_type) in PAGE_METADATA_FIELDS.items()]
+    fields.append((ARTICLE_COLUMN, pyarrow.string()))
+    return pyarrow.schema(fields)
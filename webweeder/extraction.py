@@ -0,0 +1,122 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
+from bs4 import BeautifulSoup
+from cssselect import SelectorError
+from lxml.cssselect import CSSSelector
+from lxml.etree import HTMLParser, ParserError, TreeBuilder, XMLSyntaxError, _Element
+
+# Extracts text with lxml directly using precompiled CSS selectors, rather than by building a BeautifulSoup tree. Can be
+# used as config.HTML_PARSER, and produces exactly the same text as BeautifulSoup with the "lxml" parser
+PARSER_LXML_FAST = 'lxml-fast'
+
+# A page parsed by parse_html(): either a BeautifulSoup tree, or an lxml document when PARSER_LXML_FAST is in use
+ParsedPage = Union[BeautifulSoup, _Element]
+
+# BeautifulSoup leaves the text inside these elements out of get_text(), so they're skipped to produce the same text
+_NON_CONTENT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+# Inside these elements, BeautifulSoup leaves strings of nothing but whitespace as they are
+_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+_ASCII_WHITESPACE = ' \n\t\x0c\r'
+
+
+def parse_html(raw_html: str, parser: str, selectors: Optional[List[Optional[str]]]) -> ParsedPage:
+    """
+    :param parser: Which parser BeautifulSoup should use, or PARSER_LXML_FAST
+    :param selectors: The selectors which are going to be used on the page, or None if they're unknown. If
+    PARSER_LXML_FAST is in use but the selectors are unknown or any of them can't be compiled for lxml, the page is
+    parsed with BeautifulSoup (using the "lxml" parser) instead
+    """
+    if parser != PARSER_LXML_FAST:
+        return BeautifulSoup(raw_html, parser)
+    if (selectors is None) or any((compile_selector(selector) is None) for selector in selectors if selector):
+        return BeautifulSoup(raw_html, 'lxml')
+    # Fed in the same way as BeautifulSoup feeds lxml, so the document is parsed into exactly the same tree. Built by a
+    # parser target like BeautifulSoup's, as lxml otherwise drops elements nested more than 255 deep
+    builder = _DocumentBuilder()
+    lxml_parser = HTMLParser(recover=True, target=builder)
+    try:
+        lxml_parser.feed(raw_html)
+        lxml_parser.close()
+    except (ParserError, XMLSyntaxError):
+        return BeautifulSoup(raw_html, 'lxml')
+    if builder.root is None:
+        # Eg. the document is empty or nothing but a comment, which BeautifulSoup copes with
+        return BeautifulSoup(raw_html, 'lxml')
+    return builder.root
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector: str) -> Optional[CSSSelector]:
+    """
+    :return: The given CSS selector compiled for lxml, or None if lxml doesn't support it (but BeautifulSoup may)
+    """
+    try:
+        # Matches element and attribute names case-insensitively, like BeautifulSoup does on HTML
+        return CSSSelector(selector, translator='html')
+    except SelectorError:
+        return None
+
+
+def select_one(document: _Element, selector: str) -> Optional[_Element]:
+    """
+    :return: The first element matching the given selector, like BeautifulSoup's select_one(), or None if there isn't
+    one
+    """
+    matches = compile_selector(selector)(document)
+    return matches[0] if (len(matches) != 0) else None
+
+
+def get_text(element: _Element) -> str:
+    """
+    :return: All of the text inside the given element, exactly as BeautifulSoup's get_text() would return it. Comments
+    and the contents of scripts and styles are left out, and strings of nothing but whitespace are collapsed
+    """
+    preserve = (element.tag in _PRESERVE_WHITESPACE_TAGS) or \
+        any((ancestor.tag in _PRESERVE_WHITESPACE_TAGS) for ancestor in element.iterancestors())
+    parts: List[str] = []
+    if element.text:
+        parts.append(_collapse_whitespace(element.text, preserve))
+    # Children and tails still to visit, in reverse document order. Iterative, as articles can be deeply nested
+    stack: List[Tuple[Union[_Element, str], bool]] = [(child, preserve) for child in reversed(element)]
+    while len(stack) != 0:
+        (item, preserve) = stack.pop()
+        if isinstance(item, str):
+            parts.append(_collapse_whitespace(item, preserve))
+        # Comments and processing instructions don't have a string tag, but their tails are still text
+        elif isinstance(item.tag, str) and (item.tag not in _NON_CONTENT_TAGS):
+            child_preserve = preserve or (item.tag in _PRESERVE_WHITESPACE_TAGS)
+            if item.text:
+                parts.append(_collapse_whitespace(item.text, child_preserve))
+            # The tail comes after all of the child's descendants
+            if item.tail:
+                stack.append((item.tail, preserve))
+            stack.extend((child, child_preserve) for child in reversed(item))
+        elif item.tail:
+            parts.append(_collapse_whitespace(item.tail, preserve))
+    return ''.join(parts)
+
+
+class _DocumentBuilder(TreeBuilder):
+    """
+    Builds the lxml tree for a document, keeping hold of its root element. The parser would otherwise return whatever
+    was closed last, which is a comment if the document ends with one after "</html>"
+    """
+
+    def __init__(self):
+        # Kept so the whitespace either side of a comment is the same separate strings as in BeautifulSoup
+        super().__init__(insert_comments=True)
+        self.root: Optional[_Element] = None
+
+    def start(self, tag, attrs, nsmap=None) -> _Element:
+        element = super().start(tag, attrs, nsmap)
+        if self.root is None:
+            self.root = element
+        return element
+
+
+def _collapse_whitespace(text: str, preserve: bool) -> str:
+    # BeautifulSoup replaces strings of nothing but whitespace with a single newline or space, except inside <pre>
+    if preserve or (len(text.strip(_ASCII_WHITESPACE)) != 0):
+        return text
+    return '\n' if ('\n' in text) else ' '
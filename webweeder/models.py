@@ -1,11 +1,34 @@
 import json
 from datetime import datetime
-from typing import Dict, Optional
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from dateutil.parser import parse as parse_datetime
+from webweeder.utils import from_json, parse_iso_datetime, read_text_file, to_compact_json
+
+_logger = getLogger(__name__)
+
+# The type of each field of PageMetadata, in the order they're written. Every field can also be None
+PAGE_METADATA_FIELDS: Dict[str, type] = {
+    'domain': str,
+    'url': str,
+    'url_date': datetime,
+    'page_title': str,
+    'article_title': str,
+    'article_date': datetime,
+    'directory': str,
+    'file_metadata': str,
+    'file_raw_html': str,
+    'file_article_plaintext': str,
+    'http_etag': str,
+    'http_last_modified': str
+}
+_DATETIME_FIELDS = [name for (name, field_type) in PAGE_METADATA_FIELDS.items() if field_type is datetime]
 
 
 class PageMetadata:
+    # Slotted, as metadata is loaded for every page of the corpus at once by some commands
+    __slots__ = list(PAGE_METADATA_FIELDS.keys())
+
     def __init__(self):
         self.domain: str = None
         self.url: str = None
@@ -17,24 +40,80 @@ class PageMetadata:
         self.file_metadata: str = None
         self.file_raw_html: str = None
         self.file_article_plaintext: str = None
+        # Validators from the response's headers, used to make conditional requests when the page is crawled again
+        self.http_etag: Optional[str] = None
+        self.http_last_modified: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return 'PageMetadata(url=%r, directory=%r)' % (self.url, self.directory)
 
 
 def page_metadata_to_json(meta: PageMetadata, pretty: bool = True) -> str:
-    json_obj: Dict[str, object] = meta.__dict__.copy()
-    json_obj['url_date'] = _datetime_to_json(meta.url_date)
-    json_obj['article_date'] = _datetime_to_json(meta.article_date)
+    """
+    :param pretty: Set to True for indented JSON which is easy to read, otherwise the JSON is as compact as possible
+    (and written by "orjson" if it's installed, which is much quicker)
+    """
+    json_obj = page_metadata_to_dict(meta)
+    if pretty:
+        return json.dumps(json_obj, indent=4, sort_keys=False)
+    return to_compact_json(json_obj)
+
 
-    indent = 4 if pretty else None
-    return json.dumps(json_obj, indent=indent, sort_keys=False)
+def page_metadata_to_dict(meta: PageMetadata) -> Dict[str, object]:
+    """
+    :return: Every field of the given metadata, ready to be serialized as JSON (i.e. with dates as ISO 8601 strings)
+    """
+    json_obj: Dict[str, object] = {name: getattr(meta, name) for name in PAGE_METADATA_FIELDS}
+    for name in _DATETIME_FIELDS:
+        json_obj[name] = _datetime_to_json(json_obj[name])
+    return json_obj
 
 
 def page_metadata_from_json(json_str: str) -> PageMetadata:
-    json_obj = json.loads(json_str)
-    meta = PageMetadata()
-    meta.__dict__ = json_obj.copy()
-    meta.url_date = _datetime_from_json(json_obj['url_date'])
-    meta.article_date = _datetime_from_json(json_obj['article_date'])
+    """
+    Reads metadata written by page_metadata_to_json(), whether it's pretty or compact
+    :raises ValueError: If the JSON isn't valid metadata
+    """
+    return _page_metadata_from_json_obj(from_json(json_str))
 
+
+def page_metadatas_from_json(json_strs: Iterable[str]) -> List[PageMetadata]:
+    """
+    Reads each of the given metadata records with page_metadata_from_json()
+    :raises ValueError: If any of the JSON isn't valid metadata
+    """
+    from_json_obj = _page_metadata_from_json_obj
+    return [from_json_obj(from_json(json_str)) for json_str in json_strs]
+
+
+def read_page_metadatas(metadata_paths: Iterable[str]) -> Iterator[Tuple[str, Optional[PageMetadata]]]:
+    """
+    Reads many metadata files, eg. every page found by MonsterWeeder.iter_page_metadatas()
+    :return: Each metadata path along with its metadata, or None if the file couldn't be read (which is logged)
+    """
+    for metadata_path in metadata_paths:
+        try:
+            meta = page_metadata_from_json(read_text_file(metadata_path, missing_ok=False))
+        except Exception:
+            _logger.exception('Unable to read page metadata: %s' % metadata_path)
+            meta = None
+        yield metadata_path, meta
+
+
+def _page_metadata_from_json_obj(json_obj: object) -> PageMetadata:
+    if not isinstance(json_obj, dict):
+        raise ValueError('Page metadata must be a JSON object, not: %s' % type(json_obj).__name__)
+    # Fields missing from metadata written by older versions keep their defaults, and unknown fields are ignored
+    meta = PageMetadata()
+    for (name, field_type) in PAGE_METADATA_FIELDS.items():
+        value = json_obj.get(name)
+        if value is None:
+            continue
+        if field_type is datetime:
+            value = _datetime_from_json(value)
+        elif not isinstance(value, field_type):
+            raise ValueError('Page metadata field "%s" must be a %s, not: %r' % (name, field_type.__name__, value))
+        setattr(meta, name, value)
     return meta
 
 
@@ -42,7 +121,9 @@ def _datetime_to_json(dt: Optional[datetime]) -> Optional[str]:
     return dt.isoformat() if (dt is not None) else None
 
 
-def _datetime_from_json(json_str: Optional[str]) -> Optional[datetime]:
-    if (json_str is None) or (len(json_str) == 0):
+def _datetime_from_json(json_str: str) -> Optional[datetime]:
+    if not isinstance(json_str, str):
+        raise ValueError('Page metadata dates must be strings, not: %r' % json_str)
+    if len(json_str) == 0:
         return None
-    return parse_datetime(json_str)
+    return parse_iso_datetime(json_str)
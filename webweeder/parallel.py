@@ -0,0 +1,41 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def ordered_map(func: Callable[[T], R],
+                items: Iterable[T],
+                jobs: int = 1,
+                initializer: Optional[Callable[..., None]] = None,
+                initargs: Tuple = (),
+                window: Optional[int] = None) -> Iterator[R]:
+    """
+    Applies func to each of the given items, yielding the results in the same order as the items.
+
+    :param func: Must be picklable (i.e. a module-level function) if jobs is greater than 1
+    :param items: Consumed lazily, so it's safe to pass a generator which would be too large to fit in memory
+    :param jobs: How many worker processes to use. If this is 1, everything runs in the calling process and the
+    initializer is NOT called
+    :param initializer: Called once in each worker process before it starts work, eg. to copy across configuration
+    :param initargs: Arguments for the initializer
+    :param window: Maximum number of items which can be in flight at once, or None to use a sensible default based on
+    the number of jobs. This is what stops a slow consumer from ballooning memory usage.
+    """
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    if window is None:
+        window = (jobs * 4)
+    pending: Deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while len(pending) != 0:
+            yield pending.popleft().result()
@@ -0,0 +1,57 @@
+from logging import getLogger
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredSemaphore
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+import config
+
+_logger = getLogger(__name__)
+
+
+class PageProcessingPipeline:
+    """
+    Parses and stores pages in a pool of worker threads, so the reactor thread is free to keep downloading in the
+    meantime. Only enabled when config.OFFLOAD_PROCESSING is set, in which case MonsterSpider.parse_item() hands over
+    each matching page as an item instead of processing it itself.
+
+    At most config.PROCESSING_QUEUE_SIZE pages are handed to the thread pool at once. Any more wait for their turn
+    while still counting towards Scrapy's SCRAPER_SLOT_MAX_ACTIVE_SIZE, which stops the engine from scheduling new
+    downloads, so a slow disk slows down the crawl instead of filling up memory.
+    """
+
+    def __init__(self, threads: int, queue_size: int):
+        self._threadpool = ThreadPool(minthreads=threads, maxthreads=threads, name=self.__class__.__name__)
+        self._semaphore = DeferredSemaphore(max(queue_size, threads))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(config.PROCESSING_THREADS, config.PROCESSING_QUEUE_SIZE)
+
+    def open_spider(self, spider):
+        self._threadpool.start()
+
+    def close_spider(self, spider):
+        # Scrapy waits for every item to finish processing before closing the spider, so nothing is in-flight here
+        self._threadpool.stop()
+
+    def process_item(self, item, spider):
+        if 'raw_html' not in item:
+            return item
+
+        def process() -> bool:
+            return spider.process_page(item['url'], item['raw_html'], item['url_date'], item['http_etag'],
+                                       item['http_last_modified'])
+
+        def on_processed(stored: bool):
+            spider.on_page_processed(item['url'], stored, item['budget_domain'])
+            # Don't keep the raw HTML around any longer than needed
+            return {'url': item['url'], 'matches': True}
+
+        def on_failed(failure):
+            _logger.error('Failed to process page: %s\n%s' % (item['url'], failure.getTraceback()))
+            return {'url': item['url'], 'matches': True}
+
+        deferred = self._semaphore.run(deferToThreadPool, reactor, self._threadpool, process)
+        return deferred.addCallbacks(on_processed, on_failed)
@@ -0,0 +1,266 @@
+import cProfile
+import heapq
+import marshal
+import os
+import threading
+from array import array
+from contextlib import contextmanager
+from logging import Logger
+from time import perf_counter, thread_time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Stages which pages are timed in. Only the stages a page actually goes through are recorded
+STAGE_READ = 'read'
+STAGE_FINGERPRINT = 'fingerprint'
+STAGE_PARSE = 'parse'
+STAGE_STRIP = 'strip'
+STAGE_SELECT = 'select'
+STAGE_DEDUPE = 'dedupe'
+STAGE_WRITE = 'write'
+STAGES = [STAGE_READ, STAGE_FINGERPRINT, STAGE_PARSE, STAGE_STRIP, STAGE_SELECT, STAGE_DEDUPE, STAGE_WRITE]
+
+# Percentiles of the time spent in each stage which are shown in the summary
+_PERCENTILES = [50, 90, 99]
+# How many of the slowest pages are listed in the summary, at least
+_SLOWEST_LISTED = 10
+
+# The page being profiled by each thread, if any
+_local = threading.local()
+# Wall times of the slowest pages profiled by this process, which decide whether a page's cProfile output is kept
+_slowest_walls: List[float] = []
+_slowest_walls_lock = threading.Lock()
+
+
+class PageProfile:
+    """
+    How long each stage of processing a single page took, in wall and CPU time (in seconds), and how many bytes each
+    stage processed
+    """
+    __slots__ = ['page', 'domain', 'stages', 'wall', 'cpu', 'cprofile_stats']
+
+    def __init__(self, page: str):
+        self.page: str = page
+        self.domain: Optional[str] = None
+        self.stages: Dict[str, List[float]] = {}
+        self.wall: float = 0.0
+        self.cpu: float = 0.0
+        # The page's cProfile stats, as written by cProfile.Profile.dump_stats(), if they were kept
+        self.cprofile_stats: Optional[bytes] = None
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class _StageTimer:
+    __slots__ = ['_profile', '_name', '_started_wall', '_started_cpu', '_bytes']
+
+    def __init__(self, profile: PageProfile, name: str):
+        self._profile = profile
+        self._name = name
+        self._bytes = 0
+
+    def count_bytes(self, text: Optional[str]):
+        """
+        Records that the stage processed the given text
+        """
+        if text is not None:
+            self._bytes += len(text.encode('utf8'))
+
+    def __enter__(self) -> '_StageTimer':
+        self._started_wall = perf_counter()
+        self._started_cpu = thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        wall = perf_counter() - self._started_wall
+        cpu = thread_time() - self._started_cpu
+        totals = self._profile.stages.get(self._name)
+        if totals is None:
+            self._profile.stages[self._name] = [wall, cpu, self._bytes]
+        else:
+            # The same stage can be entered more than once per page, eg. to select several parts of it
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += self._bytes
+
+
+class _NullStageTimer:
+    __slots__ = []
+
+    def count_bytes(self, text: Optional[str]):
+        pass
+
+    def __enter__(self) -> '_NullStageTimer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+
+_NULL_STAGE_TIMER = _NullStageTimer()
+
+
+def stage(name: str):
+    """
+    Times a stage of processing the page which is being profiled by this thread (see profile_page()), or does nothing
+    if no page is being profiled, so it's cheap to leave in place:
+
+        with profiling.stage(profiling.STAGE_PARSE) as timer:
+            timer.count_bytes(raw_html)
+            ...
+    """
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _NULL_STAGE_TIMER
+    return _StageTimer(profile, name)
+
+
+def set_domain(domain: Optional[str]):
+    """
+    Records which domain the page which is being profiled by this thread belongs to, if it wasn't known up-front
+    """
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.domain = domain
+
+
+@contextmanager
+def profile_page(page: str, domain: Optional[str] = None, slowest: int = 0) -> Iterator[PageProfile]:
+    """
+    Profiles the stages (see stage()) of processing a page in this thread. The profile is complete once the context
+    exits, even if processing the page fails
+    :param slowest: If this is greater than 0, the page is also profiled with cProfile, and its cProfile output is kept
+    if it's one of this many slowest pages profiled by this process so far
+    """
+    profile = PageProfile(page)
+    profile.domain = domain
+    profiler: Optional[cProfile.Profile] = cProfile.Profile() if (slowest > 0) else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another thread is already being profiled by cProfile, which newer versions of Python don't allow
+            profiler = None
+    _local.profile = profile
+    started_wall = perf_counter()
+    started_cpu = thread_time()
+    try:
+        yield profile
+    finally:
+        profile.wall = perf_counter() - started_wall
+        profile.cpu = thread_time() - started_cpu
+        _local.profile = None
+        if profiler is not None:
+            profiler.disable()
+            if _is_among_slowest(profile.wall, slowest):
+                profiler.create_stats()
+                profile.cprofile_stats = marshal.dumps(profiler.stats)
+
+
+def _is_among_slowest(wall: float, slowest: int) -> bool:
+    with _slowest_walls_lock:
+        if len(_slowest_walls) < slowest:
+            heapq.heappush(_slowest_walls, wall)
+            return True
+        if wall > _slowest_walls[0]:
+            heapq.heapreplace(_slowest_walls, wall)
+            return True
+        return False
+
+
+class Profiler:
+    """
+    Collects the profiles of many pages, to summarize the time spent in each stage for each domain and find the slowest
+    pages. Thread-safe
+    """
+
+    def __init__(self, slowest: int = 0):
+        """
+        :param slowest: How many of the slowest pages to keep the cProfile output of, if any
+        """
+        self.slowest: int = slowest
+        self.pages: int = 0
+        # The wall and CPU times of each page in each stage of each domain, and the total bytes processed
+        self._walls: Dict[Tuple[str, str], array] = {}
+        self._cpus: Dict[Tuple[str, str], array] = {}
+        self._bytes: Dict[Tuple[str, str], int] = {}
+        # Min-heap of the slowest pages so far, as (wall time, sequence number, profile)
+        self._slowest_pages: List[Tuple[float, int, PageProfile]] = []
+        self._lock = threading.Lock()
+
+    def add(self, profile: PageProfile):
+        domain = profile.domain or 'unknown'
+        with self._lock:
+            self.pages += 1
+            for (name, (wall, cpu, size)) in profile.stages.items():
+                key = (domain, name)
+                if key not in self._walls:
+                    self._walls[key] = array('d')
+                    self._cpus[key] = array('d')
+                    self._bytes[key] = 0
+                self._walls[key].append(wall)
+                self._cpus[key].append(cpu)
+                self._bytes[key] += size
+            entry = (profile.wall, self.pages, profile)
+            if len(self._slowest_pages) < max(self.slowest, _SLOWEST_LISTED):
+                heapq.heappush(self._slowest_pages, entry)
+            elif profile.wall > self._slowest_pages[0][0]:
+                heapq.heapreplace(self._slowest_pages, entry)
+
+    def log_summary(self, logger: Logger):
+        """
+        Logs the percentiles of the time spent in each stage for each domain, followed by the slowest pages
+        """
+        with self._lock:
+            if self.pages == 0:
+                return
+            percentile_headers = ''.join('%10s' % ('p%d ms' % p) for p in _PERCENTILES)
+            lines = ['Profile of %d pages:' % self.pages,
+                     '%-30s %-12s %8s %12s %12s%s %10s %12s'
+                     % ('domain', 'stage', 'pages', 'wall s', 'cpu s', percentile_headers, 'max ms', 'MB')]
+            stage_order = {name: i for (i, name) in enumerate(STAGES)}
+            for key in sorted(self._walls, key=lambda k: (k[0], stage_order.get(k[1], len(STAGES)), k[1])):
+                walls = sorted(self._walls[key])
+                percentiles = ''.join('%10.2f' % (_percentile(walls, p) * 1000) for p in _PERCENTILES)
+                lines.append('%-30s %-12s %8d %12.3f %12.3f%s %10.2f %12.2f'
+                             % (key[0], key[1], len(walls), sum(walls), sum(self._cpus[key]), percentiles,
+                                walls[-1] * 1000, self._bytes[key] / (1024 * 1024)))
+            lines.append('Slowest pages:')
+            for (wall, _, profile) in sorted(self._slowest_pages, reverse=True)[:max(self.slowest, _SLOWEST_LISTED)]:
+                lines.append('%10.2f ms (%.2f ms cpu): %s' % (wall * 1000, profile.cpu * 1000, profile.page))
+            logger.info('\n'.join(lines))
+
+    def dump_slowest(self, directory: str) -> List[str]:
+        """
+        Writes the cProfile output of the slowest pages which have it, slowest first, which can be read with the
+        "pstats" module (eg. "python -m pstats slowest-01.prof")
+        :return: Paths of the written files
+        """
+        with self._lock:
+            slowest = [profile for (_, _, profile) in sorted(self._slowest_pages, reverse=True)
+                       if profile.cprofile_stats is not None][:self.slowest]
+        paths: List[str] = []
+        if len(slowest) == 0:
+            return paths
+        os.makedirs(directory, exist_ok=True)
+        for (i, profile) in enumerate(slowest):
+            path = os.path.join(directory, 'slowest-%02d.prof' % (i + 1))
+            with open(path, 'wb') as file:
+                file.write(profile.cprofile_stats)
+            paths.append(path)
+        with open(os.path.join(directory, 'slowest.txt'), 'w', encoding='utf8') as file:
+            for (path, profile) in zip(paths, slowest):
+                file.write('%s\t%.2f ms\t%s\n' % (os.path.basename(path), profile.wall * 1000, profile.page))
+        return paths
+
+
+def _percentile(sorted_values: array, percentile: float) -> float:
+    """
+    :return: The given percentile of the given (sorted) values, using the nearest-rank method
+    """
+    rank = max(int(-(-len(sorted_values) * percentile // 100)), 1)
+    return sorted_values[rank - 1]
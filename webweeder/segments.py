@@ -0,0 +1,171 @@
+import itertools
+import os
+import struct
+import zlib
+from datetime import datetime
+from glob import escape, glob
+from logging import getLogger
+from typing import BinaryIO, Iterator, List, Optional, TextIO, Tuple
+
+from webweeder.utils import MEGABYTES
+
+_logger = getLogger(__name__)
+
+# Each record starts with this header: a magic number followed by the length of the compressed payload
+_RECORD_HEADER = struct.Struct('>4sI')
+_RECORD_MAGIC = b'WWSR'
+
+SEGMENT_EXTENSION = '.seg'
+INDEX_EXTENSION = '.idx'
+
+# Distinguishes writers which are created by the same process in the same second
+_writer_ids = itertools.count()
+
+
+class SegmentLocator:
+    """
+    Where a record can be found, so it can be read back without scanning the segment it's stored in
+    """
+
+    def __init__(self, segment_path: str, offset: int, length: int):
+        self.segment_path: str = segment_path
+        self.offset: int = offset
+        self.length: int = length
+
+    def __repr__(self) -> str:
+        return 'SegmentLocator(%r, %d, %d)' % (self.segment_path, self.offset, self.length)
+
+
+class SegmentWriter:
+    """
+    Appends compressed records to a series of segment files, starting a new segment whenever the current one gets too
+    big. Each segment has an index file listing the key, offset and length of each of its records.
+
+    Every writer creates its own segments, so several writers (eg. in different processes) can safely write into the
+    same directory at once. Segments are never appended to once their writer has been closed.
+    """
+
+    def __init__(self, directory: str, prefix: str, max_segment_bytes: int = (256 * MEGABYTES)):
+        """
+        :param directory: Where to create the segment files
+        :param prefix: Start of each segment's file name, used to tell different kinds of segment apart
+        :param max_segment_bytes: Segments which grow past this size are closed and a new segment is started
+        """
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self._name_fmt = '%s-%s-%d-%d-%%05d' % (prefix, timestamp, os.getpid(), next(_writer_ids))
+        self._directory = directory
+        self._max_segment_bytes = max_segment_bytes
+        self._segment_number = -1
+        self._segment_path: Optional[str] = None
+        self._segment_file: Optional[BinaryIO] = None
+        self._index_file: Optional[TextIO] = None
+
+    def append(self, key: str, payload: bytes, is_compressed: bool = False) -> SegmentLocator:
+        """
+        :param key: Identifies the record in the index, eg. the URL of a page. Mustn't contain tabs or newlines
+        :param payload: The data to store, which is compressed before being written
+        :param is_compressed: Set to True if the payload has already been compressed with compress_payload(), eg. by a
+        worker process
+        :return: Where the record was written
+        """
+        if (self._segment_file is None) or (self._segment_file.tell() >= self._max_segment_bytes):
+            self._start_segment()
+
+        compressed = payload if is_compressed else compress_payload(payload)
+        offset = self._segment_file.tell()
+        self._segment_file.write(_RECORD_HEADER.pack(_RECORD_MAGIC, len(compressed)))
+        self._segment_file.write(compressed)
+        self._index_file.write('%d\t%d\t%s\n' % (offset, len(compressed), key))
+        return SegmentLocator(self._segment_path, offset, len(compressed))
+
+    def flush(self):
+        if self._segment_file is not None:
+            self._segment_file.flush()
+            self._index_file.flush()
+
+    def close(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._index_file.close()
+        self._segment_file = None
+        self._index_file = None
+
+    def _start_segment(self):
+        self.close()
+        self._segment_number += 1
+        name = self._name_fmt % self._segment_number
+        self._segment_path = os.path.join(self._directory, name + SEGMENT_EXTENSION)
+        self._segment_file = open(self._segment_path, 'xb')
+        self._index_file = open(get_index_path(self._segment_path), 'x', encoding='utf8')
+
+
+def find_segments(directory: str, prefix: str) -> List[str]:
+    """
+    :return: Paths of every segment with the given prefix in the given directory, oldest first
+    """
+    return sorted(glob(os.path.join(escape(directory), '%s-*%s' % (prefix, SEGMENT_EXTENSION))))
+
+
+def get_index_path(segment_path: str) -> str:
+    return segment_path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+
+
+def iter_records(segment_path: str, decompress: bool = True) -> Iterator[Tuple[SegmentLocator, bytes]]:
+    """
+    Reads every record in the given segment sequentially. A truncated record at the end of the segment (eg. if the
+    writer was killed) is logged and ignored
+    :param decompress: Set to False to get each payload exactly as it is stored, so it can be decompressed elsewhere
+    with decompress_payload()
+    """
+    with open(segment_path, 'rb') as file:
+        while True:
+            offset = file.tell()
+            header = file.read(_RECORD_HEADER.size)
+            if len(header) == 0:
+                return
+            if len(header) != _RECORD_HEADER.size:
+                _logger.warning('Ignoring truncated record at offset %d of segment: %s' % (offset, segment_path))
+                return
+            (magic, length) = _RECORD_HEADER.unpack(header)
+            if magic != _RECORD_MAGIC:
+                raise ValueError('Corrupt record at offset %d of segment: %s' % (offset, segment_path))
+            payload = file.read(length)
+            if len(payload) != length:
+                _logger.warning('Ignoring truncated record at offset %d of segment: %s' % (offset, segment_path))
+                return
+            locator = SegmentLocator(segment_path, offset, length)
+            yield locator, (decompress_payload(payload) if decompress else payload)
+
+
+def read_record(locator: SegmentLocator, decompress: bool = True) -> bytes:
+    """
+    Reads a single record without scanning the rest of its segment
+    :param decompress: Set to False to get the payload exactly as it is stored, eg. to copy it into another segment
+    :return: The decompressed payload
+    """
+    with open(locator.segment_path, 'rb') as file:
+        file.seek(locator.offset + _RECORD_HEADER.size)
+        payload = file.read(locator.length)
+    return decompress_payload(payload) if decompress else payload
+
+
+def compress_payload(payload: bytes) -> bytes:
+    return zlib.compress(payload)
+
+
+def decompress_payload(payload: bytes) -> bytes:
+    return zlib.decompress(payload)
+
+
+def iter_index(segment_path: str) -> Iterator[Tuple[str, SegmentLocator]]:
+    """
+    :return: The key and locator of each record in the given segment, read from its index without touching the segment
+    """
+    with open(get_index_path(segment_path), 'r', encoding='utf8') as file:
+        for line in file:
+            if not line.endswith('\n'):
+                # Partially written by a writer which was killed
+                return
+            (offset, length, key) = line[:-1].split('\t', 2)
+            yield key, SegmentLocator(segment_path, int(offset), int(length))
@@ -0,0 +1,93 @@
+import gzip
+import io
+from datetime import date, datetime, timezone
+from typing import BinaryIO, Iterator, Optional
+from xml.etree.ElementTree import iterparse
+
+from webweeder.utils import parse_iso_datetime
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class SitemapEntry:
+    """
+    A single entry of a sitemap, which is either a page or (if the sitemap is a sitemap index) another sitemap
+    """
+
+    def __init__(self, loc: str, lastmod: Optional[datetime], is_sitemap: bool):
+        self.loc: str = loc
+        # When the page was last modified, in UTC, or None if the sitemap doesn't say
+        self.lastmod: Optional[datetime] = lastmod
+        self.is_sitemap: bool = is_sitemap
+
+    def __repr__(self) -> str:
+        return 'SitemapEntry(%r, %r, %r)' % (self.loc, self.lastmod, self.is_sitemap)
+
+
+def open_sitemap(body: bytes) -> BinaryIO:
+    """
+    :return: A stream of the given sitemap's XML, which is transparently decompressed if the sitemap is gzipped (eg.
+    "sitemap.xml.gz")
+    """
+    stream = io.BytesIO(body)
+    if body.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def iter_sitemap_entries(stream: BinaryIO) -> Iterator[SitemapEntry]:
+    """
+    Parses a sitemap or sitemap index incrementally, so huge sitemaps are never held in memory as a whole tree
+    """
+    root = None
+    for (event, element) in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            continue
+        tag = _local_name(element.tag)
+        if tag not in ('url', 'sitemap'):
+            continue
+        loc: Optional[str] = None
+        lastmod: Optional[datetime] = None
+        for child in element:
+            child_tag = _local_name(child.tag)
+            if (child_tag == 'loc') and (child.text is not None):
+                loc = child.text.strip()
+            elif (child_tag == 'lastmod') and (child.text is not None):
+                lastmod = _parse_lastmod(child.text.strip())
+        # Entries which have been parsed are no longer needed
+        root.clear()
+        if loc:
+            yield SitemapEntry(loc, lastmod, is_sitemap=(tag == 'sitemap'))
+
+
+def is_modified_within(lastmod: Optional[datetime], since: Optional[date], until: Optional[date]) -> bool:
+    """
+    :param lastmod: When a sitemap entry was last modified. Entries which don't say are always included
+    :param since: The first day to include, or None to include every entry modified before 'until'
+    :param until: The day after the last day to include, or None to include every entry modified from 'since'
+    :return: True if the entry was last modified within the given dates
+    """
+    if lastmod is None:
+        return True
+    if (since is not None) and (lastmod.date() < since):
+        return False
+    return (until is None) or (lastmod.date() < until)
+
+
+def _local_name(tag: str) -> str:
+    # Strips the namespace, eg. "{http://www.sitemaps.org/schemas/sitemap/0.9}url" -> "url"
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_lastmod(lastmod: str) -> Optional[datetime]:
+    try:
+        # W3C datetimes are a subset of ISO 8601
+        dt = parse_iso_datetime(lastmod)
+    except (ValueError, OverflowError):
+        return None
+    if dt.tzinfo is not None:
+        # Comparable with the UTC dates of stored pages
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
@@ -1,42 +1,370 @@
 import os
 import traceback
-from datetime import datetime
-from typing import Callable, Optional
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
-from bs4 import BeautifulSoup
 from pathvalidate import sanitize_file_path
+from scrapy import signals
+from scrapy.http import Request, Response
+from scrapy.link import Link
 from scrapy.linkextractors import LinkExtractor
 from scrapy.spiders import CrawlSpider, Rule
+from twisted.internet.task import LoopingCall
 
 import config
-from webweeder.domainconfig import DomainConfig
-from webweeder.models import PageMetadata, page_metadata_to_json
-from webweeder.utils import write_text_file
+from webweeder import profiling
+from webweeder.catalog import PageCatalog, get_catalog_path
+from webweeder.dedupe import canonicalize_url, hash_article
+from webweeder.domainconfig import DomainConfig, HostnameIndex
+from webweeder.models import PageMetadata
+from webweeder.sitemaps import SitemapEntry, is_modified_within, iter_sitemap_entries, open_sitemap
+from webweeder.storage import PageStore, open_page_store
+from webweeder.utils import round_robin
+
+# Name of the spider when it crawls more than one domain at once
+MULTI_DOMAIN_SPIDER_NAME = 'multidomain'
+
+
+class DomainCrawl:
+    """
+    Everything a spider needs to keep track of for each of the domains it's crawling
+    """
+
+    def __init__(self, domain: DomainConfig):
+        self.domain: DomainConfig = domain
+        # The dates to seed (or, when discovering articles using sitemaps, the modification dates to crawl)
+        self.seed_window: Tuple[Optional[date], Optional[date]] = (None, None)
+        # How many links have been followed, not including duplicates or seed URLs
+        self.links_followed: int = 0
+        # Which part of the domain this spider crawls, and how many parts the domain is split into between worker
+        # processes, or None if this spider crawls the whole domain. Articles are split between the parts by their URL
+        self.partition: Optional[Tuple[int, int]] = config.SEED_PARTITIONS.get(domain.name)
+        if domain.follow_patterns is None:
+            # Crawl everything, and decide which pages to store once they've been downloaded
+            self.article_links: LinkExtractor = LinkExtractor(allow=['.*'])
+            self.follow_links: Optional[LinkExtractor] = None
+        else:
+            self.article_links = LinkExtractor(allow=domain.url_patterns)
+            self.follow_links = LinkExtractor(allow=domain.follow_patterns)
+
+    def in_partition(self, url: str) -> bool:
+        """
+        :return: True if the given URL falls into this spider's part of the domain
+        """
+        if self.partition is None:
+            return True
+        (part, parts) = self.partition
+        # Not hash(), which differs between processes
+        return (zlib.crc32(url.encode('utf8')) % parts) == part
+
+    def prepare_request(self, request: Request) -> Request:
+        """
+        Applies the domain's download settings to a request for one of its pages
+        """
+        domain = self.domain
+        # Requests for "www.example.com" and "example.com" share the same slot, and its concurrency and delay
+        request.meta['download_slot'] = domain.name
+        if domain.download_timeout is not None:
+            request.meta['download_timeout'] = domain.download_timeout
+        if domain.max_retry_times is not None:
+            request.meta['max_retry_times'] = domain.max_retry_times
+        return request
+
+
+class _DomainLinkExtractor:
+    """
+    Extracts links from each response using the link extractors of the domain the response came from. Links to other
+    domains are dropped, so they're never followed according to the wrong domain's patterns
+    """
+
+    def __init__(self, spider: 'MonsterSpider', follow_links: bool):
+        """
+        :param follow_links: Set to True to extract links to follow, otherwise links to articles are extracted
+        """
+        self._spider = spider
+        self._follow_links = follow_links
+
+    def extract_links(self, response: Response) -> List[Link]:
+        crawl = self._spider.find_crawl(response.url)
+        if crawl is None:
+            return []
+        extractor = crawl.follow_links if self._follow_links else crawl.article_links
+        if extractor is None:
+            return []
+        return [link for link in extractor.extract_links(response) if self._spider.find_crawl(link.url) is crawl]
 
 
 class MonsterSpider(CrawlSpider):
-    # Horrible, horrible hack... I feel ashamed. Unsure how to pass in the domain any other way, although I'm sure it
+    # Horrible, horrible hack... I feel ashamed. Unsure how to pass in the domains any other way, although I'm sure it
     # must be possible.
-    next_instance_domain: DomainConfig = None
-    next_instance_callback: Callable[[str], None] = None
+    next_instance_domains: List[DomainConfig] = None
+    # Either a StatsMonitor, or a StatsForwarder when crawling with several worker processes
+    next_instance_stats = None
+    next_instance_settings: Dict[str, object] = None
+    # The catalog shared by every spider in this process, or None for the spider to open (and close) its own. Sharing
+    # one means spiders never wait for each other's writes to the catalog
+    next_instance_catalog: Optional[PageCatalog] = None
 
     def __init__(self):
-        domain = MonsterSpider.next_instance_domain
-        MonsterSpider.next_instance_domain = None
-        if domain is None:
+        domains = MonsterSpider.next_instance_domains
+        MonsterSpider.next_instance_domains = None
+        if not domains:
             raise TypeError
-        callback = MonsterSpider.next_instance_callback
-        MonsterSpider.next_instance_callback = None
+        stats = MonsterSpider.next_instance_stats
+        MonsterSpider.next_instance_stats = None
+        catalog = MonsterSpider.next_instance_catalog
+        MonsterSpider.next_instance_catalog = None
+
+        # Needed by the rules, which are compiled by CrawlSpider
+        self.crawls: Dict[str, DomainCrawl] = {domain.name: DomainCrawl(domain) for domain in domains}
+        self.hostname_index: HostnameIndex = HostnameIndex(domains)
+
+        # Seed URLs are generated lazily by start_requests(), rather than being listed up-front in 'start_urls'
+        super().__init__(name=self.get_name(domains),
+                         allowed_domains=[domain.name for domain in domains],
+                         rules=self._create_rules())
 
-        super().__init__(name=domain.name,
-                         start_urls=domain.seed_urls,
-                         allowed_domains=[domain.name],
-                         rules=[
-                             Rule(LinkExtractor(allow=['.*']), callback='parse_item', follow=True)
-                         ])
+        self.started: datetime = datetime.utcnow()
+        self.stats = stats
+        self._owns_catalog: bool = catalog is None
+        self.catalog: PageCatalog = PageCatalog(get_catalog_path(config.OUTPUT_DIRECTORY)) if self._owns_catalog \
+            else catalog
+        self.store: PageStore = open_page_store(config.STORAGE_BACKEND, config.OUTPUT_DIRECTORY)
+        # Samples the depth of the scheduler's queue every config.STATS_INTERVAL seconds
+        self._queue_depth_poll: Optional[LoopingCall] = None
+        # Profiles processing each page if config.PROFILE is set
+        self.profiler: Optional[profiling.Profiler] = profiling.Profiler(config.PROFILE_SLOWEST) if config.PROFILE \
+            else None
 
-        self.domain_config: DomainConfig = domain
-        self.on_crawl_callback: Callable[[str], None] = callback
+    @staticmethod
+    def get_name(domains: List[DomainConfig]) -> str:
+        """
+        :return: The name of a spider which crawls the given domains, which also names its job directory
+        """
+        return domains[0].name if (len(domains) == 1) else MULTI_DOMAIN_SPIDER_NAME
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # Called by Scrapy just before the spider is created, which is the only chance to apply per-spider settings
+        spider_settings = MonsterSpider.next_instance_settings
+        MonsterSpider.next_instance_settings = None
+        if spider_settings is not None:
+            settings.setdict(spider_settings, priority='spider')
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.on_request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(spider.on_response_received, signal=signals.response_received)
+        crawler.signals.connect(spider.on_spider_opened, signal=signals.spider_opened)
+        return spider
+
+    def find_crawl(self, url: str) -> Optional[DomainCrawl]:
+        """
+        :return: The crawl of the domain which the given URL belongs to, or None if this spider isn't crawling it
+        """
+        domain = self.hostname_index.find_domain(url)
+        return self.crawls[domain.name] if (domain is not None) else None
+
+    def start_requests(self) -> Iterator[Request]:
+        # Take turns seeding each domain, so they're crawled side by side rather than one after another
+        return round_robin([self._iter_start_requests(crawl) for crawl in self.crawls.values()])
+
+    async def start(self):
+        # Called instead of start_requests() by Scrapy 2.13 and later
+        for request in self.start_requests():
+            yield request
+
+    def _iter_start_requests(self, crawl: DomainCrawl) -> Iterator[Request]:
+        domain = crawl.domain
+        (since, until) = crawl.seed_window = self._get_seed_window(domain)
+        if config.SITEMAP_DISCOVERY and (domain.sitemap_urls is not None):
+            self.logger.info('Discovering articles of "%s" modified from %s until %s using sitemaps'
+                             % (domain.name, since or 'the start', until or 'today'))
+            for url in domain.sitemap_urls:
+                yield crawl.prepare_request(Request(url, callback=self.parse_sitemap, dont_filter=True,
+                                                    meta={'domain': domain.name}))
+            return
+
+        # Scrapy only takes more start requests when it's ready for them, so the seed URLs are never all in memory
+        self.logger.info('Seeding "%s" with dates from %s until %s'
+                         % (domain.name, since or 'the start', until or 'today'))
+        # When the domain is split between worker processes, every worker is seeded with every date, so it can find all
+        # of the articles which fall into its part of the domain (see limit_request())
+        for url in domain.iter_seed_urls(since, until):
+            yield crawl.prepare_request(Request(url, dont_filter=True))
+
+    def _get_seed_window(self, domain: DomainConfig) -> Tuple[Optional[date], Optional[date]]:
+        since = config.CRAWL_SINCE
+        if since is None:
+            last_crawl = self.catalog.find_last_crawl(domain.name)
+            # The day of the last crawl is seeded again, in case more articles were published later that day
+            since = last_crawl.date() if (last_crawl is not None) else None
+        return since, config.CRAWL_UNTIL
+
+    def parse_sitemap(self, response: Response) -> Iterator[Request]:
+        """
+        Crawls every sitemap listed by a sitemap index, and every article listed by a sitemap which is new or has
+        changed since it was stored. Entries which were last modified outside of the seed window are skipped
+        """
+        # Sitemaps don't necessarily live on the domain they describe
+        crawl = self.crawls[response.meta['domain']]
+        domain = crawl.domain
+        for entry in iter_sitemap_entries(open_sitemap(response.body)):
+            if entry.is_sitemap:
+                # A sitemap was last modified when its newest entry was, so it may still list older entries
+                if self._in_seed_window(crawl, entry.lastmod, check_until=False):
+                    yield crawl.prepare_request(Request(entry.loc, callback=self.parse_sitemap,
+                                                        meta={'domain': domain.name}))
+                continue
+            if not self._in_seed_window(crawl, entry.lastmod):
+                continue
+            if (not domain.includes_url(entry.loc)) or (not crawl.in_partition(entry.loc)):
+                continue
+            if not self._is_new_or_changed(entry):
+                continue
+            if (domain.max_pages is not None) and (crawl.links_followed >= domain.max_pages):
+                self.logger.debug('Not following sitemap beyond max pages of %d: %s' % (domain.max_pages, response.url))
+                return
+            crawl.links_followed += 1
+            request = Request(entry.loc, callback=self.parse_item, meta={'budget_domain': domain.name})
+            yield crawl.prepare_request(request)
+
+    @staticmethod
+    def _in_seed_window(crawl: DomainCrawl, lastmod: Optional[datetime], check_until: bool = True) -> bool:
+        (since, until) = crawl.seed_window
+        return is_modified_within(lastmod, since, until if check_until else None)
+
+    def _is_new_or_changed(self, entry: SitemapEntry) -> bool:
+        stored = self.catalog.find_page(entry.loc)
+        if stored is not None:
+            crawled = stored.url_date
+        else:
+            duplicate = self.catalog.find_duplicate(entry.loc) if config.DEDUPLICATE_PAGES else None
+            if duplicate is None:
+                return True
+            # Copies of stored pages are crawled again if they change, as they may no longer be copies
+            crawled = duplicate[1]
+        if (entry.lastmod is None) or (crawled is None):
+            # No way to tell whether the page has changed
+            return False
+        return entry.lastmod > crawled
+
+    def _create_rules(self) -> List[Rule]:
+        # Pages which are stored can link to more pages worth storing, so their links are followed too (although only
+        # links matching one of these rules are ever crawled)
+        return [
+            Rule(_DomainLinkExtractor(self, follow_links=False), callback='parse_item', follow=True,
+                 process_request='limit_request'),
+            Rule(_DomainLinkExtractor(self, follow_links=True), follow=True, process_request='limit_request')
+        ]
+
+    def limit_request(self, request: Request, response: Response) -> Optional[Request]:
+        """
+        Drops requests which would exceed the domain's depth or page budgets, which are for pages which have already
+        been stored when crawling incrementally, or which are for articles in another worker process's part of the
+        domain
+        """
+        crawl = self.find_crawl(request.url)
+        if crawl is None:
+            return None
+        domain = crawl.domain
+        if domain.includes_url(request.url) and (not crawl.in_partition(request.url)):
+            # Another worker process crawls this article, so it's only downloaded once
+            return None
+        if config.INCREMENTAL_CRAWL and domain.includes_url(request.url):
+            request = self._make_incremental(request)
+            if request is None:
+                return None
+        if domain.max_depth is not None:
+            depth = response.meta.get('depth', 0) + 1
+            if depth > domain.max_depth:
+                self.logger.debug('Not following link beyond max depth of %d: %s' % (domain.max_depth, request.url))
+                return None
+        if (domain.max_pages is not None) and (crawl.links_followed >= domain.max_pages):
+            self.logger.debug('Not following link beyond max pages of %d: %s' % (domain.max_pages, request.url))
+            return None
+        crawl.links_followed += 1
+        request.meta['budget_domain'] = domain.name
+        return crawl.prepare_request(request)
+
+    def _make_incremental(self, request: Request) -> Optional[Request]:
+        """
+        :return: None if the requested page has already been stored (or found to be a copy of a stored page) recently
+        enough, the request made conditional if it was stored too long ago, or the request unchanged if it hasn't been
+        stored yet
+        """
+        stored = self.catalog.find_page(request.url)
+        if stored is None:
+            duplicate = self.catalog.find_duplicate(request.url) if config.DEDUPLICATE_PAGES else None
+            if (duplicate is not None) and self._is_recent(duplicate[1]):
+                self.logger.debug('Not crawling page which is a copy of %s: %s' % (duplicate[0], request.url))
+                return None
+            # Copies aren't stored, so there's nothing to make the request conditional on
+            return request
+        if self._is_recent(stored.url_date):
+            self.logger.debug('Not crawling page which is already stored: %s' % request.url)
+            return None
+
+        # Let the server tell us if the page hasn't changed, rather than downloading it all over again
+        headers = {}
+        if stored.http_etag is not None:
+            headers['If-None-Match'] = stored.http_etag
+        if stored.http_last_modified is not None:
+            headers['If-Modified-Since'] = stored.http_last_modified
+        if len(headers) == 0:
+            return request
+        request.headers.update(headers)
+        request.meta['handle_httpstatus_list'] = [304]
+        return request
+
+    @staticmethod
+    def _is_recent(url_date: Optional[datetime]) -> bool:
+        """
+        :param url_date: When a page was last crawled
+        :return: True if the page was crawled too recently to be crawled again
+        """
+        max_age = config.REFETCH_MAX_AGE
+        if max_age == -1:
+            return True
+        return (url_date is not None) and ((datetime.utcnow() - url_date) < timedelta(days=max_age))
+
+    def on_request_dropped(self, request: Request, spider):
+        """
+        Called when the scheduler drops a request, eg. because the URL has already been crawled
+        """
+        # Only requests which count towards a domain's page budget
+        budget_domain = request.meta.get('budget_domain')
+        if (spider is self) and (budget_domain is not None):
+            self.crawls[budget_domain].links_followed -= 1
+
+    def on_response_received(self, response: Response, request: Request, spider):
+        """
+        Called on the reactor thread when any response is downloaded, including responses which aren't stored
+        """
+        if (spider is not self) or (self.stats is None):
+            return
+        # Requests for sitemaps on other hosts are still made in the domain's download slot
+        domain_name = request.meta.get('download_slot')
+        if domain_name not in self.crawls:
+            domain = self.hostname_index.find_domain(response.url)
+            if domain is None:
+                return
+            domain_name = domain.name
+        self.stats.on_response(domain_name, response.status, len(response.body), request.meta.get('download_latency'))
+
+    def on_spider_opened(self, spider):
+        if (spider is not self) or (self.stats is None) or (config.STATS_INTERVAL == -1):
+            return
+        self._queue_depth_poll = LoopingCall(self._report_queue_depth)
+        self._queue_depth_poll.start(config.STATS_INTERVAL, now=False)
+
+    def _report_queue_depth(self):
+        crawler_stats = self.crawler.stats
+        depth = crawler_stats.get_value('scheduler/enqueued', 0) - crawler_stats.get_value('scheduler/dequeued', 0)
+        self.stats.on_queue_depth(self.name, os.getpid(), depth)
 
     @classmethod
     def get_output_directory(cls, url: str) -> str:
@@ -49,20 +377,61 @@ class MonsterSpider(CrawlSpider):
     def parse_item(self, response):
         now = datetime.utcnow()
         url = response.url
-        domain = self.domain_config
+        domain = self.hostname_index.find_domain(url)
 
-        if not domain.includes_url(url):
+        if (domain is None) or (not domain.includes_url(url)):
             self.logger.info('Skipping over URL: %s' % url)
+            if (domain is not None) and (self.stats is not None):
+                self.stats.on_page_skipped(domain.name)
             return {'url': url, 'matches': False}
 
+        if response.status == 304:
+            self.logger.info('Crawler found unchanged: %s' % url)
+            self._touch_page(url, now)
+            return {'url': url, 'matches': True}
+
         self.logger.info('Crawler found: %s' % url)
 
-        soup = BeautifulSoup(response.text, config.HTML_PARSER)
+        etag = self._get_header(response, 'ETag')
+        last_modified = self._get_header(response, 'Last-Modified')
+        if config.OFFLOAD_PROCESSING:
+            # Parsed and stored in a worker thread by PageProcessingPipeline, which calls process_page()
+            return {'url': url, 'matches': True, 'raw_html': response.text, 'url_date': now, 'http_etag': etag,
+                    'http_last_modified': last_modified, 'budget_domain': response.meta.get('budget_domain')}
+
+        stored = self.process_page(url, response.text, now, etag, last_modified)
+        self.on_page_processed(url, stored, response.meta.get('budget_domain'))
+        return {'url': url, 'matches': True}
+
+    def process_page(self, url: str, raw_html: str, url_date: datetime, etag: Optional[str] = None,
+                     last_modified: Optional[str] = None) -> bool:
+        """
+        Parses the given page, then stores it along with its metadata (and its plaintext article if
+        config.EXTRACT_ON_CRAWL is set), unless config.DEDUPLICATE_PAGES is set and it's a copy of a page which has
+        already been stored. Must be thread-safe, as it's called from worker threads when config.OFFLOAD_PROCESSING is
+        set
+        :return: True if the page was stored, or False if it's a copy of a stored page
+        """
+        if self.profiler is None:
+            return self._process_page(url, raw_html, url_date, etag, last_modified)
+        with profiling.profile_page(url, slowest=config.PROFILE_SLOWEST) as page_profile:
+            try:
+                return self._process_page(url, raw_html, url_date, etag, last_modified)
+            finally:
+                self.profiler.add(page_profile)
+
+    def _process_page(self, url: str, raw_html: str, url_date: datetime, etag: Optional[str],
+                      last_modified: Optional[str]) -> bool:
+        domain = self.hostname_index.find_domain(url)
+        profiling.set_domain(domain.name)
+        with profiling.stage(profiling.STAGE_PARSE) as timer:
+            timer.count_bytes(raw_html)
+            soup = domain.parse_html(raw_html, config.HTML_PARSER)
 
         meta = PageMetadata()
         meta.domain = domain.name
         meta.url = url
-        meta.url_date = now
+        meta.url_date = url_date
         meta.page_title = self._try_get(url, 'page title', lambda: domain.scrape_page_title(soup))
         meta.article_title = self._try_get(url, 'article title', lambda: domain.scrape_article_title(soup))
         meta.article_date = self._try_get(url, 'article date', lambda: domain.scrape_article_date(soup))
@@ -70,17 +439,82 @@ class MonsterSpider(CrawlSpider):
         meta.file_metadata = 'metadata.json'
         meta.file_raw_html = 'raw.html'
         meta.file_article_plaintext = 'plaintext_article.txt'
+        meta.http_etag = etag
+        meta.http_last_modified = last_modified
 
-        meta_json = page_metadata_to_json(meta, pretty=True)
-        raw_html = response.text
+        plaintext: Optional[str] = None
+        if config.EXTRACT_ON_CRAWL or config.DEDUPLICATE_PAGES:
+            # Must be scraped last, as it modifies the soup
+            plaintext = self._try_get(url, 'article content', lambda: domain.scrape_article_content(soup))
 
-        write_text_file(os.path.join(config.OUTPUT_DIRECTORY, meta.directory, meta.file_metadata), meta_json)
-        write_text_file(os.path.join(config.OUTPUT_DIRECTORY, meta.directory, meta.file_raw_html), raw_html)
+        if config.DEDUPLICATE_PAGES:
+            with profiling.stage(profiling.STAGE_DEDUPE):
+                article_hash = hash_article(plaintext) if plaintext else None
+                duplicate = self.catalog.claim_page(url, canonicalize_url(url), article_hash)
+            if duplicate is not None:
+                (original_url, reason) = duplicate
+                self.logger.info('Crawler found copy (same %s) of %s: %s' % (reason, original_url, url))
+                self.catalog.add_duplicate(meta, original_url, reason, len(raw_html.encode('utf8')))
+                return False
 
-        if self.on_crawl_callback is not None:
-            self.on_crawl_callback(domain.name)
+        with profiling.stage(profiling.STAGE_WRITE) as timer:
+            timer.count_bytes(raw_html)
+            self.store.store_page(meta, raw_html, plaintext if config.EXTRACT_ON_CRAWL else None)
+            self.catalog.add_page(meta)
+        return True
 
-        return {'url': url, 'matches': True}
+    def _touch_page(self, url: str, url_date: datetime):
+        """
+        Records that a stored page has been crawled again, but hadn't changed
+        """
+        meta = self.catalog.find_page(url)
+        if meta is None:
+            return
+        meta.url_date = url_date
+        self.store.touch_page(meta)
+        self.catalog.add_page(meta)
+
+    @staticmethod
+    def _get_header(response: Response, name: str) -> Optional[str]:
+        value = response.headers.get(name)
+        return value.decode('latin1') if (value is not None) else None
+
+    def on_page_processed(self, url: str, stored: bool, budget_domain: Optional[str]):
+        """
+        Called on the reactor thread once a page has been processed by process_page()
+        :param stored: Whether the page was stored, as opposed to being found to be a copy of a stored page
+        :param budget_domain: The domain whose page budget the page's request counted towards, if any
+        """
+        if (not stored) and (budget_domain is not None):
+            # Copies aren't stored, so they don't use up the domain's page budget
+            self.crawls[budget_domain].links_followed -= 1
+        if self.stats is not None:
+            domain_name = self.hostname_index.find_domain(url).name
+            if stored:
+                self.stats.on_page_crawled(domain_name)
+            else:
+                self.stats.on_page_copied(domain_name)
+
+    def closed(self, reason: str):
+        if (self._queue_depth_poll is not None) and self._queue_depth_poll.running:
+            self._queue_depth_poll.stop()
+        if reason == 'finished':
+            for name in self.crawls:
+                if name not in config.SEED_PARTITIONS:
+                    # Otherwise it's only finished once every worker crawling the domain has finished
+                    self.catalog.set_last_crawl(name, self.started)
+        if self.stats is not None:
+            self.stats.on_spider_closed(list(self.crawls.keys()), reason)
+        if self.profiler is not None:
+            self.profiler.log_summary(self.logger)
+            # Spiders in different worker processes can share a name
+            profile_dir = os.path.join(config.LOG_DIRECTORY, config.PROFILE_DIRECTORY_NAME,
+                                       'crawl-%s-%d' % (self.name, os.getpid()))
+            for path in self.profiler.dump_slowest(profile_dir):
+                self.logger.info('Dumped cProfile output of slow page: %s' % path)
+        self.store.close()
+        if self._owns_catalog:
+            self.catalog.close()
 
     def _try_get(self, url: str, msg: str, func: Callable[[], object]) -> Optional[object]:
         """
@@ -91,4 +525,6 @@ class MonsterSpider(CrawlSpider):
         except Exception:
             self.logger.warning('Unable to parse %s, there may be an issue with your config: %s' % (msg, url))
             self.logger.debug(traceback.format_exc())
+            if self.stats is not None:
+                self.stats.on_scrape_failed(self.hostname_index.find_domain(url).name, msg)
         return None
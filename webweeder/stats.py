@@ -1,24 +1,113 @@
+import json
+import os
+from bisect import bisect_left
 from datetime import datetime, timedelta
 from logging import getLogger, Logger
-from typing import Dict, Optional
+from threading import RLock
+from typing import Dict, List, Optional, Tuple
 
 import config
 
 _logger = getLogger(__name__)
 
+# Name, type and help text of each metric written to the Prometheus text file
+_PROMETHEUS_METRICS: List[Tuple[str, str, str]] = [
+    ('webweeder_pages_crawled_total', 'counter', 'Pages stored by the crawler'),
+    ('webweeder_pages_skipped_total', 'counter', 'Pages downloaded but not stored, as their domain excludes them'),
+    ('webweeder_pages_copied_total', 'counter', 'Pages downloaded but not stored, as they copy a stored page'),
+    ('webweeder_responses_total', 'counter', 'Responses downloaded, by status code'),
+    ('webweeder_downloaded_bytes_total', 'counter', 'Bytes of response bodies downloaded'),
+    ('webweeder_download_latency_seconds', 'histogram', 'Time from sending each request to receiving its headers'),
+    ('webweeder_scrape_failures_total', 'counter', 'Failures to scrape part of a page, by part'),
+    ('webweeder_queue_depth', 'gauge', 'Requests waiting in the scheduler, by spider')
+]
+
 
 class StatsMonitor:
-    # TODO: ensure class is thread safe
+    """
+    Collects metrics of the crawl for each domain, and logs them every config.STATS_INTERVAL seconds. The metrics are
+    also written to the log directory as JSON lines and as a Prometheus text file (see config.METRICS_JSON_FILE_NAME
+    and config.METRICS_PROMETHEUS_FILE_NAME).
+
+    Thread-safe, as pages can be processed by worker threads (see config.OFFLOAD_PROCESSING)
+    """
+
     def __init__(self):
         self.stats: Dict[str, DomainStats] = {}
         self.combined_stats: DomainStats = DomainStats(None)
+        # Why each spider which crawled each domain finished, eg. "finished" or "shutdown"
+        self.finish_reasons: Dict[str, List[str]] = {}
+        # How many requests are waiting in the scheduler of each spider, in each process
+        self.queue_depths: Dict[Tuple[str, int], int] = {}
         self._next_log_time = None
+        self._lock: RLock = RLock()
 
     def on_page_crawled(self, domain: str):
-        self._get_stats_for(domain).on_page_crawled()
-        self.combined_stats.on_page_crawled()
+        with self._lock:
+            self._get_stats_for(domain).on_page_crawled()
+            self.combined_stats.on_page_crawled()
+            self._maybe_log_stats()
+
+    def on_page_skipped(self, domain: str):
+        with self._lock:
+            self._get_stats_for(domain).on_page_skipped()
+            self.combined_stats.on_page_skipped()
+
+    def on_page_copied(self, domain: str):
+        """
+        Called instead of on_page_crawled() when a page isn't stored because it's a copy of a page which has already
+        been stored (see config.DEDUPLICATE_PAGES)
+        """
+        with self._lock:
+            self._get_stats_for(domain).on_page_copied()
+            self.combined_stats.on_page_copied()
+
+    def on_response(self, domain: str, status: int, size: int, latency: Optional[float]):
+        """
+        :param size: Size of the response's body, in bytes
+        :param latency: How long it took to receive the response's headers (in seconds), if known
+        """
+        with self._lock:
+            self._get_stats_for(domain).on_response(status, size, latency)
+            self.combined_stats.on_response(status, size, latency)
+            self._maybe_log_stats()
+
+    def on_scrape_failed(self, domain: str, part: str):
+        """
+        :param part: Which part of the page couldn't be scraped, eg. "article title"
+        """
+        with self._lock:
+            self._get_stats_for(domain).on_scrape_failed(part)
+            self.combined_stats.on_scrape_failed(part)
 
-        self._maybe_log_stats()
+    def on_queue_depth(self, spider: str, pid: int, depth: int):
+        """
+        :param pid: ID of the process running the spider, as spiders in different worker processes can share a name
+        """
+        with self._lock:
+            self.queue_depths[(spider, pid)] = depth
+            self._maybe_log_stats()
+
+    def on_spider_closed(self, domains: List[str], reason: str):
+        with self._lock:
+            for domain in domains:
+                _logger.info('Domain "%s" spider closed: %s' % (domain, reason))
+                self.finish_reasons.setdefault(domain, []).append(reason)
+
+    def tick(self):
+        """
+        Log statistics if it's time to do so, even if nothing has happened since they were last logged
+        """
+        with self._lock:
+            self._maybe_log_stats()
+
+    def log_stats(self):
+        """
+        Log statistics now, eg. once the crawl has finished
+        """
+        with self._lock:
+            if self._get_log_interval() is not None:
+                self._log_stats(datetime.utcnow())
 
     def _maybe_log_stats(self):
         """
@@ -32,10 +121,48 @@ class StatsMonitor:
         if (self._next_log_time is None) or (now >= self._next_log_time):
             # Time to log now
             self._next_log_time = (now + log_interval)
+            self._log_stats(now)
+
+    def _log_stats(self, now: datetime):
+        for k in sorted(self.stats.keys()):
+            self.stats.get(k).log_stats(now, _logger)
+        self.combined_stats.log_stats(now, _logger)
+        try:
+            self._write_metrics(now)
+        except OSError:
+            _logger.exception('Unable to write metrics')
 
+    def _write_metrics(self, now: datetime):
+        if config.METRICS_JSON_FILE_NAME is not None:
+            queue_depths: Dict[str, int] = {}
+            for ((spider, _), depth) in self.queue_depths.items():
+                queue_depths[spider] = queue_depths.get(spider, 0) + depth
+            json_obj = {
+                'time': now.isoformat(),
+                'domains': {k: self.stats[k].to_json_obj(now) for k in sorted(self.stats.keys())},
+                'combined': self.combined_stats.to_json_obj(now),
+                'queue_depth': queue_depths
+            }
+            with open(os.path.join(config.LOG_DIRECTORY, config.METRICS_JSON_FILE_NAME), 'a', encoding='utf8') as file:
+                file.write(json.dumps(json_obj) + '\n')
+
+        if config.METRICS_PROMETHEUS_FILE_NAME is not None:
+            samples: Dict[str, List[str]] = {name: [] for (name, _, _) in _PROMETHEUS_METRICS}
             for k in sorted(self.stats.keys()):
-                self.stats.get(k).log_stats(now, _logger)
-            self.combined_stats.log_stats(now, _logger)
+                self.stats[k].add_prometheus_samples(samples)
+            for ((spider, pid), depth) in sorted(self.queue_depths.items()):
+                samples['webweeder_queue_depth'].append(
+                    _prometheus_sample('webweeder_queue_depth', {'spider': spider, 'pid': str(pid)}, depth))
+            lines: List[str] = []
+            for (name, metric_type, help_text) in _PROMETHEUS_METRICS:
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                lines.extend(samples[name])
+            # Replaced in one go, so whatever collects the metrics never sees a half-written file
+            file_path = os.path.join(config.LOG_DIRECTORY, config.METRICS_PROMETHEUS_FILE_NAME)
+            with open(file_path + '.tmp', 'w', encoding='utf8') as file:
+                file.write('\n'.join(lines) + '\n')
+            os.replace(file_path + '.tmp', file_path)
 
     def _get_stats_for(self, domain: str) -> 'DomainStats':
         if domain not in self.stats:
@@ -57,15 +184,147 @@ class DomainStats:
         :param domain: The domain these stats are for, or None if it represents stats for all domains combined
         """
         label = ('Domain "%s"' % domain) if (domain is not None) else 'Combined:'
-        self.fmt = label + ' crawled %d pages in %.2f seconds (avg. %.2f/sec)'
+        self.fmt = label + ' crawled %d pages in %.2f seconds (avg. %.2f/sec), downloaded %d responses (%.2f MB, ' \
+                           'avg. %.2f MB/sec), skipped %d pages, found %d copies of stored pages, ' \
+                           'failed to scrape %d parts of pages'
+        self.domain: Optional[str] = domain
         self.pages_crawled: int = 0
+        self.pages_skipped: int = 0
+        self.pages_copied: int = 0
+        self.responses: int = 0
+        self.bytes_downloaded: int = 0
+        # How many responses had each status code
+        self.status_counts: Dict[int, int] = {}
+        # How many responses had a latency no greater than each of config.LATENCY_BUCKETS (but greater than the one
+        # before), followed by how many were slower than all of them
+        self.latency_counts: List[int] = [0] * (len(config.LATENCY_BUCKETS) + 1)
+        self.latency_sum: float = 0.0
+        # How many times each part of a page couldn't be scraped
+        self.scrape_failures: Dict[str, int] = {}
         self.time_started: datetime = datetime.utcnow()
 
     def on_page_crawled(self):
         self.pages_crawled += 1
 
+    def on_page_skipped(self):
+        self.pages_skipped += 1
+
+    def on_page_copied(self):
+        self.pages_copied += 1
+
+    def on_response(self, status: int, size: int, latency: Optional[float]):
+        self.responses += 1
+        self.bytes_downloaded += size
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if latency is not None:
+            self.latency_counts[bisect_left(config.LATENCY_BUCKETS, latency)] += 1
+            self.latency_sum += latency
+
+    def on_scrape_failed(self, part: str):
+        self.scrape_failures[part] = self.scrape_failures.get(part, 0) + 1
+
     def log_stats(self, now: datetime, logger: Logger):
-        elapsed = (now - self.time_started).total_seconds()
+        elapsed = self._get_elapsed(now)
         avg = self.pages_crawled / (elapsed if (elapsed != 0) else 1.0)
+        mb_downloaded = self.bytes_downloaded / (1024 * 1024)
+        avg_mb = mb_downloaded / (elapsed if (elapsed != 0) else 1.0)
+
+        logger.info(self.fmt % (self.pages_crawled, elapsed, avg, self.responses, mb_downloaded, avg_mb,
+                                self.pages_skipped, self.pages_copied, sum(self.scrape_failures.values())))
+
+    def to_json_obj(self, now: datetime) -> Dict[str, object]:
+        latency_buckets = {str(bound): count
+                           for (bound, count) in zip(config.LATENCY_BUCKETS, self._cumulate_latency())}
+        latency_buckets['+Inf'] = sum(self.latency_counts)
+        return {
+            'elapsed': self._get_elapsed(now),
+            'pages_crawled': self.pages_crawled,
+            'pages_skipped': self.pages_skipped,
+            'pages_copied': self.pages_copied,
+            'responses': self.responses,
+            'bytes_downloaded': self.bytes_downloaded,
+            'status_counts': {str(status): count for (status, count) in sorted(self.status_counts.items())},
+            'latency_buckets': latency_buckets,
+            'latency_sum': self.latency_sum,
+            'scrape_failures': dict(sorted(self.scrape_failures.items()))
+        }
+
+    def add_prometheus_samples(self, samples: Dict[str, List[str]]):
+        """
+        Adds a sample of each metric for this domain to the given samples of each metric
+        """
+        labels = {'domain': self.domain}
+        samples['webweeder_pages_crawled_total'].append(
+            _prometheus_sample('webweeder_pages_crawled_total', labels, self.pages_crawled))
+        samples['webweeder_pages_skipped_total'].append(
+            _prometheus_sample('webweeder_pages_skipped_total', labels, self.pages_skipped))
+        samples['webweeder_pages_copied_total'].append(
+            _prometheus_sample('webweeder_pages_copied_total', labels, self.pages_copied))
+        for (status, count) in sorted(self.status_counts.items()):
+            samples['webweeder_responses_total'].append(
+                _prometheus_sample('webweeder_responses_total', dict(labels, status=str(status)), count))
+        samples['webweeder_downloaded_bytes_total'].append(
+            _prometheus_sample('webweeder_downloaded_bytes_total', labels, self.bytes_downloaded))
+        name = 'webweeder_download_latency_seconds'
+        for (bound, count) in zip(config.LATENCY_BUCKETS, self._cumulate_latency()):
+            samples[name].append(_prometheus_sample(name + '_bucket', dict(labels, le=str(bound)), count))
+        samples[name].append(_prometheus_sample(name + '_bucket', dict(labels, le='+Inf'), sum(self.latency_counts)))
+        samples[name].append(_prometheus_sample(name + '_sum', labels, self.latency_sum))
+        samples[name].append(_prometheus_sample(name + '_count', labels, sum(self.latency_counts)))
+        for (part, count) in sorted(self.scrape_failures.items()):
+            samples['webweeder_scrape_failures_total'].append(
+                _prometheus_sample('webweeder_scrape_failures_total', dict(labels, part=part), count))
+
+    def _cumulate_latency(self) -> List[int]:
+        """
+        :return: How many responses had a latency no greater than each of config.LATENCY_BUCKETS
+        """
+        cumulative: List[int] = []
+        total = 0
+        for count in self.latency_counts[:-1]:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def _get_elapsed(self, now: datetime) -> float:
+        return (now - self.time_started).total_seconds()
+
+
+class StatsForwarder:
+    """
+    Stands in for the StatsMonitor in a crawling worker process, forwarding each event to the StatsMonitor of the
+    coordinating process as a (method name, arguments) tuple
+    """
+
+    def __init__(self, queue):
+        """
+        :param queue: A multiprocessing queue which the coordinating process reads events from
+        """
+        self._queue = queue
+
+    def on_page_crawled(self, domain: str):
+        self._queue.put(('on_page_crawled', (domain,)))
+
+    def on_page_skipped(self, domain: str):
+        self._queue.put(('on_page_skipped', (domain,)))
+
+    def on_page_copied(self, domain: str):
+        self._queue.put(('on_page_copied', (domain,)))
+
+    def on_response(self, domain: str, status: int, size: int, latency: Optional[float]):
+        self._queue.put(('on_response', (domain, status, size, latency)))
+
+    def on_scrape_failed(self, domain: str, part: str):
+        self._queue.put(('on_scrape_failed', (domain, part)))
+
+    def on_queue_depth(self, spider: str, pid: int, depth: int):
+        self._queue.put(('on_queue_depth', (spider, pid, depth)))
+
+    def on_spider_closed(self, domains: List[str], reason: str):
+        self._queue.put(('on_spider_closed', (domains, reason)))
+
 
-        logger.info(self.fmt % (self.pages_crawled, elapsed, avg))
+def _prometheus_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    label_strs = ['%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                  for (k, v) in labels.items()]
+    return '%s{%s} %s' % (name, ','.join(label_strs), value)
@@ -0,0 +1,204 @@
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import config
+from webweeder import configutils
+from webweeder import segments
+from webweeder.models import PageMetadata, page_metadata_from_json, page_metadata_to_json
+from webweeder.segments import SegmentLocator, SegmentWriter, compress_payload
+from webweeder.utils import compressed_file_name, write_text_file
+from webweeder.weeders.monster import MonsterWeeder, fingerprint_page
+
+STORAGE_DIRECTORY = 'directory'
+STORAGE_SEGMENTS = 'segments'
+STORAGE_BACKENDS = [STORAGE_DIRECTORY, STORAGE_SEGMENTS]
+
+# Where segments are kept, relative to the output directory
+SEGMENTS_DIRECTORY_NAME = 'segments'
+# Segments containing page metadata and raw HTML, written when crawling
+PAGE_SEGMENT_PREFIX = 'pages'
+# Segments containing page metadata and plaintext articles, written when weeding
+PLAINTEXT_SEGMENT_PREFIX = 'plaintext'
+
+
+class PageStore:
+    """
+    Implementations must allow store_page() to be called from several threads at once
+    """
+
+    def store_page(self, meta: PageMetadata, raw_html: str, plaintext: Optional[str] = None):
+        """
+        :param plaintext: The page's article, if it was extracted while crawling, or None if it's left for the weeder
+        """
+        raise NotImplementedError
+
+    def touch_page(self, meta: PageMetadata):
+        """
+        Updates the stored metadata of a page which was crawled again but hadn't changed. Does nothing if the store
+        can't update metadata in-place, in which case the catalog is the only record of the update
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class DirectoryPageStore(PageStore):
+    """
+    Stores each page in its own directory, as separate metadata and raw HTML files
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir: str = base_dir
+
+    def store_page(self, meta: PageMetadata, raw_html: str, plaintext: Optional[str] = None):
+        # Metadata is never compressed so it stays readable, and it records the actual name of the raw HTML file
+        meta.file_raw_html = compressed_file_name(meta.file_raw_html, config.COMPRESSION)
+        meta_json = page_metadata_to_json(meta, pretty=(not config.COMPACT_METADATA))
+        write_text_file(os.path.join(self.base_dir, meta.directory, meta.file_metadata), meta_json)
+        write_text_file(os.path.join(self.base_dir, meta.directory, meta.file_raw_html), raw_html,
+                        compression=config.COMPRESSION)
+        if plaintext is not None:
+            # Written exactly as the weeder would, so incremental weeding knows it doesn't need to weed the page again
+            domain = configutils.get_config_for_domain(meta.domain)
+            MonsterWeeder().write_plaintext(self.base_dir, meta, plaintext, fingerprint_page(raw_html, domain))
+
+    def touch_page(self, meta: PageMetadata):
+        meta_json = page_metadata_to_json(meta, pretty=(not config.COMPACT_METADATA))
+        write_text_file(os.path.join(self.base_dir, meta.directory, meta.file_metadata), meta_json)
+
+
+class SegmentPageStore(PageStore):
+    """
+    Appends each page as a compressed record to a series of large segment files, to avoid creating millions of tiny
+    files. The metadata still refers to the page's directory, although it's never created. Records are always
+    compressed, so config.COMPRESSION doesn't apply
+    """
+
+    def __init__(self, base_dir: str, prefix: str = PAGE_SEGMENT_PREFIX):
+        self.base_dir: str = base_dir
+        self._writer = SegmentWriter(get_segments_directory(base_dir), prefix, config.SEGMENT_MAX_BYTES)
+        # Only created once there's some plaintext to write, to avoid leaving empty plaintext segments lying around
+        self._plaintext_writer: Optional[SegmentWriter] = None
+        self._lock = threading.Lock()
+
+    def store_page(self, meta: PageMetadata, raw_html: str, plaintext: Optional[str] = None):
+        # Compress outside the lock, so pages stored from several threads are compressed in parallel
+        payload = compress_payload(encode_page_record(meta, raw_html))
+        plaintext_payload = compress_payload(encode_page_record(meta, plaintext)) if (plaintext is not None) else None
+        with self._lock:
+            self._writer.append(meta.url, payload, is_compressed=True)
+            if plaintext_payload is not None:
+                if self._plaintext_writer is None:
+                    self._plaintext_writer = SegmentWriter(get_segments_directory(self.base_dir),
+                                                           PLAINTEXT_SEGMENT_PREFIX, config.SEGMENT_MAX_BYTES)
+                self._plaintext_writer.append(meta.url, plaintext_payload, is_compressed=True)
+
+    def close(self):
+        with self._lock:
+            self._writer.close()
+            if self._plaintext_writer is not None:
+                self._plaintext_writer.close()
+
+
+def open_page_store(backend: str, base_dir: str) -> PageStore:
+    """
+    :param backend: One of STORAGE_BACKENDS
+    :param base_dir: The output directory
+    """
+    if backend == STORAGE_DIRECTORY:
+        return DirectoryPageStore(base_dir)
+    if backend == STORAGE_SEGMENTS:
+        return SegmentPageStore(base_dir)
+    raise ValueError('Unknown storage backend: %s' % backend)
+
+
+def get_segments_directory(base_dir: str) -> str:
+    return os.path.join(base_dir, SEGMENTS_DIRECTORY_NAME)
+
+
+def encode_page_record(meta: PageMetadata, content: str) -> bytes:
+    """
+    :param content: Either the page's raw HTML or its plaintext article, depending on what kind of segment the record
+    is destined for
+    """
+    return (page_metadata_to_json(meta, pretty=False) + '\n' + content).encode('utf8')
+
+
+def decode_page_record(payload: bytes) -> Tuple[PageMetadata, str]:
+    """
+    :return: The metadata and content of a record which was encoded using encode_page_record()
+    """
+    (meta_json, content) = payload.decode('utf8').split('\n', 1)
+    return page_metadata_from_json(meta_json), content
+
+
+def find_segments(base_dir: str, prefix: str) -> List[str]:
+    """
+    :return: Paths of every segment of the given kind, oldest first
+    """
+    return segments.find_segments(get_segments_directory(base_dir), prefix)
+
+
+def iter_segment_payloads(base_dir: str, prefix: str, decompress: bool = True) -> Iterator[bytes]:
+    """
+    Reads every record of the given kind sequentially, oldest first
+    """
+    for segment_path in find_segments(base_dir, prefix):
+        for (_, payload) in segments.iter_records(segment_path, decompress=decompress):
+            yield payload
+
+
+def iter_latest_segment_payloads(base_dir: str, prefix: str, decompress: bool = True) -> Iterator[Tuple[str, bytes]]:
+    """
+    Like iter_segment_payloads(), but only reads the most recently stored record for each URL, so older copies of a
+    page (eg. from before it was crawled again) are skipped
+    :return: The URL of each record, along with the record
+    """
+    latest = {(locator.segment_path, locator.offset): url
+              for (url, locator) in load_segment_index(base_dir, prefix).items()}
+    for segment_path in find_segments(base_dir, prefix):
+        for (locator, payload) in segments.iter_records(segment_path, decompress=decompress):
+            url = latest.get((locator.segment_path, locator.offset))
+            if url is not None:
+                yield url, payload
+
+
+def iter_segment_pages(base_dir: str, prefix: str = PAGE_SEGMENT_PREFIX) -> Iterator[Tuple[PageMetadata, str]]:
+    for payload in iter_segment_payloads(base_dir, prefix):
+        yield decode_page_record(payload)
+
+
+def load_segment_index(base_dir: str, prefix: str = PAGE_SEGMENT_PREFIX) -> Dict[str, SegmentLocator]:
+    """
+    :return: Where to find the most recently stored record for each URL, so individual pages can be read with
+    read_segment_page() without scanning every segment
+    """
+    index: Dict[str, SegmentLocator] = {}
+    for segment_path in find_segments(base_dir, prefix):
+        for (url, locator) in segments.iter_index(segment_path):
+            index[url] = locator
+    return index
+
+
+def read_segment_page(locator: SegmentLocator) -> Tuple[PageMetadata, str]:
+    return decode_page_record(segments.read_record(locator))
+
+
+def delete_segments(base_dir: str, prefix: str, segment_paths: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Removes every segment of the given kind, along with their indexes
+    :param segment_paths: If given, only these segments (as returned by find_segments()) are removed
+    :return: Paths of the removed segments
+    """
+    if segment_paths is None:
+        removed = find_segments(base_dir, prefix)
+    else:
+        removed = [path for path in segment_paths if os.path.isfile(path)]
+    for segment_path in removed:
+        os.remove(segment_path)
+        index_path = segments.get_index_path(segment_path)
+        if os.path.isfile(index_path):
+            os.remove(index_path)
+    return removed
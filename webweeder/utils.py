@@ -1,7 +1,23 @@
+import gzip
 import json
 import os
 from datetime import date, datetime, timedelta
-from typing import List, Optional, Set
+from logging import getLogger
+from typing import Iterable, Iterator, List, Optional, Set
+
+from dateutil.parser import parse as parse_datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_logger = getLogger(__name__)
 
 BYTES: int = 1
 KILOBYTES: int = (1024 * BYTES)
@@ -9,6 +25,15 @@ MEGABYTES: int = (1024 * KILOBYTES)
 GIGABYTES: int = (1024 * MEGABYTES)
 TERABYTES: int = (1024 * GIGABYTES)
 
+COMPRESSION_NONE = 'none'
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+COMPRESSIONS = [COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZSTD]
+
+_COMPRESSION_EXTENSIONS = {COMPRESSION_NONE: '', COMPRESSION_GZIP: '.gz', COMPRESSION_ZSTD: '.zst'}
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
 
 def find_duplicates(test_list: List[object]) -> Set[object]:
     """
@@ -28,12 +53,99 @@ def date_range(start: date, end: date = date.today()) -> List[date]:
     :param end:
     :return: Every possible date between start and end, inclusive
     """
-    delta = (end - start)
-    return [(start + timedelta(days=i)) for i in range(delta.days + 1)]
+    return list(iter_dates(start, end))
+
+
+def iter_dates(start: date, end: date, reverse: bool = False) -> Iterator[date]:
+    """
+    Like date_range(), but lazily generates each date rather than building a list of all of them
+    :param reverse: Set to True to generate the dates newest first
+    """
+    days = (end - start).days + 1
+    for i in (range(days - 1, -1, -1) if reverse else range(days)):
+        yield start + timedelta(days=i)
+
+
+def parse_iso_datetime(dt_str: str) -> datetime:
+    """
+    Quickly parses a timestamp written by datetime.isoformat(), falling back to dateutil for anything else (eg. a
+    timestamp edited by hand)
+    """
+    try:
+        return datetime.fromisoformat(dt_str)
+    except ValueError:
+        return parse_datetime(dt_str)
+
+
+def to_compact_json(obj: object) -> str:
+    """
+    :return: The given object as JSON without any padding, written by "orjson" if it's installed, which is much quicker
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf8')
+    return json.dumps(obj, separators=(',', ':'), sort_keys=False)
+
+
+def from_json(json_str: str) -> object:
+    """
+    Like json.loads(), but uses "orjson" if it's installed
+    :raises ValueError: If the given string isn't valid JSON
+    """
+    if orjson is not None:
+        # orjson.JSONDecodeError is a ValueError, just like json's
+        return orjson.loads(json_str)
+    return json.loads(json_str)
+
+
+def round_robin(iterables: List[Iterable[object]]) -> Iterator[object]:
+    """
+    Lazily takes one item from each of the given iterables in turn, until they're all exhausted
+    """
+    iterators = [iter(iterable) for iterable in iterables]
+    while len(iterators) != 0:
+        remaining = []
+        for iterator in iterators:
+            try:
+                yield next(iterator)
+            except StopIteration:
+                continue
+            remaining.append(iterator)
+        iterators = remaining
+
+
+def resolve_compression(compression: str) -> str:
+    """
+    :param compression: One of COMPRESSIONS
+    :return: The given compression, or gzip if zstd was requested but the "zstandard" package isn't installed
+    """
+    if (compression == COMPRESSION_ZSTD) and (zstandard is None):
+        _logger.warning('zstd compression requested but the "zstandard" package isn\'t installed, using gzip instead')
+        return COMPRESSION_GZIP
+    return compression
+
+
+def compressed_file_name(file_name: str, compression: str) -> str:
+    """
+    :return: The name a file should be given when it's compressed with the given compression, eg. "raw.html.gz"
+    """
+    return file_name + _COMPRESSION_EXTENSIONS[compression]
+
+
+def find_compressed_file(file_path: str) -> Optional[str]:
+    """
+    :param file_path: Path of the file as if it was uncompressed
+    :return: Path of the file if it exists, either uncompressed or with any supported compression, or None if it doesn't
+    exist at all
+    """
+    for extension in _COMPRESSION_EXTENSIONS.values():
+        if os.path.isfile(file_path + extension):
+            return file_path + extension
+    return None
 
 
 def read_text_file(file_path: str, missing_ok: bool = True) -> Optional[str]:
     """
+    Files compressed by write_text_file() are decompressed transparently, regardless of their name
     :param file_path:
     :param missing_ok: If the file doesn't exist and this is set to True, the None will be returned. Otherwise, a
     FileNotFoundError will be thrown.
@@ -42,22 +154,45 @@ def read_text_file(file_path: str, missing_ok: bool = True) -> Optional[str]:
     if missing_ok:
         if not os.path.isfile(file_path):
             return None
-    with open(file_path, 'r', encoding='utf8') as file:
-        return file.read()
+    with open(file_path, 'rb') as file:
+        content = file.read()
 
+    if content.startswith(_GZIP_MAGIC):
+        content = gzip.decompress(content)
+    elif content.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError('The "zstandard" package must be installed to read: %s' % file_path)
+        content = zstandard.ZstdDecompressor().decompressobj().decompress(content)
+    # Behave the same as reading in text mode, which translates all line endings
+    return content.decode('utf8').replace('\r\n', '\n').replace('\r', '\n')
 
-def write_text_file(file_path: str, content: str, create_parents: bool = True):
+
+def write_text_file(file_path: str, content: str, create_parents: bool = True, compression: str = COMPRESSION_NONE):
     """
     :param file_path:
     :param content:
     :param create_parents: If the file's parent directory doesn't exist and this is set to True, it will be created.
     Otherwise, a FileNotFoundError will be thrown.
+    :param compression: One of COMPRESSIONS. The file path is used as-is, so use compressed_file_name() to get a
+    sensible one
     :return:
     """
     if create_parents:
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w', encoding='utf8') as file:
-        file.write(content)
+    if compression == COMPRESSION_NONE:
+        with open(file_path, 'w', encoding='utf8') as file:
+            file.write(content)
+        return
+
+    data = content.encode('utf8')
+    if compression == COMPRESSION_GZIP:
+        data = gzip.compress(data, compresslevel=6)
+    elif compression == COMPRESSION_ZSTD:
+        data = zstandard.ZstdCompressor().compress(data)
+    else:
+        raise ValueError('Unknown compression: %s' % compression)
+    with open(file_path, 'wb') as file:
+        file.write(data)
 
 
 def delete_directory(dir_path: str, preserve_dir: bool = False, missing_ok: bool = True):
@@ -85,3 +220,12 @@ def delete_directory(dir_path: str, preserve_dir: bool = False, missing_ok: bool
 
     if not preserve_dir:
         os.rmdir(dir_path)
+
+
+def delete_empty_directories(dir_path: str):
+    """
+    Removes every empty directory inside the specified directory, recursively. The specified directory is preserved
+    """
+    for (parent, _, _) in os.walk(dir_path, topdown=False):
+        if (parent != dir_path) and (len(os.listdir(parent)) == 0):
+            os.rmdir(parent)
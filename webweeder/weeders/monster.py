@@ -1,73 +1,135 @@
+import hashlib
 import os
-from typing import Iterable, List, Optional
-
-from bs4 import BeautifulSoup
+from typing import Iterator, List, Optional
 
 import config
 from webweeder import configutils
+from webweeder import profiling
 from webweeder import utils
 from webweeder.domainconfig import DomainConfig
+from webweeder.extraction import PARSER_LXML_FAST
 from webweeder.models import PageMetadata, page_metadata_from_json
 
+# Stored alongside each weeded page when weeding incrementally, so we can tell whether it needs to be weeded again
+FINGERPRINT_FILE_NAME = 'weed_fingerprint.txt'
+
+# Bump this whenever a change to the extraction code would produce different plaintext, to invalidate all fingerprints
+_EXTRACTION_VERSION = 2
+
 
 class MonsterWeeder:
-    def find_page_metadatas(self, directory: str) -> Iterable[str]:
+    def find_page_metadatas(self, directory: str) -> List[str]:
         """
         :param directory: Where to look for metadata files
-        :return: List of paths for the metadata files of each found page in the given directory, recursively
+        :return: Sorted list of paths for the metadata files of each found page in the given directory, recursively
         """
-        found_pages: List[str] = []
-        for item_name in os.listdir(directory):
-            item_path = os.path.join(directory, item_name)
-            if os.path.isfile(item_path):
-                if item_name == 'metadata.json':
-                    found_pages.append(item_path)
-            elif os.path.isdir(item_path):
-                found_pages += self.find_page_metadatas(item_path)
-            else:
-                raise TypeError('Not a file or a directory: %s' % item_path)
-        return found_pages
-
-    def weed_page(self, base_dir: str, metadata_path: str):
+        return sorted(self.iter_page_metadatas(directory))
+
+    def iter_page_metadatas(self, directory: str) -> Iterator[str]:
+        """
+        Like find_page_metadatas(), but yields each page as soon as it's found, in no particular order. Avoids holding
+        every path in memory, and avoids a separate stat call for each directory entry on most platforms
+        :param directory: Where to look for metadata files
+        """
+        with os.scandir(directory) as entries:
+            subdirectories: List[str] = []
+            for entry in entries:
+                if entry.is_file():
+                    if entry.name == 'metadata.json':
+                        yield entry.path
+                elif entry.is_dir():
+                    subdirectories.append(entry.path)
+                else:
+                    raise TypeError('Not a file or a directory: %s' % entry.path)
+        # Recurse only after the scandir() handle is closed, so deep trees don't exhaust file handles
+        for subdirectory in subdirectories:
+            yield from self.iter_page_metadatas(subdirectory)
+
+    def weed_page(self, base_dir: str, metadata_path: str, incremental: bool = False) -> bool:
         """
         :param base_dir: Top-level directory containing the raw HTML and plaintext files referred to by the metadata
         :param metadata_path: Full path to the metadata (i.e. already joined to base_dir)
+        :param incremental: If True, the page is skipped if its plaintext was produced from the same raw HTML using
+        the same extraction settings as now
+        :return: True if the page was weeded, or False if it was skipped because its plaintext is already up to date
+        """
+        with profiling.stage(profiling.STAGE_READ) as timer:
+            # Read and parse metadata
+            meta: PageMetadata = page_metadata_from_json(utils.read_text_file(metadata_path, missing_ok=False))
+            profiling.set_domain(meta.domain)
+            domain = self._get_domain_config(meta, metadata_path)
+
+            # Read raw HTML for the page
+            raw_html_path = os.path.join(base_dir, meta.directory, meta.file_raw_html)
+            raw_html = utils.read_text_file(raw_html_path, missing_ok=False)
+            timer.count_bytes(raw_html)
+
+        plaintext_path = os.path.join(base_dir, meta.directory, meta.file_article_plaintext)
+        with profiling.stage(profiling.STAGE_FINGERPRINT):
+            fingerprint = fingerprint_page(raw_html, domain)
+            if incremental and (utils.find_compressed_file(plaintext_path) is not None):
+                fingerprint_path = os.path.join(base_dir, meta.directory, FINGERPRINT_FILE_NAME)
+                if utils.read_text_file(fingerprint_path) == fingerprint:
+                    return False
+
+        plaintext = self._extract_plaintext(raw_html, domain)
+        with profiling.stage(profiling.STAGE_WRITE) as timer:
+            timer.count_bytes(plaintext)
+            self.write_plaintext(base_dir, meta, plaintext, fingerprint)
+        return True
+
+    def weed_html(self, meta: PageMetadata, raw_html: str) -> Optional[str]:
+        """
+        Like weed_page(), but for a page which has already been read into memory (eg. from a segment), so nothing is
+        read or written
+        :return: The plaintext of the page's article
         """
-        # Read and parse metadata
-        meta: PageMetadata = page_metadata_from_json(utils.read_text_file(metadata_path, missing_ok=False))
+        profiling.set_domain(meta.domain)
+        domain = self._get_domain_config(meta, meta.url)
+        return self._extract_plaintext(raw_html, domain)
+
+    @staticmethod
+    def _get_domain_config(meta: PageMetadata, page: str) -> DomainConfig:
         domain = configutils.get_config_for_domain(meta.domain)
         if domain is None:
-            msg = 'No configuration found for domain "%s" while weeding page: %s' % (meta.domain, metadata_path)
+            msg = 'No configuration found for domain "%s" while weeding page: %s' % (meta.domain, page)
             raise RuntimeError(msg)
+        return domain
 
-        # Read raw HTML for the page
-        raw_html_path = os.path.join(base_dir, meta.directory, meta.file_raw_html)
-        raw_html = utils.read_text_file(raw_html_path, missing_ok=False)
-
-        # Parse HTML and extract plaintext from article
-        soup = BeautifulSoup(raw_html, config.HTML_PARSER)
-        plaintext = self._extract_article_content(soup, domain)
-
-        # Write plaintext to metadata_path
+    def write_plaintext(self, base_dir: str, meta: PageMetadata, plaintext: Optional[str], fingerprint: str):
+        """
+        Writes the plaintext of a page stored in its own directory, along with the fingerprint used by incremental
+        weeding, replacing any plaintext which was written with a different compression
+        :param fingerprint: As returned by fingerprint_page()
+        """
         plaintext_path = os.path.join(base_dir, meta.directory, meta.file_article_plaintext)
-        utils.write_text_file(plaintext_path, plaintext, create_parents=True)
+        existing_plaintext_path = utils.find_compressed_file(plaintext_path)
+        compressed_plaintext_path = utils.compressed_file_name(plaintext_path, config.COMPRESSION)
+        if (existing_plaintext_path is not None) and (existing_plaintext_path != compressed_plaintext_path):
+            os.remove(existing_plaintext_path)
+        utils.write_text_file(compressed_plaintext_path, plaintext, create_parents=True,
+                              compression=config.COMPRESSION)
+        utils.write_text_file(os.path.join(base_dir, meta.directory, FINGERPRINT_FILE_NAME), fingerprint,
+                              create_parents=True)
 
     @staticmethod
-    def _extract_article_content(soup: BeautifulSoup, domain: DomainConfig) -> Optional[str]:
-        # TODO: Similar to DomainConfig.scrape_* methods, refactor needed?
-        """
-        IMPORTANT: This modifies the passed soup
+    def _extract_plaintext(raw_html: str, domain: DomainConfig) -> Optional[str]:
+        # Parse HTML and extract plaintext from article
+        with profiling.stage(profiling.STAGE_PARSE) as timer:
+            timer.count_bytes(raw_html)
+            soup = domain.parse_html(raw_html, config.HTML_PARSER)
+        return domain.scrape_article_content(soup)
 
-        If configured selector is None, None is returned
-        If configured selector is not None, the scraped article content is returned
-        If configured selector is not None but the article content cannot be scraped, an error is raised
-        """
-        if domain.article_content_selector is None:
-            return None
-        for crap in soup.find_all(name='script'):
-            crap.extract()
-        for crap in soup.find_all(name='style'):
-            crap.extract()
-        element = soup.select_one(domain.article_content_selector)
-        text = element.get_text()
-        return text.strip()
+
+def fingerprint_page(raw_html: str, domain: DomainConfig) -> str:
+    """
+    :return: A digest of everything which affects the plaintext extracted from a page. Only settings which are used by
+    the extraction are included, so changing eg. a domain's title selector doesn't invalidate its pages
+    """
+    digest = hashlib.sha1()
+    # Both parsers extract exactly the same text
+    parser = 'lxml' if (config.HTML_PARSER == PARSER_LXML_FAST) else config.HTML_PARSER
+    settings = (_EXTRACTION_VERSION, parser, domain.article_content_selector)
+    digest.update(repr(settings).encode('utf8'))
+    digest.update(raw_html.encode('utf8'))
+    return digest.hexdigest()